@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Service, Asset, IncomingIoTData
+from .models import (
+    Service, Asset, IncomingIoTData, AssetRollup1s, AssetRollup1m, AssetRollup1h, AlertRule, AlertEvent
+)
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
@@ -22,4 +24,30 @@ class IncomingIoTDataAdmin(admin.ModelAdmin):
     list_filter = ['processed', 'received_at']
     readonly_fields = ['received_at']
     date_hierarchy = 'received_at'
-    list_per_page = 25
\ No newline at end of file
+    list_per_page = 25
+
+@admin.register(AssetRollup1s, AssetRollup1m, AssetRollup1h)
+class AssetRollupAdmin(admin.ModelAdmin):
+    list_display = ['service', 'asset_id', 'bucket', 'sample_count', 'min_value', 'max_value', 'last_value']
+    list_filter = ['service']
+    search_fields = ['asset_id', 'service__name']
+    date_hierarchy = 'bucket'
+    list_per_page = 50
+
+@admin.register(AlertRule)
+class AlertRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'service', 'asset_id', 'rule_type', 'operator', 'threshold', 'duration_seconds', 'severity', 'enabled']
+    list_filter = ['rule_type', 'severity', 'enabled', 'service']
+    list_editable = ['enabled']
+    search_fields = ['name', 'asset_id', 'service__name']
+    readonly_fields = ['created_at', 'updated_at']
+    list_per_page = 50
+
+@admin.register(AlertEvent)
+class AlertEventAdmin(admin.ModelAdmin):
+    list_display = ['rule', 'state', 'value', 'triggered_at', 'message']
+    list_filter = ['state', 'rule__severity', 'rule']
+    search_fields = ['rule__name', 'message']
+    readonly_fields = ['created_at']
+    date_hierarchy = 'triggered_at'
+    list_per_page = 50
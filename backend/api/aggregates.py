@@ -0,0 +1,368 @@
+# aggregates.py - Dashboard summaries maintained incrementally from live updates
+from django.conf import settings
+from django.db import DatabaseError, connection
+from datetime import datetime, timezone
+import json
+import threading
+import zlib
+
+from .ingest import parse_asset_timestamp
+from .models import AssetRollup1m
+from .snapshot_cache import CachedSnapshot
+
+# ==================== CONFIGURATION ====================
+# Power readings (kW) integrated into energy, per service
+DASHBOARD_POWER_ASSETS = getattr(settings, 'IOT_DASHBOARD_POWER_ASSETS', {
+    'modbus': ['Hoist_power', 'Ct_power', 'Lt_power'],
+})
+DASHBOARD_LOAD_SERVICE = getattr(settings, 'IOT_DASHBOARD_LOAD_SERVICE', 'LoadCell')
+DASHBOARD_OPERATION_SERVICE = getattr(settings, 'IOT_DASHBOARD_OPERATION_SERVICE', 'onboard_io')
+# Power readings further apart than this are not integrated across (outage)
+DASHBOARD_MAX_GAP_SECONDS = getattr(settings, 'IOT_DASHBOARD_MAX_GAP_SECONDS', 300)
+DEFAULT_CAPACITY = 10000
+
+# onboard_io datapoints whose 0 -> 1 edge starts an operation
+OPERATION_DATAPOINTS = {
+    'Hoist_Up': 'hoist-up',
+    'Hoist_Down': 'hoist-down',
+    'Ct_Left': 'ct-left',
+    'Ct_Right': 'ct-right',
+    'Lt_Forward': 'lt-forward',
+    'Lt_Reverse': 'lt-reverse',
+}
+LOAD_STATUSES = ('normal', 'warning', 'overload')
+
+SECTIONS = ('summary', 'services', 'energy', 'load', 'operations')
+# Sections counting only the updates this worker has seen since it started
+PER_PROCESS_SECTIONS = ('services', 'operations')
+
+def _number(value):
+    try:
+        return float(str(value))
+    except (TypeError, ValueError):
+        return None
+
+def _isoformat(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+def load_status(load, capacity):
+    """Same bands as the Load page: >95% overload, >80% warning"""
+    if load <= 0:
+        return 'no_data'
+    percentage = load / capacity * 100 if capacity > 0 else 0
+    if percentage > 95:
+        return 'overload'
+    if percentage > 80:
+        return 'warning'
+    return 'normal'
+
+# ==================== AGGREGATES ====================
+
+class DashboardAggregates:
+    """
+    Running summaries for the dashboard pages, updated by a live-state
+    listener so each update costs work proportional to its services (plus
+    its power, load and operation datapoints) and no page ever needs the
+    full asset set:
+
+    - services:   per-service update/reading counts and asset totals
+    - energy:     current kW per power asset, and kWh integrated over sample
+                  time with the trapezoidal rule (today and since start)
+    - load:       current load against capacity, peak, mean utilisation and
+                  readings per load band
+    - operations: 0 -> 1 edges of the onboard_io motion datapoints, by type
+                  and by the load band they started in
+
+    Each section has its own version, and its JSON body is encoded at
+    most once per version for the cacheable endpoints. Energy and load
+    are seeded from the day's 1m rollups (seed_from_rollups), so they
+    survive a worker recycle; services and operations cover the updates
+    this worker has seen since it started, and the response says so.
+    """
+    def __init__(self, power_assets=None, load_service=None, operation_service=None, max_gap_seconds=None):
+        self.power_assets = {
+            service_name: set(asset_ids)
+            for service_name, asset_ids in (power_assets or DASHBOARD_POWER_ASSETS).items()
+        }
+        self.load_service = load_service or DASHBOARD_LOAD_SERVICE
+        self.operation_service = operation_service or DASHBOARD_OPERATION_SERVICE
+        self.max_gap_seconds = max_gap_seconds or DASHBOARD_MAX_GAP_SECONDS
+        self._lock = threading.Lock()
+        self._started = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+        self._versions = dict.fromkeys(SECTIONS[1:], 0)
+        self._encoded = {}
+        self._seeded_since = None
+        self._seeded_kwh = {}
+
+        self._services = {}
+        self._power = {}  # (service, asset id) -> {'kw', 'kwh', 'time'}
+        self._energy_kwh = 0.0
+        self._energy_today_kwh = 0.0
+        self._energy_day = None
+        self._load = {
+            'current_load': 0.0, 'capacity': float(DEFAULT_CAPACITY), 'percentage': 0.0,
+            'status': 'no_data', 'swing_angle': 0.0, 'max_load': 0.0, 'timestamp': None
+        }
+        self._load_percentage_sum = 0.0
+        self._load_readings = dict.fromkeys(LOAD_STATUSES, 0)
+        self._operation_values = {}
+        self._operations = dict.fromkeys(OPERATION_DATAPOINTS.values(), 0)
+        self._operations_by_status = dict.fromkeys(LOAD_STATUSES + ('no_data',), 0)
+        self._last_operation = None
+
+    def on_update(self, version, timestamp, services_data, changes, removed):
+        """Live-state listener"""
+        self.record(services_data, timestamp)
+
+    def record(self, services_data, timestamp=None):
+        with self._lock:
+            for service in services_data:
+                service_name = service.get('name')
+                assets = service.get('assets', [])
+                if not isinstance(assets, list):
+                    continue
+                totals = self._services.get(service_name)
+                if totals is None:
+                    totals = self._services[service_name] = {'assets': 0, 'updates': 0, 'readings': 0, 'last_update': None}
+                totals['assets'] = len(assets)
+                totals['updates'] += 1
+                totals['readings'] += len(assets)
+                totals['last_update'] = timestamp
+                self._versions['services'] += 1
+
+                if service_name in self.power_assets:
+                    self._record_power(service_name, assets)
+                if service_name == self.load_service:
+                    self._record_load(assets)
+                if service_name == self.operation_service:
+                    self._record_operations(assets)
+
+    def _record_power(self, service_name, assets):
+        asset_ids = self.power_assets[service_name]
+        for asset in assets:
+            if asset.get('id') not in asset_ids:
+                continue
+            kw = _number(asset.get('value'))
+            if kw is None:
+                continue
+            sample_time = parse_asset_timestamp(asset.get('timestamp')).timestamp()
+            key = (service_name, asset.get('id'))
+            state = self._power.get(key)
+            if state is None:
+                state = self._power[key] = {'kw': kw, 'kwh': self._seeded_kwh.get(key, 0.0), 'time': sample_time}
+            elif sample_time > state['time']:
+                elapsed = sample_time - state['time']
+                if elapsed <= self.max_gap_seconds:
+                    kwh = (state['kw'] + kw) / 2 * elapsed / 3600
+                    state['kwh'] += kwh
+                    self._energy_kwh += kwh
+                    day = datetime.fromtimestamp(sample_time, timezone.utc).date()
+                    if day != self._energy_day:
+                        self._energy_day = day
+                        self._energy_today_kwh = 0.0
+                    self._energy_today_kwh += kwh
+                state['kw'] = kw
+                state['time'] = sample_time
+            else:
+                continue
+            self._versions['energy'] += 1
+
+    def _record_load(self, assets):
+        load = self._load
+        seen = False
+        for asset in assets:
+            asset_id = asset.get('id')
+            value = _number(asset.get('value'))
+            if value is None:
+                continue
+            if asset_id == 'Load':
+                load['current_load'] = value
+                load['timestamp'] = asset.get('timestamp')
+                seen = True
+            elif asset_id == 'Load_Capacity':
+                load['capacity'] = value or float(DEFAULT_CAPACITY)
+            elif asset_id == 'Load_Swing_Angle':
+                load['swing_angle'] = value
+        if not seen:
+            return
+        capacity = load['capacity']
+        load['percentage'] = load['current_load'] / capacity * 100 if capacity > 0 else 0.0
+        load['status'] = load_status(load['current_load'], capacity)
+        load['max_load'] = max(load['max_load'], load['current_load'])
+        if load['status'] in self._load_readings:
+            self._load_readings[load['status']] += 1
+            self._load_percentage_sum += load['percentage']
+        self._versions['load'] += 1
+
+    def _record_operations(self, assets):
+        for asset in assets:
+            operation = OPERATION_DATAPOINTS.get(asset.get('id'))
+            if operation is None:
+                continue
+            value = _number(asset.get('value'))
+            previous = self._operation_values.get(asset.get('id'), 0.0)
+            self._operation_values[asset.get('id')] = value
+            if previous == 0 and value == 1:
+                self._operations[operation] += 1
+                self._operations_by_status[self._load['status']] += 1
+                self._last_operation = {
+                    'operation': operation,
+                    'timestamp': asset.get('timestamp'),
+                    'load': self._load['current_load'],
+                    'load_status': self._load['status']
+                }
+                self._versions['operations'] += 1
+
+    # seeding -------------------------------------------------------------
+
+    def seed_from_rollups(self, now=None):
+        """
+        Add today's (UTC) stored readings to the energy and load figures from
+        the 1m rollups, so a recycled worker does not restart them from zero.
+        Each bucket's mean stands in for its readings: kW is held for the
+        minute, and a bucket's readings fall in the load band of its mean.
+        Returns the number of rollup rows read.
+        """
+        now = now or datetime.now(timezone.utc)
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = 0
+
+        energy = {}
+        for service_name, asset_ids in self.power_assets.items():
+            buckets = AssetRollup1m.objects.filter(
+                service__name=service_name, asset_id__in=asset_ids, bucket__gte=day_start
+            ).values_list('asset_id', 'sample_count', 'sum_value')
+            for asset_id, sample_count, sum_value in buckets.iterator():
+                key = (service_name, asset_id)
+                energy[key] = energy.get(key, 0.0) + sum_value / sample_count / 60
+                rows += 1
+
+        capacity = AssetRollup1m.objects.filter(
+            service__name=self.load_service, asset_id='Load_Capacity'
+        ).order_by('-bucket').values_list('last_value', flat=True).first() or float(DEFAULT_CAPACITY)
+        readings = dict.fromkeys(LOAD_STATUSES, 0)
+        percentage_sum, max_load, latest = 0.0, 0.0, None
+        buckets = AssetRollup1m.objects.filter(
+            service__name=self.load_service, asset_id='Load', bucket__gte=day_start
+        ).order_by('bucket').values_list('sample_count', 'sum_value', 'max_value', 'last_value', 'last_timestamp')
+        for sample_count, sum_value, max_value, last_value, last_timestamp in buckets.iterator():
+            status = load_status(sum_value / sample_count, capacity)
+            if status in readings:
+                readings[status] += sample_count
+                percentage_sum += sum_value / capacity * 100 if capacity > 0 else 0.0
+            max_load = max(max_load, max_value)
+            latest = (last_value, last_timestamp)
+            rows += 1
+
+        with self._lock:
+            self._seeded_since = day_start.isoformat().replace('+00:00', 'Z')
+            if energy:
+                self._seeded_kwh = energy
+                for key, kwh in energy.items():
+                    if key in self._power:
+                        self._power[key]['kwh'] += kwh
+                self._energy_kwh += sum(energy.values())
+                if self._energy_day in (None, day_start.date()):
+                    self._energy_day = day_start.date()
+                    self._energy_today_kwh += sum(energy.values())
+            if latest is not None:
+                load = self._load
+                for status, count in readings.items():
+                    self._load_readings[status] += count
+                self._load_percentage_sum += percentage_sum
+                load['max_load'] = max(load['max_load'], max_load)
+                if load['timestamp'] is None:
+                    load['capacity'] = capacity
+                    load['current_load'] = latest[0]
+                    load['timestamp'] = latest[1].isoformat().replace('+00:00', 'Z')
+                    load['percentage'] = latest[0] / capacity * 100 if capacity > 0 else 0.0
+                    load['status'] = load_status(latest[0], capacity)
+            self._versions['energy'] += 1
+            self._versions['load'] += 1
+        return rows
+
+    def seed_in_background(self):
+        """seed_from_rollups() on a daemon thread, leaving startup unblocked"""
+        def seed():
+            try:
+                self.seed_from_rollups()
+            except DatabaseError as e:
+                print(f"⚠️ Dashboard aggregates not seeded from rollups: {e}")
+            finally:
+                connection.close()
+        thread = threading.Thread(target=seed, daemon=True)
+        thread.start()
+        return thread
+
+    # sections ------------------------------------------------------------
+
+    def _section(self, name):
+        if name == 'services':
+            return {
+                'total_services': len(self._services),
+                'total_assets': sum(totals['assets'] for totals in self._services.values()),
+                'services': {service_name: dict(totals) for service_name, totals in self._services.items()}
+            }
+        if name == 'energy':
+            return {
+                'total_kw': round(sum(state['kw'] for state in self._power.values()), 3),
+                'energy_kwh': round(self._energy_kwh, 4),
+                'energy_today_kwh': round(self._energy_today_kwh, 4),
+                'day': self._energy_day.isoformat() if self._energy_day else None,
+                'assets': {
+                    f'{service_name}:{asset_id}': {
+                        'kw': state['kw'],
+                        'kwh': round(state['kwh'], 4),
+                        'timestamp': _isoformat(state['time'])
+                    }
+                    for (service_name, asset_id), state in self._power.items()
+                }
+            }
+        if name == 'load':
+            readings = sum(self._load_readings.values())
+            return {
+                **self._load,
+                'percentage': round(self._load['percentage'], 2),
+                'average_percentage': round(self._load_percentage_sum / readings, 2) if readings else 0.0,
+                'readings': dict(self._load_readings)
+            }
+        if name == 'operations':
+            return {
+                'total': sum(self._operations.values()),
+                'counts': dict(self._operations),
+                'by_load_status': dict(self._operations_by_status),
+                'last_operation': self._last_operation
+            }
+        raise KeyError(name)
+
+    def snapshot(self, name):
+        """(version, data) for one section; 'summary' combines all of them"""
+        with self._lock:
+            if name == 'summary':
+                return sum(self._versions.values()), {section: self._section(section) for section in SECTIONS[1:]}
+            return self._versions[name], self._section(name)
+
+    def encoded(self, name):
+        """CachedSnapshot of a section's response body, re-encoded only after it changed"""
+        with self._lock:
+            version = sum(self._versions.values()) if name == 'summary' else self._versions[name]
+            entry = self._encoded.get(name)
+            if entry is not None and entry.version == version:
+                return entry
+        version, data = self.snapshot(name)
+        body = json.dumps({
+            "success": True,
+            "section": name,
+            "since": self._started,
+            "seeded_since": None if name in PER_PROCESS_SECTIONS else self._seeded_since,
+            "per_process": [section for section in PER_PROCESS_SECTIONS if name in (section, 'summary')],
+            "data": data
+        }, separators=(',', ':')).encode('utf-8')
+        entry = CachedSnapshot(version, f'"{name}-{version:x}-{zlib.crc32(body):08x}"', body)
+        with self._lock:
+            self._encoded[name] = entry
+        return entry
+
+
+# Process-wide aggregates fed by the live-state listener in views
+dashboard_aggregates = DashboardAggregates()
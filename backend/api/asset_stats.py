@@ -0,0 +1,207 @@
+# asset_stats.py - Per-asset sample windows with rolling statistics
+from django.conf import settings
+from array import array
+from collections import deque
+from datetime import datetime, timezone
+import math
+import threading
+
+from .ingest import parse_asset_timestamp
+
+# ==================== CONFIGURATION ====================
+# Samples kept per asset, and optionally the span of sample time they may
+# cover (0 = limited by depth only)
+ASSET_STATS_DEPTH = getattr(settings, 'IOT_ASSET_STATS_DEPTH', 600)
+ASSET_STATS_WINDOW_SECONDS = getattr(settings, 'IOT_ASSET_STATS_WINDOW_SECONDS', 0)
+
+def _isoformat(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+# ==================== PER-ASSET WINDOW ====================
+
+class AssetWindow:
+    """
+    Ring buffer of one asset's most recent (timestamp, value) samples, bounded
+    by `depth` samples and, if set, by `window_seconds` of sample time.
+
+    Statistics are maintained as samples enter and leave, so reading them
+    is O(1): running sums (shifted by a reference value to limit
+    cancellation) give mean and standard deviation, and monotonic deques of
+    sample sequence numbers give min and max. The sums are recomputed from
+    the buffer once per `depth` evictions so rounding error cannot build up.
+    """
+    def __init__(self, depth=None, window_seconds=None):
+        self.depth = depth or ASSET_STATS_DEPTH
+        self.window_seconds = ASSET_STATS_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self._times = array('d')
+        self._values = array('d')
+        # Sequence numbers of the oldest retained sample and of the next one
+        self._start = 0
+        self._end = 0
+        self._shift = 0.0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._mins = deque()
+        self._maxs = deque()
+        self._evictions = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _value(self, sequence):
+        return self._values[sequence % self.depth]
+
+    def _time(self, sequence):
+        return self._times[sequence % self.depth]
+
+    def add(self, timestamp, value):
+        """Append a sample; repeated or out-of-order timestamps are ignored. Returns whether it was kept."""
+        if self._end > self._start and timestamp <= self._time(self._end - 1):
+            return False
+        if self._end == self._start:
+            self._shift = value
+        elif len(self) == self.depth:
+            self._evict()
+
+        index = self._end % self.depth
+        if index == len(self._values):
+            self._times.append(timestamp)
+            self._values.append(value)
+        else:
+            self._times[index] = timestamp
+            self._values[index] = value
+        sequence = self._end
+        self._end += 1
+
+        delta = value - self._shift
+        self._sum += delta
+        self._sum_sq += delta * delta
+        while self._mins and self._value(self._mins[-1]) >= value:
+            self._mins.pop()
+        self._mins.append(sequence)
+        while self._maxs and self._value(self._maxs[-1]) <= value:
+            self._maxs.pop()
+        self._maxs.append(sequence)
+
+        if self.window_seconds:
+            horizon = timestamp - self.window_seconds
+            while self._time(self._start) < horizon:
+                self._evict()
+        return True
+
+    def _evict(self):
+        sequence = self._start
+        delta = self._value(sequence) - self._shift
+        self._sum -= delta
+        self._sum_sq -= delta * delta
+        if self._mins[0] == sequence:
+            self._mins.popleft()
+        if self._maxs[0] == sequence:
+            self._maxs.popleft()
+        self._start += 1
+        self._evictions += 1
+        if self._evictions >= self.depth:
+            self._resum()
+
+    def _resum(self):
+        self._evictions = 0
+        if self._end == self._start:
+            self._sum = self._sum_sq = 0.0
+            return
+        self._shift = self._value(self._start)
+        deltas = [self._value(sequence) - self._shift for sequence in range(self._start, self._end)]
+        self._sum = math.fsum(deltas)
+        self._sum_sq = math.fsum(delta * delta for delta in deltas)
+
+    def stats(self):
+        """Count, mean, min, max, population stddev and rate of change (units/second) over the window"""
+        count = len(self)
+        if not count:
+            return {'count': 0}
+        mean_delta = self._sum / count
+        variance = max(self._sum_sq / count - mean_delta * mean_delta, 0.0)
+        first_time, last_time = self._time(self._start), self._time(self._end - 1)
+        first_value, last_value = self._value(self._start), self._value(self._end - 1)
+        return {
+            'count': count,
+            'mean': self._shift + mean_delta,
+            'min': self._value(self._mins[0]),
+            'max': self._value(self._maxs[0]),
+            'stddev': math.sqrt(variance),
+            'rate_per_second': (last_value - first_value) / (last_time - first_time) if last_time > first_time else None,
+            'last_value': last_value,
+            'first_timestamp': _isoformat(first_time),
+            'last_timestamp': _isoformat(last_time),
+            'span_seconds': last_time - first_time
+        }
+
+    def samples(self, limit=None):
+        """The newest `limit` samples (all by default) as [epoch ms, value], oldest first"""
+        start = self._start if limit is None else max(self._start, self._end - limit)
+        return [
+            [round(self._time(sequence) * 1000), self._value(sequence)]
+            for sequence in range(start, self._end)
+        ]
+
+# ==================== REGISTRY ====================
+
+class AssetStatsRegistry:
+    """
+    One AssetWindow per (service, asset id), fed from live-state updates so
+    every payload an asset appears in contributes a sample - however rarely
+    it reports relative to other assets. Non-numeric values are skipped.
+    """
+    def __init__(self, depth=None, window_seconds=None):
+        self.depth = depth or ASSET_STATS_DEPTH
+        self.window_seconds = ASSET_STATS_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def record(self, services_data):
+        """Add every numeric asset reading in a services list; returns the samples kept"""
+        added = 0
+        parsed = {}
+        with self._lock:
+            for service in services_data:
+                service_name = service.get('name')
+                for asset in service.get('assets', []):
+                    try:
+                        value = float(str(asset.get('value')))
+                    except (TypeError, ValueError):
+                        continue
+                    if math.isnan(value) or math.isinf(value):
+                        continue
+                    # Assets of one payload usually share a timestamp string
+                    raw_timestamp = asset.get('timestamp')
+                    timestamp = parsed.get(raw_timestamp)
+                    if timestamp is None:
+                        timestamp = parsed[raw_timestamp] = parse_asset_timestamp(raw_timestamp).timestamp()
+                    key = (service_name, str(asset.get('id')))
+                    window = self._windows.get(key)
+                    if window is None:
+                        window = self._windows[key] = AssetWindow(self.depth, self.window_seconds)
+                    added += window.add(timestamp, value)
+        return added
+
+    def on_update(self, version, timestamp, services_data, changes, removed):
+        """Live-state listener"""
+        self.record(services_data)
+
+    def stats(self, service_name, asset_id, samples=0):
+        """Statistics for one asset (plus its newest `samples` samples), or None if it was never seen"""
+        with self._lock:
+            window = self._windows.get((service_name, str(asset_id)))
+            if window is None:
+                return None
+            result = window.stats()
+            if samples:
+                result['samples'] = window.samples(samples)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._windows)
+
+
+# Process-wide registry fed by the live-state listener in views
+asset_stats = AssetStatsRegistry()
@@ -0,0 +1,126 @@
+# batch_ingest.py - Decoding of multi-payload ingest request bodies
+from django.conf import settings
+import io
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .ingest import extract_services
+
+# ==================== CONFIGURATION ====================
+BATCH_MAX_PAYLOADS = getattr(settings, 'IOT_BATCH_MAX_PAYLOADS', 5000)
+# Limit on the decompressed body, whatever the compressed size
+BATCH_MAX_DECODED_BYTES = getattr(settings, 'IOT_BATCH_MAX_DECODED_BYTES', 64 * 1024 * 1024)
+MAX_REPORTED_ERRORS = 10
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/jsonlines')
+JSON_TYPES = ('application/json',)
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+class BatchDecodeError(ValueError):
+    """Undecodable batch body; carries the HTTP status to answer with"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# ==================== DECOMPRESSION ====================
+
+def decompress(body, content_encoding):
+    """Undo a gzip/deflate/zstd Content-Encoding, refusing bodies that inflate past the limit"""
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        # wbits 47 auto-detects gzip and zlib headers
+        decompressor = zlib.decompressobj(47)
+        try:
+            data = decompressor.decompress(body, BATCH_MAX_DECODED_BYTES + 1)
+        except zlib.error as e:
+            raise BatchDecodeError(f"Invalid {encoding} body: {e}")
+    elif encoding == 'zstd':
+        if zstandard is None:
+            raise BatchDecodeError("zstd bodies need the 'zstandard' package", status=415)
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                data = reader.read(BATCH_MAX_DECODED_BYTES + 1)
+        except zstandard.ZstdError as e:
+            raise BatchDecodeError(f"Invalid zstd body: {e}")
+    else:
+        raise BatchDecodeError(f"Unsupported Content-Encoding: {encoding}", status=415)
+    if len(data) > BATCH_MAX_DECODED_BYTES:
+        raise BatchDecodeError(f"Decoded body exceeds {BATCH_MAX_DECODED_BYTES} bytes", status=413)
+    return data
+
+# ==================== PAYLOAD DECODING ====================
+
+def _as_payload_list(decoded):
+    """A JSON/MessagePack document is either one payload or an array of them"""
+    if isinstance(decoded, dict):
+        return [decoded]
+    if isinstance(decoded, list):
+        return decoded
+    raise BatchDecodeError("Body must be a payload object or an array of payloads")
+
+def decode_batch(body, content_type, content_encoding=None):
+    """
+    Decode a batch body into (payloads, errors, rejected): `rejected`
+    entries were skipped and `errors` describes the first few of them. A
+    body that cannot be read at all raises BatchDecodeError. Each payload
+    may be in any format receive_iot_data accepts.
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    data = decompress(body, content_encoding)
+    errors = []
+
+    if media_type in NDJSON_TYPES:
+        entries = []
+        for line_number, line in enumerate(data.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                errors.append(f"line {line_number}: {e}")
+    elif media_type in JSON_TYPES:
+        try:
+            entries = _as_payload_list(json.loads(data))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise BatchDecodeError(f"Invalid JSON format: {e}")
+    elif media_type in MSGPACK_TYPES:
+        if msgpack is None:
+            raise BatchDecodeError("MessagePack bodies need the 'msgpack' package", status=415)
+        try:
+            entries = _as_payload_list(msgpack.unpackb(data, raw=False))
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise BatchDecodeError(f"Invalid MessagePack body: {e}")
+    else:
+        raise BatchDecodeError(f"Unsupported Content-Type: {media_type or 'none'}", status=415)
+
+    payloads = []
+    for index, entry in enumerate(entries):
+        if isinstance(entry, (dict, list)):
+            payloads.append(entry)
+        else:
+            errors.append(f"entry {index}: not a payload object")
+    if len(payloads) > BATCH_MAX_PAYLOADS:
+        raise BatchDecodeError(f"At most {BATCH_MAX_PAYLOADS} payloads per batch", status=413)
+    return payloads, errors[:MAX_REPORTED_ERRORS], len(errors)
+
+def count_assets(payloads):
+    """Assets across all payloads"""
+    total = 0
+    for external_data in payloads:
+        for service in extract_services(external_data):
+            if isinstance(service, dict) and isinstance(service.get('assets'), list):
+                total += len(service['assets'])
+    return total
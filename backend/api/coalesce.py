@@ -0,0 +1,357 @@
+# coalesce.py - Latest-value-wins ingest queue for overload
+from django.conf import settings
+from collections import deque
+from datetime import datetime
+import logging
+import queue
+import threading
+import time
+
+from . import ingest, metrics
+
+# ==================== CONFIGURATION ====================
+# 'fifo'     - every payload is published to the live state in arrival order;
+#              a full queue (counted in payloads) answers 503
+# 'coalesce' - a persister thread writes every payload in bulk, and while more
+#              than COALESCE_THRESHOLD are waiting the backlog is published as
+#              one update holding the newest reading per asset
+INGEST_MODE = getattr(settings, 'IOT_INGEST_MODE', 'fifo')
+COALESCE_THRESHOLD = getattr(settings, 'IOT_COALESCE_THRESHOLD', ingest.INGEST_BATCH_SIZE)
+# Payloads drained (and written in one transaction) per coalesced update
+COALESCE_MAX_BATCH = getattr(settings, 'IOT_COALESCE_MAX_BATCH', 2000)
+# Payloads kept waiting before the oldest are dropped; also the most handed to
+# the persister before the processor waits for it to catch up
+COALESCE_BACKLOG = getattr(settings, 'IOT_COALESCE_BACKLOG', 50000)
+
+INGEST_MODES = ('fifo', 'coalesce')
+
+# ==================== QUEUE ====================
+
+def _payload_count(item):
+    data = item[0] if isinstance(item, tuple) else item
+    return len(data) if isinstance(data, ingest.PayloadBatch) else 1
+
+class PayloadQueue(queue.Queue):
+    """
+    FIFO ingest queue bounded in payloads rather than items: a PayloadBatch
+    counts each of its payloads against `maxsize`, so queued batches never
+    hold more than `maxsize` payloads in memory. A batch larger than
+    `maxsize` on its own is accepted only into an empty queue. qsize() is
+    in payloads too.
+    """
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.payloads = 0
+
+    def _qsize(self):
+        return self.payloads
+
+    def _put(self, item):
+        super()._put(item)
+        self.payloads += _payload_count(item)
+
+    def _get(self):
+        item = super()._get()
+        self.payloads -= _payload_count(item)
+        return item
+
+    def _fits(self, count):
+        return self.maxsize <= 0 or not self.payloads or self.payloads + count <= self.maxsize
+
+    def put(self, item, block=True, timeout=None):
+        count = _payload_count(item)
+        with self.not_full:
+            if not block:
+                if not self._fits(count):
+                    raise queue.Full
+            elif timeout is None:
+                while not self._fits(count):
+                    self.not_full.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self._fits(count):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Full
+                    self.not_full.wait(remaining)
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+class CoalescingQueue:
+    """
+    Stand-in for the ingest queue.Queue that never refuses a put(), paired
+    with a bulk persister thread so the database never holds up the live
+    state.
+
+    Both sides are bounded by `maxsize` waiting payloads (a PayloadBatch
+    counts each of its payloads), and qsize() is in payloads as for the
+    FIFO PayloadQueue. A persister that falls behind holds up the processor
+    in persist() rather than losing writes, so every payload published is
+    also written. Incoming payloads past the bound drop the oldest waiting
+    ones, so under sustained overload the data lost is the stalest, never
+    the newest: `dropped` payloads never reached the live state or the
+    database, and each drop is logged.
+    """
+    def __init__(self, maxsize=None, threshold=None, persist_batch_size=None):
+        self.maxsize = maxsize or COALESCE_BACKLOG
+        self.threshold = COALESCE_THRESHOLD if threshold is None else threshold
+        self.persist_batch_size = persist_batch_size or COALESCE_MAX_BATCH
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._persist_ready = threading.Condition(self._lock)
+        self._persisted = threading.Condition(self._lock)
+        self._items = deque()
+        self._unwritten = deque()
+        self._writing = 0
+        self._persister = None
+        self.pending = 0
+        self.pending_writes = 0
+        self.received = 0
+        self.dropped = 0
+        self.persisted = 0
+        self.coalesced_updates = 0
+        self.coalesced_payloads = 0
+        self.coalesced_readings = 0
+
+    def put(self, item, block=True, timeout=None):
+        count = _payload_count(item)
+        dropped = 0
+        with self._lock:
+            self._items.append((item, count))
+            self.pending += count
+            self.received += count
+            while self.pending > self.maxsize and len(self._items) > 1:
+                _, oldest = self._items.popleft()
+                self.pending -= oldest
+                dropped += oldest
+            self.dropped += dropped
+            pending = self.pending
+            self._not_empty.notify()
+        if dropped:
+            ingest.ingest_log.event(
+                'coalesce_dropped', logging.WARNING, totals=('payloads',),
+                payloads=dropped, pending=pending, max_pending=self.maxsize
+            )
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        with self._lock:
+            if not block:
+                if not self._items:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._items:
+                    self._not_empty.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self._items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            item, count = self._items.popleft()
+            self.pending -= count
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._lock:
+            return self.pending
+
+    def empty(self):
+        with self._lock:
+            return not self._items
+
+    def full(self):
+        return False
+
+    def backed_up(self):
+        return self.pending > self.threshold
+
+    def record_coalesced(self, payloads, superseded):
+        """Count one update that stood in for `payloads` payloads, hiding `superseded` older readings"""
+        with self._lock:
+            self.coalesced_updates += 1
+            self.coalesced_payloads += payloads
+            self.coalesced_readings += superseded
+
+    # persistence ---------------------------------------------------------
+
+    def persist(self, payloads, normalized, writer=None):
+        """
+        Hand normalized payloads to the persister thread (started on first
+        use), first waiting for it to catch up if that would put more than
+        `maxsize` payloads behind it.
+        """
+        with self._lock:
+            if self._persister is None:
+                self._persister = threading.Thread(target=self._persist_forever, args=(writer,), daemon=True)
+                self._persister.start()
+            while self._unwritten and self.pending_writes + len(payloads) > self.maxsize:
+                self._persisted.wait()
+            self._unwritten.append((payloads, normalized))
+            self.pending_writes += len(payloads)
+            self._persist_ready.notify()
+
+    def _persist_forever(self, writer):
+        """Write the backlog in transactions of up to persist_batch_size payloads"""
+        while True:
+            payloads, normalized = [], []
+            with self._lock:
+                while not self._unwritten:
+                    self._persist_ready.wait()
+                while self._unwritten and len(payloads) < self.persist_batch_size:
+                    chunk_payloads, chunk_normalized = self._unwritten.popleft()
+                    payloads.extend(chunk_payloads)
+                    normalized.extend(chunk_normalized)
+                self.pending_writes -= len(payloads)
+                self._writing = len(payloads)
+            ingest.persist_normalized(payloads, normalized, writer)
+            with self._lock:
+                self._writing = 0
+                self.persisted += len(payloads)
+                self._persisted.notify_all()
+
+    def wait_persisted(self, timeout=None):
+        """Block until every handed-over payload is written; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._unwritten or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._persisted.wait(remaining)
+        return True
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'mode': 'coalesce',
+                'queue_size': self.pending,
+                'queued_items': len(self._items),
+                'pending_writes': self.pending_writes + self._writing,
+                'max_pending_payloads': self.maxsize,
+                'threshold': self.threshold,
+                'received': self.received,
+                'dropped': self.dropped,
+                'persisted': self.persisted,
+                'coalesced_updates': self.coalesced_updates,
+                'coalesced_payloads': self.coalesced_payloads,
+                'coalesced_readings': self.coalesced_readings
+            }
+
+def create_ingest_queue(maxsize, mode=None):
+    """The ingest queue for IOT_INGEST_MODE; `maxsize` bounds the FIFO queue"""
+    mode = mode or INGEST_MODE
+    if mode == 'fifo':
+        return PayloadQueue(maxsize=maxsize)
+    if mode == 'coalesce':
+        return CoalescingQueue()
+    raise ValueError(f"Unknown IOT_INGEST_MODE {mode!r} (expected one of {', '.join(INGEST_MODES)})")
+
+def ingest_metrics(data_queue):
+    """Mode and counters of an ingest queue, for the debug endpoints"""
+    if isinstance(data_queue, CoalescingQueue):
+        return data_queue.get_metrics()
+    return {
+        'mode': 'fifo',
+        'queue_size': data_queue.qsize(),
+        'max_queue_size': data_queue.maxsize
+    }
+
+# ==================== PROCESSING ====================
+
+def coalesce_services(processed_batch):
+    """
+    Merge the processed services lists of several payloads, oldest first,
+    into one list holding the newest reading of every (service, asset id).
+    Services and assets keep the position they first appeared in.
+
+    Returns (services, superseded) where superseded counts the readings
+    replaced by a newer one.
+    """
+    merged = {}
+    readings = 0
+    for processed_services in processed_batch:
+        for service in processed_services:
+            assets = merged.get(service['name'])
+            if assets is None:
+                assets = merged[service['name']] = {}
+            for asset in service['assets']:
+                assets[str(asset['id'])] = asset
+                readings += 1
+    services = [
+        {'name': service_name, 'assets': list(assets.values())}
+        for service_name, assets in merged.items()
+    ]
+    return services, readings - sum(len(service['assets']) for service in services)
+
+def drain_next(data_queue):
+    """
+    Drain the next batch from `data_queue`: (payloads, received, coalescing)
+    where `received` holds each payload's request time and coalescing
+    means a backed-up CoalescingQueue was drained up to COALESCE_MAX_BATCH
+    payloads to be published as one update. Raises queue.Empty when
+    nothing arrives.
+    """
+    coalescing = isinstance(data_queue, CoalescingQueue) and data_queue.backed_up()
+    batch = ingest.drain_batch(data_queue, COALESCE_MAX_BATCH if coalescing else None)
+    payloads = [external_data for external_data, request_time in batch]
+    received = [request_time for external_data, request_time in batch]
+    metrics.BATCHES.inc()
+    metrics.QUEUE_WAIT.observe_many(_ages(received))
+    return payloads, received, coalescing
+
+def _ages(received):
+    now = datetime.now()
+    return [(now - request_time).total_seconds() for request_time in received]
+
+def commit_batch(data_queue, store, payloads, normalized, coalescing=False, writer=None, received=None):
+    """
+    Persist a drained batch and publish it to the live-state `store`, given
+    its normalize_payload() results. Returns (payloads, updates published).
+
+    A CoalescingQueue's batches go to its persister thread; FIFO batches
+    are written in one transaction before the live state is updated in
+    arrival order. A coalescing batch is published as the newest reading
+    per asset, so listeners (streams, stats, rules) never see the readings
+    it superseded.
+    """
+    if isinstance(data_queue, CoalescingQueue):
+        data_queue.persist(payloads, normalized, writer)
+    else:
+        ingest.persist_normalized(payloads, normalized, writer)
+
+    processed_batch = [processed_services for processed_services, _ in normalized]
+    if not coalescing or len(processed_batch) == 1:
+        for processed_services in processed_batch:
+            store.atomic_update(processed_services)
+        published = len(processed_batch)
+    else:
+        services_data, superseded = coalesce_services(processed_batch)
+        store.atomic_update(services_data)
+        data_queue.record_coalesced(len(processed_batch), superseded)
+        published = 1
+
+    metrics.PAYLOADS.inc(len(processed_batch))
+    metrics.ASSETS.inc(sum(len(service['assets']) for processed_services in processed_batch for service in processed_services))
+    metrics.LIVE_UPDATES.inc(published)
+    if received:
+        metrics.PUBLISH_LATENCY.observe_many(_ages(received))
+    return len(processed_batch), published
+
+def process_next_batch(data_queue, store, writer=None):
+    """
+    Drain, normalize, persist and publish one batch on this thread (see
+    drain_next and commit_batch). Returns (payloads processed, updates
+    published); raises queue.Empty when nothing arrives.
+    """
+    payloads, received, coalescing = drain_next(data_queue)
+    with metrics.PARSE_SECONDS.time():
+        normalized = [ingest.normalize_payload(external_data) for external_data in payloads]
+    return commit_batch(data_queue, store, payloads, normalized, coalescing, writer, received)
@@ -0,0 +1,168 @@
+# config_proxy.py - Cached proxy for the crane configuration on the Flask server
+from django.conf import settings
+from datetime import datetime
+import json
+import threading
+import time
+import zlib
+
+from .upstream import upstream_gateway, UpstreamError
+
+# ==================== CONFIGURATION ====================
+# Served from memory while younger than the TTL; for STALE_SECONDS after
+# that it is still served while one background request revalidates it
+CRANE_CONFIG_TTL_SECONDS = getattr(settings, 'IOT_CRANE_CONFIG_TTL_SECONDS', 5.0)
+CRANE_CONFIG_STALE_SECONDS = getattr(settings, 'IOT_CRANE_CONFIG_STALE_SECONDS', 300.0)
+CRANE_CONFIG_PATH = '/api/crane-config'
+
+def _now_iso():
+    return datetime.now().isoformat() + 'Z'
+
+# ==================== CACHE ENTRIES ====================
+
+class ConfigEntry:
+    """One encoded proxy response and when it was fetched"""
+    __slots__ = ('status', 'body', 'etag', 'fetched')
+
+    def __init__(self, status, body, fetched=None):
+        self.status = status
+        self.body = body
+        self.etag = f'"cfg-{zlib.crc32(body):08x}"'
+        self.fetched = time.monotonic() if fetched is None else fetched
+
+    def age(self, now=None):
+        return (time.monotonic() if now is None else now) - self.fetched
+
+def error_entry(status, error):
+    return ConfigEntry(status, json.dumps({
+        "success": False,
+        "error": error,
+        "timestamp": _now_iso()
+    }).encode('utf-8'))
+
+# ==================== CACHED PROXY ====================
+
+class CraneConfigProxy:
+    """
+    Crane configuration from the upstream Flask server, fetched through
+    the UpstreamGateway and cached as an encoded response body.
+
+    get() never waits on the upstream while a cached config is younger
+    than ttl + stale_seconds: past the TTL it returns the cached body and
+    starts a single background revalidation. Only a cold (or very old)
+    cache waits for a fetch, and concurrent callers then share that one
+    upstream call. A failed refresh - or an open circuit - keeps the last
+    good config (stale-if-error); errors themselves are never cached.
+
+    update() forwards a new config upstream and, once accepted, drops the
+    cached one so the next read in this worker sees the change. Other
+    workers catch up within the TTL.
+    """
+    def __init__(self, gateway=None, ttl_seconds=None, stale_seconds=None):
+        self.gateway = gateway or upstream_gateway
+        self.ttl_seconds = CRANE_CONFIG_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.stale_seconds = CRANE_CONFIG_STALE_SECONDS if stale_seconds is None else stale_seconds
+        self._lock = threading.Lock()
+        self._entry = None
+        self._generation = 0
+        self._refreshing = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    # reads ---------------------------------------------------------------
+
+    async def get(self):
+        """(ConfigEntry, cache state) - state is 'hit', 'stale' or 'miss'"""
+        entry = self._entry
+        if entry is not None:
+            age = entry.age()
+            if age < self.ttl_seconds:
+                self.hits += 1
+                return entry, 'hit'
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stale_hits += 1
+                self._refresh_in_background()
+                return entry, 'stale'
+        self.misses += 1
+        return await self._fetch(), 'miss'
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        self.refreshes += 1
+        self.gateway.run(self._refresh())
+
+    async def _refresh(self):
+        try:
+            await self._fetch()
+        finally:
+            self._refreshing = False
+
+    async def _fetch(self):
+        generation = self._generation
+        try:
+            # Reads after an update never share a fetch started before it
+            status, external_data = await self.gateway.get(CRANE_CONFIG_PATH, key=(CRANE_CONFIG_PATH, generation))
+        except UpstreamError as e:
+            self.errors += 1
+            entry = error_entry(e.status, str(e))
+        else:
+            entry = self._encode(status, external_data)
+        with self._lock:
+            # A config written meanwhile makes this response outdated
+            if entry.status == 200 and generation == self._generation:
+                self._entry = entry
+        if entry.status != 200 and self._entry is not None:
+            return self._entry
+        return entry
+
+    def _encode(self, status, external_data):
+        if status != 200:
+            self.errors += 1
+            return error_entry(status, f"Flask server returned {status}")
+        if external_data is None:
+            self.errors += 1
+            return error_entry(503, "Connection error: upstream response is not JSON")
+        return ConfigEntry(200, json.dumps({
+            "success": True,
+            "data": external_data.get('data', external_data) if isinstance(external_data, dict) else external_data,
+            "source": "flask_server",
+            "timestamp": _now_iso()
+        }).encode('utf-8'))
+
+    # writes --------------------------------------------------------------
+
+    async def update(self, data):
+        """Forward a new config upstream; returns the upstream status code (raises UpstreamError)"""
+        status, _ = await self.gateway.post(CRANE_CONFIG_PATH, json=data)
+        if status == 200:
+            self.invalidate()
+        return status
+
+    def invalidate(self):
+        """Drop the cached config; a fetch already in flight will not store its older copy"""
+        with self._lock:
+            self._entry = None
+            self._generation += 1
+
+    def get_metrics(self):
+        entry = self._entry
+        return {
+            "cached": entry is not None,
+            "age_seconds": round(entry.age(), 3) if entry is not None else None,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "upstream": self.gateway.get_metrics()
+        }
+
+
+# Process-wide proxy used by the config endpoints
+crane_config = CraneConfigProxy()
@@ -0,0 +1,328 @@
+# db_writer.py - Single-writer database access for the ingest pipeline
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection
+from collections import deque
+from datetime import datetime
+import os
+import queue
+import socketserver
+import threading
+import time
+
+from . import ingest
+from .rules import persist_alert_events
+from .ipc import UnixSocketClient, recv_frame, send_frame, IPCError
+
+# ==================== CONFIGURATION ====================
+# 'local'   - every worker writes through its own connection
+# 'process' - `manage.py run_db_writer` owns all writes; workers send it batches
+DB_WRITER_BACKEND = getattr(settings, 'IOT_DB_WRITER', 'local')
+DB_WRITER_SOCKET = getattr(settings, 'IOT_DB_WRITER_SOCKET', '/tmp/iot_db_writer.sock')
+# Payloads from concurrent worker requests merged into one commit
+DB_WRITER_MAX_BATCH = getattr(settings, 'IOT_DB_WRITER_MAX_BATCH', 1000)
+DB_WRITER_TIMEOUT = 30.0
+METRICS_WINDOW = 1024
+
+# Lock timeouts and lost connections may succeed on retry; bad data will not
+TRANSIENT_WRITE_ERRORS = (OperationalError, InterfaceError)
+
+class WriteRejected(Exception):
+    """The writer process could not commit a batch for a reason retrying will not fix"""
+
+# ==================== METRICS ====================
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class WriteMetrics:
+    """Commit latency and batch-size counters over the last METRICS_WINDOW commits"""
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._batch_payloads = deque(maxlen=window)
+        self._batch_rows = deque(maxlen=window)
+        self.commits = 0
+        self.payloads = 0
+        self.rows = 0
+        self.errors = 0
+        # SQLITE_BUSY seen by this writer - stays 0 without lock contention
+        self.lock_errors = 0
+
+    def record(self, latency, payloads, rows):
+        with self._lock:
+            self._latencies.append(latency)
+            self._batch_payloads.append(payloads)
+            self._batch_rows.append(rows)
+            self.commits += 1
+            self.payloads += payloads
+            self.rows += rows
+
+    def record_error(self, error):
+        with self._lock:
+            self.errors += 1
+            if isinstance(error, OperationalError) and 'locked' in str(error):
+                self.lock_errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            batch_payloads = list(self._batch_payloads)
+            batch_rows = list(self._batch_rows)
+            counters = {
+                "commits": self.commits,
+                "payloads": self.payloads,
+                "rows": self.rows,
+                "errors": self.errors,
+                "lock_errors": self.lock_errors,
+            }
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            **counters,
+            "write_latency_ms": {
+                "p50": ms(_percentile(latencies, 0.50)),
+                "p99": ms(_percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None),
+            },
+            "commit_batch_payloads": {
+                "mean": round(sum(batch_payloads) / len(batch_payloads), 1) if batch_payloads else None,
+                "max": max(batch_payloads, default=None),
+            },
+            "commit_batch_rows": {
+                "mean": round(sum(batch_rows) / len(batch_rows), 1) if batch_rows else None,
+                "max": max(batch_rows, default=None),
+            },
+            "window": len(latencies),
+        }
+
+# ==================== WRITERS ====================
+
+class LocalDatabaseWriter:
+    """Writes each batch through this process's own database connection"""
+    backend = 'local'
+
+    def __init__(self):
+        self.metrics = WriteMetrics()
+
+    def write(self, payloads, normalized):
+        start = time.perf_counter()
+        try:
+            rows = ingest.write_batch(payloads, normalized)
+        except Exception as e:
+            self.metrics.record_error(e)
+            raise
+        self.metrics.record(time.perf_counter() - start, len(payloads), rows)
+        return rows
+
+    def write_alert_events(self, transitions):
+        persist_alert_events(transitions)
+
+    def get_metrics(self):
+        return {"backend": self.backend, "pid": os.getpid(), **self.metrics.snapshot()}
+
+
+class RemoteDatabaseWriter:
+    """Hands batches to the DatabaseWriterServer and waits for the commit"""
+    backend = 'process'
+
+    def __init__(self, path=None):
+        self.client = UnixSocketClient(path or DB_WRITER_SOCKET, timeout=DB_WRITER_TIMEOUT)
+
+    def write(self, payloads, normalized):
+        # The rows normalized here (or by the normalizer pool) are persisted as
+        # they are - the writer thread never parses a payload
+        reply = self.client.request({'op': 'write', 'payloads': payloads, 'normalized': encode_normalized(normalized)})
+        if 'error' in reply:
+            raise (IPCError if reply.get('transient', True) else WriteRejected)(reply['error'])
+        return reply['rows']
+
+    def write_alert_events(self, transitions):
+        reply = self.client.request({'op': 'alerts', 'transitions': transitions})
+        if 'error' in reply:
+            raise (IPCError if reply.get('transient', True) else WriteRejected)(reply['error'])
+
+    def get_metrics(self):
+        try:
+            return {"backend": self.backend, **self.client.request({'op': 'metrics'}, idempotent=True)}
+        except (OSError, IPCError) as e:
+            return {"backend": self.backend, "error": str(e)}
+
+# ==================== WRITE FRAMES ====================
+
+def encode_normalized(normalized):
+    """normalize_payload() results as plain JSON, asset timestamps in ISO-8601"""
+    return [
+        [processed_services, [[service_name, asset_id, value, asset_timestamp.isoformat()]
+                              for service_name, asset_id, value, asset_timestamp in asset_rows]]
+        for processed_services, asset_rows in normalized
+    ]
+
+def decode_normalized(encoded):
+    """Inverse of encode_normalized()"""
+    return [
+        (processed_services, [(service_name, asset_id, value, datetime.fromisoformat(asset_timestamp))
+                              for service_name, asset_id, value, asset_timestamp in asset_rows])
+        for processed_services, asset_rows in encoded
+    ]
+
+# ==================== WRITER PROCESS ====================
+
+class _PendingWrite:
+    __slots__ = ('payloads', 'normalized', 'alerts', 'done', 'rows', 'error', 'transient')
+
+    def __init__(self, payloads, normalized, alerts=None):
+        self.payloads = payloads
+        self.normalized = normalized
+        # Alert transitions (see rules) instead of an ingest batch
+        self.alerts = alerts
+        self.done = threading.Event()
+        self.rows = 0
+        self.error = None
+        self.transient = True
+
+    def fail(self, error):
+        self.error = str(error)
+        self.transient = isinstance(error, TRANSIENT_WRITE_ERRORS)
+
+
+class DatabaseWriterHandler(socketserver.BaseRequestHandler):
+    """One worker connection: queue its batches and wait for their commit"""
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                message = recv_frame(self.request)
+            except (OSError, IPCError, ValueError):
+                return
+            op = message.get('op')
+            if op == 'write':
+                if message.get('normalized') is None:
+                    # Workers send the rows they normalized; parsing here would
+                    # put that work back on the single writer
+                    reply = {'error': "write without normalized rows", 'transient': False}
+                else:
+                    payloads = message.get('payloads') or []
+                    reply = server.submit(_PendingWrite(payloads, decode_normalized(message['normalized'])))
+            elif op == 'alerts':
+                reply = server.submit(_PendingWrite([], [], alerts=message.get('transitions') or []))
+            elif op == 'metrics':
+                reply = {"pid": os.getpid(), **server.metrics.snapshot()}
+            else:
+                reply = {'error': f"Unknown op: {op}"}
+            send_frame(self.request, reply)
+
+
+class DatabaseWriterServer(socketserver.ThreadingUnixStreamServer):
+    """
+    The only process writing IoT data and alert events. Handler threads
+    queue incoming batches; a single writer thread merges whatever is pending from all
+    workers into one transaction (group commit), so the database lock has
+    exactly one owner and is never contended.
+    """
+    daemon_threads = True
+
+    def __init__(self, path=None, max_batch=None):
+        self.path = path or DB_WRITER_SOCKET
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.max_batch = max_batch or DB_WRITER_MAX_BATCH
+        self.pending = queue.Queue()
+        self.metrics = WriteMetrics()
+        super().__init__(self.path, DatabaseWriterHandler)
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def submit(self, pending):
+        """Queue one write for the writer thread and wait for its reply"""
+        self.pending.put(pending)
+        pending.done.wait()
+        if pending.error:
+            return {'error': pending.error, 'transient': pending.transient}
+        return {'rows': pending.rows}
+
+    def _next_group(self):
+        group = [self.pending.get()]
+        count = len(group[0].payloads)
+        while count < self.max_batch:
+            try:
+                pending = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            group.append(pending)
+            count += len(pending.payloads)
+        return group
+
+    def _write_loop(self):
+        while True:
+            group = self._next_group()
+            alerts = [pending for pending in group if pending.alerts is not None]
+            if alerts:
+                self._write_alerts(alerts)
+            writes = [pending for pending in group if pending.alerts is None]
+            if writes:
+                self._write_group(writes)
+
+    def _write_alerts(self, group):
+        try:
+            persist_alert_events([t for pending in group for t in pending.alerts])
+        except Exception as e:
+            self.metrics.record_error(e)
+            print(f"⚠️ Database writer error (alert events): {e}")
+            connection.close()
+            for pending in group:
+                pending.fail(e)
+        for pending in group:
+            pending.done.set()
+
+    def _write_group(self, group):
+        error = self._commit(group)
+        if error is not None and len(group) > 1 and not isinstance(error, TRANSIENT_WRITE_ERRORS):
+            # One bad batch fails the whole merged transaction - commit each
+            # worker's batch on its own so only the bad ones are refused
+            for pending in group:
+                pending_error = self._commit([pending])
+                if pending_error is not None:
+                    pending.fail(pending_error)
+        elif error is not None:
+            for pending in group:
+                pending.fail(error)
+        for pending in group:
+            pending.done.set()
+
+    def _commit(self, group):
+        """Write the group's batches in one transaction; returns the error, if any"""
+        payloads = [p for pending in group for p in pending.payloads]
+        normalized = [n for pending in group for n in pending.normalized]
+        start = time.perf_counter()
+        try:
+            rows = ingest.write_batch(payloads, normalized)
+        except Exception as e:
+            self.metrics.record_error(e)
+            print(f"⚠️ Database writer error: {e}")
+            connection.close()
+            return e
+        self.metrics.record(time.perf_counter() - start, len(payloads), rows)
+        for pending in group:
+            pending.rows = sum(len(asset_rows) for _, asset_rows in pending.normalized)
+        return None
+
+# ==================== BACKEND SELECTION ====================
+
+DB_WRITER_BACKENDS = {
+    'local': LocalDatabaseWriter,
+    'process': RemoteDatabaseWriter,
+}
+
+def create_db_writer(backend=None):
+    """Instantiate the configured database writer"""
+    backend = backend or DB_WRITER_BACKEND
+    try:
+        return DB_WRITER_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown IOT_DB_WRITER '{backend}' (choose from {', '.join(DB_WRITER_BACKENDS)})"
+        )
@@ -0,0 +1,186 @@
+# ingest.py - Batched ingest pipeline for queued IoT payloads
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+from datetime import datetime
+import logging
+import queue
+import time
+
+from . import metrics
+from .service_cache import service_cache
+from .storage import get_storage
+
+# ==================== CONFIGURATION ====================
+# Max payloads written per transaction / max time spent filling one batch
+INGEST_BATCH_SIZE = getattr(settings, 'IOT_INGEST_BATCH_SIZE', 200)
+INGEST_FLUSH_INTERVAL_MS = getattr(settings, 'IOT_INGEST_FLUSH_INTERVAL_MS', 50)
+
+# Batch-level events of the ingest pipeline, sampled (see metrics.SampledLog)
+ingest_log = metrics.SampledLog(logging.getLogger('api.ingest'))
+
+# ==================== PAYLOAD NORMALIZATION ====================
+
+def extract_services(external_data):
+    """Return the list of service dicts contained in any accepted payload format"""
+    if isinstance(external_data, list):
+        return external_data
+    if isinstance(external_data, dict):
+        if 'services' in external_data and isinstance(external_data['services'], list):
+            return external_data['services']
+        return [external_data]
+    return []
+
+def parse_asset_timestamp(timestamp_str):
+    """Parse an ISO-8601 asset timestamp, falling back to now"""
+    try:
+        if timestamp_str:
+            if timestamp_str.endswith('Z'):
+                timestamp_str = timestamp_str[:-1] + '+00:00'
+            parsed = datetime.fromisoformat(timestamp_str)
+            if timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            return parsed
+    except Exception:
+        pass
+    return timezone.now()
+
+def normalize_payload(external_data):
+    """
+    Normalize one payload without touching the database.
+
+    Returns (processed_services, asset_rows) where asset_rows is a list of
+    (service_name, asset_id, value, timestamp) tuples ready for persistence.
+    Assets whose value is not numeric are kept in processed_services but are
+    not persisted, matching the FloatField column.
+    """
+    processed_services = []
+    asset_rows = []
+
+    for service_data in extract_services(external_data):
+        if not (isinstance(service_data, dict) and 'name' in service_data):
+            continue
+        service_name = service_data['name']
+
+        assets_data = service_data.get('assets', [])
+        if not isinstance(assets_data, list):
+            assets_data = []
+
+        processed_assets = []
+        for asset_data in assets_data:
+            if not (isinstance(asset_data, dict) and 'id' in asset_data and 'value' in asset_data):
+                continue
+
+            try:
+                value = float(str(asset_data['value']))
+            except (TypeError, ValueError):
+                value = None
+            if value is not None:
+                asset_rows.append((
+                    service_name,
+                    asset_data['id'],
+                    value,
+                    parse_asset_timestamp(asset_data.get('timestamp'))
+                ))
+
+            processed_assets.append({
+                'id': asset_data['id'],
+                'value': asset_data['value'],
+                'timestamp': asset_data.get('timestamp', datetime.now().isoformat() + 'Z')
+            })
+
+        processed_services.append({
+            'name': service_name,
+            'assets': processed_assets
+        })
+
+    return processed_services, asset_rows
+
+# ==================== BULK PERSISTENCE ====================
+
+def persist_batch(payloads, normalized):
+    """
+    Write a batch of payloads in a single transaction through the configured
+    storage backend (see storage). Returns the number of asset rows written.
+    """
+    return get_storage().persist_batch(payloads, normalized)
+
+def write_batch(payloads, normalized):
+    """persist_batch(), retried once if the service cache turns out stale"""
+    try:
+        return persist_batch(payloads, normalized)
+    except IntegrityError:
+        # A cached service was deleted or renamed by another process -
+        # reload the cache and retry the batch once
+        service_cache.invalidate()
+        return persist_batch(payloads, normalized)
+
+def process_payloads(payloads, writer=None):
+    """
+    Normalize and persist a batch of payloads, returning processed services
+    per payload. `writer` (see db_writer) performs the write; by default it
+    happens on this process's own connection.
+    """
+    normalized = [normalize_payload(external_data) for external_data in payloads]
+    persist_normalized(payloads, normalized, writer)
+    return [processed_services for processed_services, _ in normalized]
+
+def persist_normalized(payloads, normalized, writer=None):
+    """Write already-normalized payloads; failures are logged, never raised"""
+    start = time.perf_counter()
+    try:
+        if writer is None:
+            write_batch(payloads, normalized)
+        else:
+            writer.write(payloads, normalized)
+    except Exception as e:
+        metrics.DB_WRITE_ERRORS.inc()
+        ingest_log.event('db_write_error', logging.WARNING, totals=('payloads',), payloads=len(payloads), error=str(e))
+        # Continue processing even if DB fails
+    finally:
+        metrics.DB_WRITE_SECONDS.observe(time.perf_counter() - start)
+
+# ==================== QUEUE DRAINING ====================
+
+class PayloadBatch(list):
+    """
+    Many payloads queued as a single item, e.g. by the batch ingest
+    endpoint: one put(), but counted as its payloads against the queue
+    bound (see coalesce.PayloadQueue). drain_batch() expands it back into
+    individual (payload, request_time) items.
+    """
+
+def _add_item(batch, item):
+    if isinstance(item, tuple) and isinstance(item[0], PayloadBatch):
+        payloads, request_time = item
+        batch.extend((external_data, request_time) for external_data in payloads)
+    else:
+        batch.append(item)
+
+def drain_batch(data_queue, max_items=None, flush_interval_ms=None, timeout=1.0):
+    """
+    Block for the first queued item, then keep collecting until either
+    `max_items` payloads are gathered or the flush interval has elapsed.
+    Queued PayloadBatch items are expanded, so a batch may overshoot
+    `max_items` by up to one PayloadBatch.
+
+    Raises queue.Empty if nothing arrives within `timeout` seconds.
+    """
+    max_items = max_items or INGEST_BATCH_SIZE
+    if flush_interval_ms is None:
+        flush_interval_ms = INGEST_FLUSH_INTERVAL_MS
+
+    batch = []
+    _add_item(batch, data_queue.get(timeout=timeout))
+    deadline = time.monotonic() + flush_interval_ms / 1000.0
+
+    while len(batch) < max_items:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            _add_item(batch, data_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+
+    return batch
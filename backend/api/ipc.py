@@ -0,0 +1,87 @@
+# ipc.py - Length-prefixed JSON framing for local Unix-socket IPC
+import json
+import os
+import socket
+import struct
+import threading
+
+_HEADER = struct.Struct('!I')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class IPCError(Exception):
+    """Raised when a peer disconnects or sends a malformed frame"""
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise IPCError("Connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock, message):
+    """Send one JSON-serializable message"""
+    body = json.dumps(message, separators=(',', ':'), default=str).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+
+def recv_frame(sock):
+    """Receive one message sent with send_frame()"""
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise IPCError(f"Frame of {size} bytes exceeds limit")
+    return json.loads(_recv_exact(sock, size))
+
+
+class UnixSocketClient:
+    """
+    Request/response client with one persistent connection per thread.
+
+    Connections are re-established transparently after a fork or when the
+    server restarts: a request whose connect or send failed is retried once
+    on a fresh connection. Once the frame has gone out the server may have
+    acted on it, so a failure while waiting for the reply is only retried
+    for `idempotent` requests.
+    """
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(self.timeout)
+        conn.connect(self.path)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def request(self, message, idempotent=False):
+        for attempt in range(2):
+            sent = False
+            try:
+                conn = self._connection()
+                send_frame(conn, message)
+                sent = True
+                return recv_frame(conn)
+            except (OSError, IPCError):
+                self._reset()
+                if attempt or (sent and not idempotent):
+                    raise
@@ -0,0 +1,338 @@
+# live_columns.py - Compact columnar history of live-state versions
+from array import array
+from collections import deque
+import threading
+import weakref
+
+# Value kinds stored alongside the float column
+FLOAT, INT, OBJECT = 0, 1, 2
+# Integers beyond this lose precision as doubles and are kept as objects
+MAX_EXACT_INT = 2 ** 53
+
+# ==================== INTERNING ====================
+
+class AssetRegistry:
+    """
+    Interns (service, asset id) keys as dense integer slots, so rows refer
+    to an asset by a 4-byte index instead of repeating its names.
+    """
+    def __init__(self):
+        self._slots = {}
+        self.keys = []  # slot -> (service, asset id)
+
+    def slot(self, service_name, asset_id):
+        key = (service_name, asset_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self.keys)
+            self.keys.append(key)
+        return slot
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Layout:
+    """
+    The shape of one update: its services in order, each with the slots of
+    its assets. Layouts are interned, so consecutive updates from the same
+    gateway share one instance.
+    """
+    __slots__ = ('services', 'slots', '_index', '__weakref__')
+
+    def __init__(self, services):
+        self.services = services  # ((service name, array of slots), ...)
+        self.slots = array('I')
+        for _, slots in services:
+            self.slots.extend(slots)
+        self._index = None
+
+    @property
+    def index(self):
+        """slot -> position in this layout, built on first use"""
+        if self._index is None:
+            self._index = {slot: position for position, slot in enumerate(self.slots)}
+        return self._index
+
+    def __len__(self):
+        return len(self.slots)
+
+# ==================== ROWS ====================
+
+class Row:
+    """
+    One live-state version in typed columns: float values with a kind per
+    position (None when every value is a float), objects for values that are
+    not numbers, and timestamps as indexes into the row's distinct timestamp
+    strings (None when every asset shares the first one). `changed` and
+    `removed` hold the slots that differ from the previous row.
+
+    The newest row also keeps the services list it was built from, so the
+    latest state is served without decoding.
+    """
+    __slots__ = ('version', 'timestamp', 'layout', 'values', 'kinds', 'objects',
+                 'stamps', 'stamp_index', 'changed', 'removed', 'services')
+
+    def kind_at(self, position):
+        return FLOAT if self.kinds is None else self.kinds[position]
+
+    def value_at(self, position):
+        kind = self.kind_at(position)
+        if kind == FLOAT:
+            return self.values[position]
+        if kind == INT:
+            return int(self.values[position])
+        return self.objects[position]
+
+    def stamp_at(self, position):
+        return self.stamps[0 if self.stamp_index is None else self.stamp_index[position]]
+
+    def same_at(self, position, other, other_position):
+        """Whether an asset holds the same reading here as at `other_position` in `other`"""
+        kind = self.kind_at(position)
+        if kind != other.kind_at(other_position) or self.stamp_at(position) != other.stamp_at(other_position):
+            return False
+        if kind == OBJECT:
+            value, other_value = self.objects[position], other.objects[other_position]
+            # Equal values of different types still read differently to a client
+            return type(value) is type(other_value) and value == other_value
+        return self.values[position] == other.values[other_position]
+
+    def nbytes(self):
+        """Approximate size of the typed columns"""
+        return sum(
+            column.itemsize * len(column) if isinstance(column, array) else len(column)
+            for column in (self.values, self.kinds, self.stamp_index, self.changed, self.removed)
+            if column is not None
+        )
+
+# ==================== COLUMNAR HISTORY ====================
+
+class LiveColumns:
+    """
+    Ring buffer of the last `maxlen` live-state versions as compact rows.
+
+    Each update is diffed against the previous row as it is appended: an
+    asset counts as changed when its value, the value's type (1 -> 1.0) or
+    its timestamp differs, and assets missing from the new update are
+    removed.
+    A client can catch up from any retained version with one merged delta,
+    built from the changed slots alone. Older versions are decoded back into
+    services lists only when asked for.
+    """
+    def __init__(self, maxlen):
+        self._lock = threading.Lock()
+        self.registry = AssetRegistry()
+        self._layouts = weakref.WeakValueDictionary()
+        self._rows = deque(maxlen=maxlen)
+        # First version of the current unbroken run of versions
+        self._chain_start = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _layout(self, services_data):
+        # Interned by names, so a repeated shape costs one tuple build and lookup
+        key = tuple(
+            (service.get('name'), tuple(asset.get('id') for asset in service.get('assets', [])))
+            for service in services_data
+        )
+        layout = self._layouts.get(key)
+        if layout is None:
+            slot = self.registry.slot
+            layout = Layout(tuple(
+                (service_name, array('I', [slot(service_name, asset_id) for asset_id in asset_ids]))
+                for service_name, asset_ids in key
+            ))
+            self._layouts[key] = layout
+        return layout
+
+    def _encode(self, version, timestamp, services_data):
+        """Build a Row (without its diff) from a services list"""
+        row = Row()
+        row.version = version
+        row.timestamp = timestamp
+        row.layout = self._layout(services_data)
+        assets = [asset for service in services_data for asset in service.get('assets', [])]
+
+        values = [asset.get('value') for asset in assets]
+        if all(type(value) is float for value in values):
+            row.values = array('d', values)
+            row.kinds = row.objects = None
+        else:
+            row.values = array('d')
+            kinds = bytearray()
+            objects = {}
+            for position, value in enumerate(values):
+                value_type = type(value)
+                if value_type is float:
+                    row.values.append(value)
+                    kinds.append(FLOAT)
+                elif value_type is int and -MAX_EXACT_INT <= value <= MAX_EXACT_INT:
+                    row.values.append(value)
+                    kinds.append(INT)
+                else:
+                    row.values.append(0.0)
+                    kinds.append(OBJECT)
+                    objects[position] = value
+            row.kinds = bytes(kinds)
+            row.objects = objects or None
+
+        stamps = [asset.get('timestamp') for asset in assets]
+        if not stamps or stamps.count(stamps[0]) == len(stamps):
+            row.stamps = tuple(stamps[:1])
+            row.stamp_index = None
+        else:
+            distinct = {}
+            row.stamp_index = array('I', [distinct.setdefault(stamp, len(distinct)) for stamp in stamps])
+            row.stamps = tuple(distinct)
+        return row
+
+    def _diff(self, row, previous):
+        """Slots of `row` whose reading differs from `previous`, and slots it dropped"""
+        changed = array('I')
+        if previous is None:
+            changed.extend(row.layout.slots)
+            return changed, array('I')
+
+        slots = row.layout.slots
+        if previous.layout is row.layout:
+            if previous.kinds is None and row.kinds is None \
+                    and previous.stamp_index is None and row.stamp_index is None:
+                # All-float rows of the same shape with one timestamp each
+                # compare column to column - or all changed with the stamp
+                if row.stamps != previous.stamps:
+                    changed.extend(slots)
+                else:
+                    changed.extend([
+                        slot for slot, value, previous_value in zip(slots, row.values, previous.values)
+                        if value != previous_value
+                    ])
+            else:
+                for position in range(len(slots)):
+                    if not row.same_at(position, previous, position):
+                        changed.append(slots[position])
+            return changed, array('I')
+
+        previous_index = previous.layout.index
+        for position, slot in enumerate(slots):
+            previous_position = previous_index.get(slot)
+            if previous_position is None or not row.same_at(position, previous, previous_position):
+                changed.append(slot)
+        current_index = row.layout.index
+        removed = array('I', (slot for slot in previous.layout.slots if slot not in current_index))
+        return changed, removed
+
+    def append(self, version, timestamp, services_data):
+        """Record a new version; returns its (changes, removed)"""
+        with self._lock:
+            row = self._encode(version, timestamp, services_data)
+            previous = self._rows[-1] if self._rows else None
+            row.changed, row.removed = self._diff(row, previous)
+            row.services = services_data
+            if previous is not None:
+                # Only the newest row keeps its decoded form
+                previous.services = None
+            if version != self.version + 1:
+                # Versions were skipped - older diffs no longer chain up
+                self._chain_start = version
+            self._rows.append(row)
+            self.version = version
+            changes = self._changes(row, row.changed)
+            keys = self.registry.keys
+            removed = [{'service': keys[slot][0], 'id': keys[slot][1]} for slot in row.removed]
+        return changes, removed
+
+    def _changes(self, row, slots):
+        """Change entries for `slots`, with their values in `row`"""
+        keys = self.registry.keys
+        index = row.layout.index
+        values = row.values
+        simple = row.kinds is None and row.stamp_index is None
+        stamp = row.stamps[0] if row.stamps else None
+        changes = []
+        for slot in slots:
+            service_name, asset_id = keys[slot]
+            position = index[slot]
+            changes.append({
+                'service': service_name,
+                'id': asset_id,
+                'value': values[position] if simple else row.value_at(position),
+                'timestamp': stamp if simple else row.stamp_at(position)
+            })
+        return changes
+
+    def since(self, version):
+        """
+        Merge every diff after `version` into (current version, changes, removed),
+        or None when `version` is older than the retained diffs (send a full
+        snapshot instead).
+        """
+        with self._lock:
+            if version == self.version:
+                return self.version, [], []
+            if version > self.version or not self._rows:
+                return None
+            if max(self._rows[0].version, self._chain_start) > version + 1:
+                return None
+            merged = {}
+            removed = {}
+            for row in self._rows:
+                if row.version <= version:
+                    continue
+                for slot in row.changed:
+                    merged[slot] = True
+                    removed.pop(slot, None)
+                for slot in row.removed:
+                    removed[slot] = True
+                    merged.pop(slot, None)
+            keys = self.registry.keys
+            return (
+                self.version,
+                self._changes(self._rows[-1], merged),
+                [{'service': keys[slot][0], 'id': keys[slot][1]} for slot in removed]
+            )
+
+    def _decode(self, row):
+        """Services list of a row, in the shape it was published in"""
+        services = row.services
+        if services is not None:
+            return services
+        keys = self.registry.keys
+        services = []
+        position = 0
+        for service_name, slots in row.layout.services:
+            assets = []
+            for slot in slots:
+                assets.append({
+                    'id': keys[slot][1],
+                    'value': row.value_at(position),
+                    'timestamp': row.stamp_at(position)
+                })
+                position += 1
+            services.append({'name': service_name, 'assets': assets})
+        return services
+
+    def entries(self, limit=None, after=None):
+        """
+        [(version, timestamp, services), ...] oldest first: the last `limit`
+        versions, restricted to those newer than `after`.
+        """
+        with self._lock:
+            rows = []
+            for row in reversed(self._rows):
+                if (limit is not None and len(rows) >= limit) or (after is not None and row.version <= after):
+                    break
+                rows.append(row)
+            rows.reverse()
+        return [(row.version, row.timestamp, self._decode(row)) for row in rows]
+
+    def oldest_version(self):
+        with self._lock:
+            return self._rows[0].version if self._rows else None
+
+    def memory_usage(self):
+        """Approximate bytes held by the typed row columns"""
+        with self._lock:
+            return sum(row.nbytes() for row in self._rows)
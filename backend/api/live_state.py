@@ -0,0 +1,509 @@
+# live_state.py - Pluggable live-state backends for latest data and history
+from django.conf import settings
+from datetime import datetime
+import fcntl
+import json
+import logging
+import mmap
+import os
+import socketserver
+import struct
+import threading
+import time
+
+from . import metrics
+from .coalesce import create_ingest_queue
+from .ipc import UnixSocketClient, recv_frame, send_frame, IPCError
+from .live_columns import LiveColumns
+
+# ==================== CONFIGURATION ====================
+LIVE_STATE_BACKEND = getattr(settings, 'IOT_LIVE_STATE_BACKEND', 'local')
+LIVE_STATE_PATH = getattr(settings, 'IOT_LIVE_STATE_PATH', '/dev/shm/iot_live_state')
+LIVE_STATE_SLOT_BYTES = getattr(settings, 'IOT_LIVE_STATE_SLOT_BYTES', 128 * 1024)
+LIVE_STATE_SOCKET = getattr(settings, 'IOT_LIVE_STATE_SOCKET', '/tmp/iot_live_state.sock')
+# Versions kept in the shared backends' fixed-size slots
+HISTORY_SIZE = 100
+# Versions kept as compact rows in process memory (and for per-asset deltas)
+LIVE_HISTORY_SIZE = getattr(settings, 'IOT_LIVE_HISTORY_SIZE', 1000)
+QUEUE_MAX_SIZE = 1000
+
+logger = logging.getLogger('api.live_state')
+
+# ==================== IN-PROCESS BACKEND ====================
+
+class ThreadSafeIoTData:
+    """
+    Thread-safe container for IoT data with atomic updates.
+
+    The latest services list is kept as published; history lives in
+    LiveColumns as typed rows and is only decoded back into services lists
+    for the versions a caller asks for. Snapshots hand out the stored
+    latest list rather than copies, so treat them as read-only.
+    """
+    def __init__(self, history_size=None):
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._columns = LiveColumns(history_size or LIVE_HISTORY_SIZE)
+        self._data = {
+            'services': [],
+            'last_updated': None,
+            'version': 0,
+            'websocket_clients': set(),
+            'data_queue': create_ingest_queue(QUEUE_MAX_SIZE)
+        }
+
+    def add_listener(self, callback):
+        """Call `callback(version, timestamp, services, changes, removed)` after every update"""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def _notify(self, version, timestamp, services_data, changes, removed):
+        for callback in list(self._listeners):
+            try:
+                callback(version, timestamp, services_data, changes, removed)
+            except Exception as e:
+                print(f"⚠️ Live state listener error: {e}")
+
+    def atomic_update(self, services_data):
+        """Update all data fields atomically to prevent race conditions"""
+        with self._lock:
+            timestamp = datetime.now().isoformat() + 'Z'
+            version = self._data['version'] + 1
+
+            # Append to the columnar history, diffing against the previous version
+            changes, removed = self._columns.append(version, timestamp, services_data)
+
+            # Update all fields in single operation
+            self._data.update({
+                'services': services_data,
+                'last_updated': timestamp,
+                'version': version
+            })
+
+        # Listeners run outside the lock so slow subscribers never block readers
+        self._notify(version, timestamp, services_data, changes, removed)
+        return timestamp
+
+    def get_snapshot(self, include_history=True):
+        """Get consistent snapshot of all data - no partial states"""
+        with self._lock:
+            services = self._data['services']
+            return {
+                'services': services,
+                'last_updated': self._data['last_updated'],
+                'latest': services or None,
+                'history': [entry[2] for entry in self._columns.entries()] if include_history else [],
+                'history_count': len(self._columns),
+                'version': self._data['version'],
+                'websocket_clients': self._data['websocket_clients'].copy(),
+                'queue_size': self._data['data_queue'].qsize()
+            }
+
+    def history_entries(self, limit=None):
+        """Return (current version, [(version, timestamp, services), ...] oldest first), the last `limit` only if given"""
+        with self._lock:
+            return self._data['version'], self._columns.entries(limit)
+
+    def updates_since(self, version):
+        """
+        Return the (version, timestamp, services) entries newer than `version`,
+        or None when the history no longer reaches back that far or `version`
+        is ahead of it (handed out before a restart).
+        """
+        with self._lock:
+            current = self._data['version']
+            if version > current:
+                return None
+            if version == current:
+                return []
+            oldest = self._columns.oldest_version()
+            if oldest is None or oldest > version + 1:
+                return None
+            return self._columns.entries(after=version)
+
+    def changes_since(self, version):
+        """
+        Return (current version, changes, removed) covering everything after
+        `version`, or None when the gap is too large for a delta.
+        """
+        return self._columns.since(version)
+
+    def add_websocket_client(self, client):
+        with self._lock:
+            self._data['websocket_clients'].add(client)
+
+    def remove_websocket_client(self, client):
+        with self._lock:
+            self._data['websocket_clients'].discard(client)
+
+    @property
+    def data_queue(self):
+        return self._data['data_queue']
+
+    @property
+    def websocket_clients(self):
+        with self._lock:
+            return len(self._data['websocket_clients'])
+
+
+class SharedIoTDataBase(ThreadSafeIoTData):
+    """
+    Base for backends whose latest/history live outside this process.
+
+    The ingest queue and WebSocket client set stay worker-local: each worker
+    persists what it received, but every worker publishes into and reads from
+    the same shared state. Decoded snapshots are cached per version so
+    repeated reads between updates cost a single version check.
+
+    Listeners are driven by a watcher thread that follows the shared version,
+    so updates published by any worker reach this worker's subscribers. The
+    same watcher feeds this process's LiveColumns, which serve per-asset
+    deltas.
+    """
+    WATCH_INTERVAL = 0.01
+
+    def __init__(self):
+        super().__init__(HISTORY_SIZE)
+        self._cache_lock = threading.Lock()
+        self._cached = None
+        self._watcher = None
+
+    def _publish(self, services_data, timestamp):
+        raise NotImplementedError
+
+    def _read_version(self):
+        raise NotImplementedError
+
+    def _read_state(self, since=0):
+        """
+        Return (version, last_updated, oldest, entries): `oldest` is the first
+        version still held and `entries` the [(version, timestamp, services), ...]
+        newer than `since`, oldest first.
+        """
+        raise NotImplementedError
+
+    def atomic_update(self, services_data):
+        timestamp = datetime.now().isoformat() + 'Z'
+        self._publish(services_data, timestamp)
+        return timestamp
+
+    def add_listener(self, callback):
+        super().add_listener(callback)
+        with self._lock:
+            if self._watcher is None or self._watcher[0] != os.getpid():
+                thread = threading.Thread(target=self._watch, daemon=True)
+                self._watcher = (os.getpid(), thread)
+                thread.start()
+
+    def _watch(self):
+        last_seen = self._read_version_safe()
+        while True:
+            time.sleep(self.WATCH_INTERVAL)
+            version = self._read_version_safe()
+            if version is None or version == last_seen:
+                continue
+            try:
+                entries = self.updates_since(last_seen or 0)
+                if entries is None:
+                    # Fell further behind than the history reaches - jump to latest
+                    entries = self.history_entries(1)[1]
+            except Exception as e:
+                print(f"⚠️ Live state watcher error: {e}")
+                continue
+            for entry_version, timestamp, services_data in entries:
+                changes, removed = self._columns.append(entry_version, timestamp, services_data)
+                self._notify(entry_version, timestamp, services_data, changes, removed)
+            if entries:
+                last_seen = entries[-1][0]
+
+    def _read_version_safe(self):
+        try:
+            return self._read_version()
+        except Exception:
+            return None
+
+    def _shared_state(self):
+        version = self._read_version()
+        with self._cache_lock:
+            cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached
+        # Only decode what was published since the cached version; a shared
+        # state that went backwards (recreated) is read in full
+        since = cached[0] if cached is not None and cached[0] < version else 0
+        version, last_updated, oldest, entries = self._read_state(since)
+        if since:
+            entries = [entry for entry in cached[2] if entry[0] >= oldest] + entries
+        state = (version, last_updated, entries)
+        with self._cache_lock:
+            if self._cached is None or self._cached[0] <= version:
+                self._cached = state
+        return state
+
+    def history_entries(self, limit=None):
+        version, _, entries = self._shared_state()
+        return version, entries[-limit:] if limit else entries
+
+    def updates_since(self, version):
+        current, entries = self.history_entries()
+        if version > current:
+            return None
+        if version == current:
+            return []
+        if not entries or entries[0][0] > version + 1:
+            return None
+        return [entry for entry in entries if entry[0] > version]
+
+    def get_snapshot(self, include_history=True):
+        version, last_updated, entries = self._shared_state()
+        latest = entries[-1][2] if entries else None
+        with self._lock:
+            websocket_clients = self._data['websocket_clients'].copy()
+        return {
+            'services': latest or [],
+            'last_updated': last_updated,
+            'latest': latest or None,
+            'history': [services for _, _, services in entries] if include_history else [],
+            'history_count': len(entries),
+            'version': version,
+            'websocket_clients': websocket_clients,
+            'queue_size': self._data['data_queue'].qsize()
+        }
+
+# ==================== SHARED-MEMORY BACKEND ====================
+
+def _decode_timestamp(raw):
+    return raw.rstrip(b'\0').decode('ascii') or None
+
+class SharedMemoryIoTData(SharedIoTDataBase):
+    """
+    Live state in an mmap-backed file (on /dev/shm by default) shared by all
+    workers on the host.
+
+    Layout: a fixed header followed by HISTORY_SIZE fixed-size slots used as a
+    ring buffer. Each slot holds one JSON-encoded services list. Writers take
+    an exclusive flock, readers a shared one, so no reader ever observes a
+    half-written slot.
+
+    IOT_LIVE_STATE_SLOT_BYTES is the starting slot size: an update that does
+    not fit doubles it until it does, growing the file, and every process
+    remaps once it sees the new size in the header.
+    """
+    MAGIC = b'IOTS'
+    HEADER = struct.Struct('<4sIIIQII32s')  # magic, format, slots, slot size, version, head, count, last_updated
+    SLOT_HEADER = struct.Struct('<Q32sI')   # version, timestamp, payload length
+    FORMAT_VERSION = 2
+
+    def __init__(self, path=None, slot_bytes=None, slots=HISTORY_SIZE):
+        super().__init__()
+        self.path = path or LIVE_STATE_PATH
+        self.slot_bytes = slot_bytes or LIVE_STATE_SLOT_BYTES
+        self.slots = slots
+        self._open_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @property
+    def _size(self):
+        return self.HEADER.size + self.slots * self.slot_bytes
+
+    def _ensure_open(self):
+        # flock is tied to the open file description, so a descriptor
+        # inherited across fork (gunicorn --preload) must be reopened
+        if self._pid == os.getpid():
+            return
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, self.HEADER.size, 0)
+                magic, fmt, slots, slot_bytes = (
+                    self.HEADER.unpack(header)[:4] if len(header) == self.HEADER.size else (None,) * 4
+                )
+                if (magic, fmt, slots) == (self.MAGIC, self.FORMAT_VERSION, self.slots) \
+                        and slot_bytes >= self.slot_bytes \
+                        and os.fstat(fd).st_size == self.HEADER.size + slots * slot_bytes:
+                    # Another process already grew the slots - keep its layout
+                    self.slot_bytes = slot_bytes
+                    mapped = mmap.mmap(fd, self._size)
+                else:
+                    os.ftruncate(fd, self._size)
+                    mapped = mmap.mmap(fd, self._size)
+                    self.HEADER.pack_into(
+                        mapped, 0, self.MAGIC, self.FORMAT_VERSION, self.slots, self.slot_bytes, 0, 0, 0, b''
+                    )
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd, self._map, self._pid = fd, mapped, os.getpid()
+
+    def _sync_layout(self):
+        """Remap if another process grew the slots; call holding the flock"""
+        slot_bytes = self.HEADER.unpack_from(self._map, 0)[3]
+        if slot_bytes != self.slot_bytes:
+            self.slot_bytes = slot_bytes
+            # The old map is left to the garbage collector rather than closed,
+            # as _read_version may still be reading it without the lock
+            self._map = mmap.mmap(self._fd, self._size)
+
+    def _grow(self, needed):
+        """Double the slot size until `needed` bytes fit; call holding the exclusive flock"""
+        slot_bytes = self.slot_bytes
+        while slot_bytes < needed:
+            slot_bytes *= 2
+        logger.warning("Live update of %d bytes exceeds the %d-byte slots; growing them to %d bytes (%s)",
+                       needed, self.slot_bytes, slot_bytes, self.path)
+        slots = []
+        for index in range(self.slots):
+            offset = self._slot_offset(index)
+            length = min(self.SLOT_HEADER.unpack_from(self._map, offset)[2], self.slot_bytes - self.SLOT_HEADER.size)
+            slots.append(bytes(self._map[offset:offset + self.SLOT_HEADER.size + length]))
+        header = list(self.HEADER.unpack_from(self._map, 0))
+        header[3] = slot_bytes
+        self.slot_bytes = slot_bytes
+        os.ftruncate(self._fd, self._size)
+        self._map = mmap.mmap(self._fd, self._size)
+        for index, slot in enumerate(slots):
+            offset = self._slot_offset(index)
+            self._map[offset:offset + len(slot)] = slot
+        self.HEADER.pack_into(self._map, 0, *header)
+
+    def _slot_offset(self, index):
+        return self.HEADER.size + index * self.slot_bytes
+
+    def _publish(self, services_data, timestamp):
+        body = json.dumps(services_data, separators=(',', ':'), default=str).encode('utf-8')
+        self._ensure_open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._sync_layout()
+                if self.SLOT_HEADER.size + len(body) > self.slot_bytes:
+                    self._grow(self.SLOT_HEADER.size + len(body))
+                _, _, _, _, version, head, count, _ = self.HEADER.unpack_from(self._map, 0)
+                version += 1
+                head = (head + 1) % self.slots if count else 0
+                offset = self._slot_offset(head)
+                self.SLOT_HEADER.pack_into(self._map, offset, version, timestamp.encode('ascii')[:32], len(body))
+                self._map[offset + self.SLOT_HEADER.size:offset + self.SLOT_HEADER.size + len(body)] = body
+                self.HEADER.pack_into(
+                    self._map, 0, self.MAGIC, self.FORMAT_VERSION, self.slots, self.slot_bytes,
+                    version, head, min(count + 1, self.slots), timestamp.encode('ascii')[:32]
+                )
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_version(self):
+        self._ensure_open()
+        # An 8-byte aligned read; a stale value only costs one extra decode
+        return self.HEADER.unpack_from(self._map, 0)[4]
+
+    def _read_state(self, since=0):
+        self._ensure_open()
+        # Threads share one open file description, and flock on it would
+        # convert rather than wait on a sibling's lock - serialize in-process
+        # first, then across processes.
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                self._sync_layout()
+                _, _, _, _, version, head, count, last_updated = self.HEADER.unpack_from(self._map, 0)
+                slots = []
+                oldest = version + 1
+                for i in range(count):
+                    offset = self._slot_offset((head - count + 1 + i) % self.slots)
+                    slot_version, slot_timestamp, length = self.SLOT_HEADER.unpack_from(self._map, offset)
+                    oldest = min(oldest, slot_version)
+                    if slot_version > since:
+                        start = offset + self.SLOT_HEADER.size
+                        slots.append((slot_version, slot_timestamp, self._map[start:start + length]))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        entries = [
+            (slot_version, _decode_timestamp(slot_timestamp), json.loads(body))
+            for slot_version, slot_timestamp, body in slots
+        ]
+        return version, _decode_timestamp(last_updated), oldest, entries
+
+# ==================== UNIX-SOCKET BROKER BACKEND ====================
+
+class LiveStateBrokerHandler(socketserver.BaseRequestHandler):
+    """Serve update/snapshot requests against the broker's in-process store"""
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                message = recv_frame(self.request)
+            except (OSError, IPCError, ValueError):
+                return
+            op = message.get('op')
+            if op == 'update':
+                with store._lock:
+                    store.atomic_update(message['services'])
+                    store._data['last_updated'] = message['timestamp']
+                    reply = {'version': store._data['version']}
+            elif op == 'version':
+                with store._lock:
+                    reply = {'version': store._data['version']}
+            elif op == 'snapshot':
+                since = message.get('since', 0)
+                with store._lock:
+                    entries = store.history_entries(HISTORY_SIZE)[1]
+                    reply = {
+                        'version': store._data['version'],
+                        'last_updated': store._data['last_updated'],
+                        'oldest': entries[0][0] if entries else store._data['version'] + 1,
+                        'history': [entry for entry in entries if entry[0] > since]
+                    }
+            else:
+                reply = {'error': f"Unknown op: {op}"}
+            send_frame(self.request, reply)
+
+
+class LiveStateBroker(socketserver.ThreadingUnixStreamServer):
+    """Local broker process owning the shared latest/history state"""
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        self.path = path or LIVE_STATE_SOCKET
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.store = ThreadSafeIoTData(HISTORY_SIZE)
+        super().__init__(self.path, LiveStateBrokerHandler)
+
+
+class BrokerIoTData(SharedIoTDataBase):
+    """Live state held by a LiveStateBroker reached over a Unix socket"""
+    def __init__(self, path=None):
+        super().__init__()
+        self.client = UnixSocketClient(path or LIVE_STATE_SOCKET)
+
+    def _publish(self, services_data, timestamp):
+        self.client.request({'op': 'update', 'services': services_data, 'timestamp': timestamp})
+
+    def _read_version(self):
+        return self.client.request({'op': 'version'}, idempotent=True)['version']
+
+    def _read_state(self, since=0):
+        reply = self.client.request({'op': 'snapshot', 'since': since}, idempotent=True)
+        return reply['version'], reply['last_updated'], reply['oldest'], [tuple(entry) for entry in reply['history']]
+
+# ==================== BACKEND SELECTION ====================
+
+LIVE_STATE_BACKENDS = {
+    'local': ThreadSafeIoTData,
+    'shared_memory': SharedMemoryIoTData,
+    'broker': BrokerIoTData,
+}
+
+def create_live_state(backend=None):
+    """Instantiate the configured live-state backend"""
+    backend = backend or LIVE_STATE_BACKEND
+    try:
+        return LIVE_STATE_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown IOT_LIVE_STATE_BACKEND '{backend}' (choose from {', '.join(LIVE_STATE_BACKENDS)})"
+        )
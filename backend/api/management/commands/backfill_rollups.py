@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Asset, Service
+from api.rollups import ROLLUP_MODELS, bucket_start, update_rollups
+from api.timeseries import TimeseriesQueryError, parse_time
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the 1s/1m/1h asset rollup tables from raw incoming_assets rows. "
+        "Stop ingest while it runs: rows written meanwhile would be counted twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only rebuild from this time (ISO-8601 or epoch seconds), rounded down to the hour")
+        parser.add_argument('--service', action='append', help="Only rebuild these services (repeatable)")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Raw rows merged per transaction")
+
+    def handle(self, *args, **options):
+        services = Service.objects.all()
+        if options['service']:
+            services = services.filter(name__in=options['service'])
+            missing = set(options['service']) - set(services.values_list('name', flat=True))
+            if missing:
+                raise CommandError(f"Unknown service(s): {', '.join(sorted(missing))}")
+        service_ids = dict(services.values_list('name', 'id'))
+
+        rows = Asset.objects.filter(service_id__in=service_ids.values())
+        since = None
+        if options['since']:
+            try:
+                # Align to the coarsest bucket so no rollup is left half-rebuilt
+                since = bucket_start(parse_time(options['since']), ROLLUP_MODELS[-1].resolution_seconds)
+            except TimeseriesQueryError as e:
+                raise CommandError(str(e))
+            rows = rows.filter(timestamp__gte=since)
+
+        with transaction.atomic():
+            for model in ROLLUP_MODELS:
+                existing = model.objects.filter(service_id__in=service_ids.values())
+                if since is not None:
+                    existing = existing.filter(bucket__gte=since)
+                deleted, _ = existing.delete()
+                self.stdout.write(f"🗑️ Cleared {deleted} rows from {model._meta.db_table}")
+
+        names = {service_id: name for name, service_id in service_ids.items()}
+        chunk_size = options['chunk_size']
+        chunk = []
+        total = 0
+        start = time.perf_counter()
+        for service_id, asset_id, value, asset_timestamp in rows.order_by('timestamp').values_list(
+            'service_id', 'asset_id', 'value', 'timestamp'
+        ).iterator(chunk_size=chunk_size):
+            chunk.append((names[service_id], asset_id, value, asset_timestamp))
+            if len(chunk) >= chunk_size:
+                total += self._merge(chunk, service_ids)
+                chunk = []
+        if chunk:
+            total += self._merge(chunk, service_ids)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"✅ Rolled up {total} raw rows in {elapsed:.2f}s")
+
+    def _merge(self, chunk, service_ids):
+        with transaction.atomic():
+            update_rollups(chunk, service_ids)
+        return len(chunk)
@@ -0,0 +1,188 @@
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import coalesce
+from api.aggregates import DashboardAggregates
+from api.asset_stats import AssetStatsRegistry
+from api.live_state import QUEUE_MAX_SIZE, ThreadSafeIoTData
+from api.models import Service, Asset, IncomingIoTData
+from api.snapshot_cache import SnapshotResponseCache
+
+
+def make_timed_payloads(count, services, assets_per_service, start, rate):
+    """Payloads stamped with the wall-clock time each is due to be sent at `rate` per second"""
+    payloads = []
+    for i in range(count):
+        send_at = start + i / rate
+        timestamp = datetime.fromtimestamp(send_at, dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+        payloads.append((send_at, {
+            'services': [
+                {
+                    'name': f'service_{s}',
+                    'assets': [
+                        {'id': f'asset_{a}', 'value': (i + a) % 1000 / 10.0, 'timestamp': timestamp}
+                        for a in range(assets_per_service)
+                    ]
+                }
+                for s in range(services)
+            ]
+        }))
+    return payloads
+
+
+def create_store():
+    """An in-process live state with the listeners the views attach (minus the streams)"""
+    store = ThreadSafeIoTData()
+    snapshots = SnapshotResponseCache()
+    store.add_listener(lambda version, timestamp, services_data, changes, removed:
+                       snapshots.update(version, timestamp, services_data))
+    store.add_listener(AssetStatsRegistry().on_update)
+    store.add_listener(DashboardAggregates().on_update)
+    return store
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the ingest queue above its sustainable rate: FIFO versus coalescing "
+        "(IOT_INGEST_MODE), reporting 503s, drops, coalesced readings and live-state staleness"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--services', type=int, default=4)
+        parser.add_argument('--assets', type=int, default=10, help="Assets per service")
+        parser.add_argument('--duration', type=float, default=3.0, help="Seconds of offered load per run")
+        parser.add_argument('--multipliers', default='2,5,10', help="Offered rates as multiples of the sustainable rate")
+        parser.add_argument('--calibrate-payloads', type=int, default=1000)
+        parser.add_argument('--mode', action='append', choices=coalesce.INGEST_MODES, help="Mode(s) to run (default: both)")
+
+    def handle(self, *args, **options):
+        # Run against a throwaway on-disk database so commit costs are realistic
+        with tempfile.TemporaryDirectory() as tmpdir:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self._run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, options):
+        sustainable = self._calibrate(options)
+        self.stdout.write(
+            f"📊 Sustainable FIFO rate: {sustainable:.0f} payloads/s "
+            f"({options['services'] * options['assets']} assets per payload)"
+        )
+
+        for multiplier in [float(m) for m in options['multipliers'].split(',')]:
+            for mode in options['mode'] or coalesce.INGEST_MODES:
+                self._reset()
+                result = self._offer(mode, sustainable * multiplier, options)
+                self.stdout.write(
+                    f"{mode:>8} x{multiplier:<4g}: offered {result['offered']:6d}  accepted {result['accepted']:6d}  "
+                    f"503s {result['rejected']:6d}  dropped {result['dropped']:6d}  "
+                    f"coalesced {result['coalesced']:8d} readings  updates {result['updates']:6d}  "
+                    f"staleness p50 {result['p50'] * 1000:7.0f}ms p99 {result['p99'] * 1000:7.0f}ms  "
+                    f"drain {result['drain']:5.2f}s  rows {result['rows']}/{result['expected_rows']}"
+                )
+
+    def _calibrate(self, options):
+        """Payloads per second the FIFO pipeline sustains with a full queue"""
+        self._reset()
+        count = options['calibrate_payloads']
+        data_queue = queue.Queue()
+        for send_at, payload in make_timed_payloads(count, options['services'], options['assets'], time.time(), 1000.0):
+            data_queue.put((payload, datetime.now()))
+        store = create_store()
+        start = time.perf_counter()
+        while not data_queue.empty():
+            coalesce.process_next_batch(data_queue, store)
+        return count / (time.perf_counter() - start)
+
+    def _offer(self, mode, rate, options):
+        count = int(rate * options['duration'])
+        start = time.time() + 0.2
+        payloads = make_timed_payloads(count, options['services'], options['assets'], start, rate)
+        data_queue = coalesce.create_ingest_queue(QUEUE_MAX_SIZE, mode)
+        store = create_store()
+        producing = threading.Event()
+        producing.set()
+        updates = [0]
+
+        def process():
+            try:
+                while producing.is_set() or not data_queue.empty():
+                    try:
+                        updates[0] += coalesce.process_next_batch(data_queue, store)[1]
+                    except queue.Empty:
+                        continue
+            finally:
+                connection.close()
+
+        staleness = []
+
+        def sample():
+            while producing.is_set():
+                services = store.get_snapshot(include_history=False)['services']
+                if services:
+                    newest = datetime.fromisoformat(services[0]['assets'][0]['timestamp'].replace('Z', '+00:00'))
+                    staleness.append(max(time.time() - newest.timestamp(), 0.0))
+                time.sleep(0.01)
+
+        processor = threading.Thread(target=process, daemon=True)
+        sampler = threading.Thread(target=sample, daemon=True)
+        processor.start()
+        sampler.start()
+
+        rejected = 0
+        for send_at, payload in payloads:
+            delay = send_at - time.time()
+            if delay > 0.001:
+                time.sleep(delay)
+            try:
+                data_queue.put((payload, datetime.now()), block=False)
+            except queue.Full:
+                rejected += 1
+
+        drain_start = time.perf_counter()
+        producing.clear()
+        processor.join()
+        if isinstance(data_queue, coalesce.CoalescingQueue):
+            data_queue.wait_persisted()
+        drain = time.perf_counter() - drain_start
+        sampler.join()
+
+        metrics = coalesce.ingest_metrics(data_queue)
+        dropped = metrics.get('dropped', 0)
+        assets_per_payload = options['services'] * options['assets']
+        return {
+            'offered': count,
+            'accepted': count - rejected - dropped,
+            'rejected': rejected,
+            'dropped': dropped,
+            'coalesced': metrics.get('coalesced_readings', 0),
+            'updates': updates[0],
+            'p50': percentile(staleness, 0.5),
+            'p99': percentile(staleness, 0.99),
+            'drain': drain,
+            'rows': Asset.objects.count(),
+            'expected_rows': (count - rejected - dropped) * assets_per_payload
+        }
+
+    def _reset(self):
+        Asset.objects.all().delete()
+        IncomingIoTData.objects.all().delete()
+        Service.objects.all().delete()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from api.config_proxy import CraneConfigProxy, CRANE_CONFIG_PATH
+from api.upstream import CircuitBreaker, UpstreamGateway, UpstreamError
+
+
+class StandInUpstream:
+    """
+    Local stand-in for the Flask server's /api/crane-config on a free port:
+    GET returns the stored config after `delay` seconds, POST replaces it.
+    With `failing` set every request answers 500; stop() refuses connections.
+    Counts requests and the TCP connections they arrived on.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.failing = False
+        self.config = {"crane_id": "stand-in", "revision": 0}
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with upstream._lock:
+                    upstream.connections += 1
+
+            def do_GET(self):
+                upstream._count()
+                time.sleep(upstream.delay)
+                self._reply({"data": upstream.config} if self.path == CRANE_CONFIG_PATH else None)
+
+            def do_POST(self):
+                upstream._count()
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == CRANE_CONFIG_PATH and not upstream.failing:
+                    upstream.config = json.loads(body)
+                self._reply({"success": True} if self.path == CRANE_CONFIG_PATH else None)
+
+            def _reply(self, payload):
+                status = 500 if upstream.failing else (200 if payload is not None else 404)
+                body = json.dumps(payload or {"error": "stand-in"}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def stop(self):
+        if not self._stopped:
+            self._stopped = True
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark /api/proxy/config against a local stand-in for the Flask server: "
+        "the old per-request fetch versus the cached proxy on the async gateway, with a "
+        "slow, updated, failing and hung upstream"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reads', type=int, default=2000)
+        parser.add_argument('--delay-ms', type=float, default=200, help="Upstream response delay")
+        parser.add_argument('--ttl', type=float, default=0.5, help="Cache TTL in seconds")
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options['reads'], options['delay_ms'] / 1000, options['ttl']))
+
+    async def _run(self, reads, delay, ttl):
+        upstream = StandInUpstream(delay)
+        gateway = UpstreamGateway(
+            base_url=upstream.base_url, timeout=delay + 1,
+            breaker=CircuitBreaker(failures=3, reset_seconds=60)
+        )
+        proxy = CraneConfigProxy(gateway=gateway, ttl_seconds=ttl)
+        self.stdout.write(f"📊 stand-in upstream at {upstream.base_url}, {delay * 1000:.0f} ms per GET")
+
+        try:
+            # Old behaviour: one new connection and one blocking round trip per read
+            samples = []
+            for _ in range(min(reads, 10)):
+                start = time.perf_counter()
+                await asyncio.to_thread(requests.get, upstream.base_url + CRANE_CONFIG_PATH, timeout=delay + 2)
+                samples.append(time.perf_counter() - start)
+            self._report('uncached', samples)
+
+            start = time.perf_counter()
+            entry, state = await proxy.get()
+            self._report(f'cold ({state})', [time.perf_counter() - start])
+            self._report('warm (hit)', await self._reads(proxy, reads))
+
+            # Past the TTL: served stale while one background request revalidates
+            await asyncio.sleep(ttl)
+            requests_before = upstream.requests
+            self._report('expired (stale)', await self._reads(proxy, reads))
+            await asyncio.sleep(delay + 0.1)
+            entry, state = await proxy.get()
+            self.stdout.write(
+                f"   {upstream.requests - requests_before} upstream request(s) for {reads} expired reads, "
+                f"cache age now {entry.age():.3f}s"
+            )
+
+            # A write lands upstream and drops the cache: the next read is new
+            status = await proxy.update({"crane_id": "stand-in", "revision": 1})
+            entry, state = await proxy.get()
+            revision = json.loads(entry.body)['data'].get('revision')
+            self.stdout.write(f"✅ update -> {status}, next read {state} with revision {revision}")
+
+            # Concurrent cold reads share a single upstream call
+            proxy.invalidate()
+            requests_before = upstream.requests
+            await asyncio.gather(*(proxy.get() for _ in range(50)))
+            self.stdout.write(f"✅ 50 concurrent cold reads -> {upstream.requests - requests_before} upstream call(s)")
+
+            # Upstream failing: the last good config keeps being served
+            upstream.failing = True
+            await asyncio.sleep(ttl)
+            await proxy.get()
+            await asyncio.sleep(delay + 0.1)
+            entry, state = await proxy.get()
+            self.stdout.write(f"✅ upstream 500: served {state} {entry.status}, age {entry.age():.3f}s")
+
+            # Upstream hung (answers after the timeout): calls fail after the
+            # timeout until the breaker opens, then fail without calling
+            upstream.failing = False
+            upstream.delay = gateway.timeout + 1
+            proxy.invalidate()
+            for attempt in range(gateway.breaker.failure_threshold + 2):
+                start = time.perf_counter()
+                entry, state = await proxy.get()
+                self.stdout.write(
+                    f"   hung upstream read {attempt + 1}: {entry.status} in {(time.perf_counter() - start) * 1000:8.1f} ms "
+                    f"(circuit {gateway.breaker.state})"
+                )
+            samples = []
+            for _ in range(reads):
+                start = time.perf_counter()
+                try:
+                    await gateway.post(CRANE_CONFIG_PATH, json={})
+                except UpstreamError:
+                    pass
+                samples.append(time.perf_counter() - start)
+            self._report('circuit open', samples)
+            self.stdout.write(
+                f"📊 {upstream.requests} upstream requests over {upstream.connections} connections; "
+                f"proxy {proxy.get_metrics()}"
+            )
+        finally:
+            await asyncio.to_thread(gateway.close)
+            upstream.stop()
+
+    async def _reads(self, proxy, count):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await proxy.get()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def _report(self, label, samples):
+        samples = sorted(samples)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        self.stdout.write(
+            f"{label:>16}: {len(samples):6d} reads  p50 {statistics.median(samples) * 1e6:10.1f} µs  "
+            f"p99 {p99 * 1e6:10.1f} µs"
+        )
@@ -0,0 +1,94 @@
+import gzip
+import json
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from api.batch_ingest import msgpack
+from api.management.commands.bench_ingest import make_payloads
+
+MODES = ('single', 'json', 'ndjson', 'msgpack')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark HTTP ingest against a running server: one POST per payload to "
+        "/api/iot-data/receive versus batches to /api/iot-data/receive/batch"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server base URL")
+        parser.add_argument('--payloads', type=int, default=2000)
+        parser.add_argument('--services', type=int, default=4)
+        parser.add_argument('--assets', type=int, default=10, help="Assets per service")
+        parser.add_argument('--batch-size', type=int, default=500, help="Payloads per batch request")
+        parser.add_argument('--mode', action='append', choices=MODES, help="Mode(s) to run (default: all available)")
+        parser.add_argument('--gzip', action='store_true', help="gzip batch bodies")
+
+    def handle(self, *args, **options):
+        modes = options['mode'] or [m for m in MODES if m != 'msgpack' or msgpack is not None]
+        if 'msgpack' in modes and msgpack is None:
+            raise CommandError("--mode msgpack needs the 'msgpack' package")
+
+        session = requests.Session()
+        payload_count = options['payloads']
+        total_assets = payload_count * options['services'] * options['assets']
+        self.stdout.write(f"📊 {payload_count} payloads, {total_assets} assets per mode against {options['url']}")
+
+        for mode in modes:
+            # Fresh timestamps per mode so no reading is a duplicate
+            payloads = make_payloads(payload_count, options['services'], options['assets'])
+            offset = MODES.index(mode)
+            for payload in payloads:
+                for service in payload['services']:
+                    service['name'] = f"{service['name']}_{mode}"
+                    for asset in service['assets']:
+                        asset['timestamp'] = asset['timestamp'].replace('2025-', f'{2030 + offset}-')
+
+            start = time.perf_counter()
+            requests_sent, rejected, busy, body_bytes = self._send(session, mode, payloads, options)
+            elapsed = time.perf_counter() - start
+            label = mode if mode == 'single' else f"{mode}{'+gzip' if options['gzip'] else ''}"
+            self.stdout.write(
+                f"{label:>12}: {elapsed:7.3f}s  {requests_sent:6d} requests  "
+                f"{total_assets / elapsed:9.0f} assets/s  {elapsed / total_assets * 1e6:7.1f} µs/asset  "
+                f"{body_bytes / total_assets:6.1f} B/asset  503s: {busy}  rejected: {rejected}"
+            )
+
+    def _send(self, session, mode, payloads, options):
+        url = options['url'].rstrip('/')
+        requests_sent = rejected = busy = body_bytes = 0
+        if mode == 'single':
+            for payload in payloads:
+                body = json.dumps(payload).encode('utf-8')
+                response = session.post(f"{url}/api/iot-data/receive", data=body,
+                                        headers={'Content-Type': 'application/json'})
+                requests_sent += 1
+                body_bytes += len(body)
+                busy += response.status_code == 503
+            return requests_sent, rejected, busy, body_bytes
+
+        batch_size = options['batch_size']
+        for i in range(0, len(payloads), batch_size):
+            chunk = payloads[i:i + batch_size]
+            if mode == 'json':
+                body, content_type = json.dumps(chunk).encode('utf-8'), 'application/json'
+            elif mode == 'ndjson':
+                body = '\n'.join(json.dumps(payload) for payload in chunk).encode('utf-8')
+                content_type = 'application/x-ndjson'
+            else:
+                body, content_type = msgpack.packb(chunk), 'application/msgpack'
+            headers = {'Content-Type': content_type}
+            if options['gzip']:
+                body = gzip.compress(body, compresslevel=5)
+                headers['Content-Encoding'] = 'gzip'
+            response = session.post(f"{url}/api/iot-data/receive/batch", data=body, headers=headers)
+            requests_sent += 1
+            body_bytes += len(body)
+            if response.status_code == 503:
+                busy += 1
+            else:
+                rejected += response.json().get('rejected', 0)
+        return requests_sent, rejected, busy, body_bytes
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import ingest
+from api.models import Service, Asset, IncomingIoTData
+
+
+def make_payloads(count, services, assets_per_service):
+    """Build synthetic crane payloads with unique, increasing timestamps"""
+    start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+    payloads = []
+    for i in range(count):
+        timestamp = (start + timedelta(milliseconds=10 * i)).isoformat().replace('+00:00', 'Z')
+        payloads.append({
+            'services': [
+                {
+                    'name': f'service_{s}',
+                    'assets': [
+                        {'id': f'asset_{a}', 'value': (i + a) % 1000 / 10.0, 'timestamp': timestamp}
+                        for a in range(assets_per_service)
+                    ]
+                }
+                for s in range(services)
+            ]
+        })
+    return payloads
+
+
+def legacy_process(external_data):
+    """Per-payload write path used before batching: one create/get_or_create per row"""
+    incoming_data = IncomingIoTData.objects.create(raw_data=external_data, total_services=0, total_assets=0)
+    total_assets = 0
+    services_data = ingest.extract_services(external_data)
+    for service_data in services_data:
+        service, created = Service.objects.get_or_create(name=service_data['name'])
+        for asset_data in service_data.get('assets', []):
+            Asset.objects.create(
+                service=service,
+                asset_id=asset_data['id'],
+                value=str(asset_data['value']),
+                timestamp=ingest.parse_asset_timestamp(asset_data.get('timestamp'))
+            )
+            total_assets += 1
+    incoming_data.total_services = len(services_data)
+    incoming_data.total_assets = total_assets
+    incoming_data.processed = True
+    incoming_data.save()
+
+
+class Command(BaseCommand):
+    help = "Benchmark sustained ingest throughput (assets/second) of the per-payload and batched write paths"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=500)
+        parser.add_argument('--services', type=int, default=4)
+        parser.add_argument('--assets', type=int, default=10, help="Assets per service")
+        parser.add_argument('--batch-size', type=int, default=ingest.INGEST_BATCH_SIZE)
+        parser.add_argument('--skip-legacy', action='store_true', help="Only run the batched path")
+
+    def handle(self, *args, **options):
+        # Run against a throwaway on-disk database so commit costs are realistic
+        with tempfile.TemporaryDirectory() as tmpdir:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self._run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, options):
+        payload_count = options['payloads']
+        assets_per_payload = options['services'] * options['assets']
+        total_assets = payload_count * assets_per_payload
+        self.stdout.write(
+            f"📊 {payload_count} payloads x {assets_per_payload} assets = {total_assets} asset rows"
+        )
+
+        results = {}
+        if not options['skip_legacy']:
+            payloads = make_payloads(payload_count, options['services'], options['assets'])
+            self._reset()
+            start = time.perf_counter()
+            for external_data in payloads:
+                legacy_process(external_data)
+            results['per-payload'] = time.perf_counter() - start
+
+        payloads = make_payloads(payload_count, options['services'], options['assets'])
+        self._reset()
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        for i in range(0, payload_count, batch_size):
+            ingest.process_payloads(payloads[i:i + batch_size])
+        results[f'batched({batch_size})'] = time.perf_counter() - start
+
+        if Asset.objects.count() != total_assets:
+            self.stderr.write(f"⚠️ Expected {total_assets} asset rows, found {Asset.objects.count()}")
+
+        for name, elapsed in results.items():
+            self.stdout.write(
+                f"{name:>16}: {elapsed:8.3f}s  {total_assets / elapsed:10.0f} assets/s  "
+                f"{payload_count / elapsed:8.0f} payloads/s"
+            )
+
+    def _reset(self):
+        Asset.objects.all().delete()
+        IncomingIoTData.objects.all().delete()
+        Service.objects.all().delete()
@@ -0,0 +1,82 @@
+import os
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand
+
+from api import ingest
+from api.management.commands.bench_ingest import make_payloads
+from api.parallel_ingest import NormalizerPool
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark payload normalization (timestamp parsing, row building) on the processor "
+        "thread versus the IOT_INGEST_WORKERS process pool, at increasing worker counts"
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=4000)
+        parser.add_argument('--services', type=int, default=16, help="Services per payload (the shard key)")
+        parser.add_argument('--assets', type=int, default=10, help="Assets per service")
+        parser.add_argument('--batch-size', type=int, default=ingest.INGEST_BATCH_SIZE)
+        parser.add_argument('--workers', default=None,
+                            help="Comma-separated worker counts (default: 1, 2, 4 ... up to the CPU count)")
+
+    def handle(self, *args, **options):
+        payloads = make_payloads(options['payloads'], options['services'], options['assets'])
+        batch_size = options['batch_size']
+        batches = [payloads[i:i + batch_size] for i in range(0, len(payloads), batch_size)]
+        total_assets = options['payloads'] * options['services'] * options['assets']
+        cpus = os.cpu_count() or 1
+        if options['workers']:
+            worker_counts = [int(count) for count in options['workers'].split(',')]
+        else:
+            worker_counts = [1]
+            while worker_counts[-1] * 2 <= cpus:
+                worker_counts.append(worker_counts[-1] * 2)
+            if worker_counts[-1] != cpus:
+                worker_counts.append(cpus)
+        self.stdout.write(f"📊 {len(payloads)} payloads, {total_assets} assets, {cpus} CPUs")
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        expected = [ingest.normalize_payload(external_data) for batch in batches for external_data in batch]
+        baseline = time.perf_counter() - start
+        self._report('in-process', baseline, baseline, time.process_time() - cpu_start, len(payloads), total_assets)
+
+        for workers in worker_counts:
+            pool = NormalizerPool(workers)
+            try:
+                # Start the processes (and their django.setup()) outside the timing
+                pool.normalize(batches[0])
+                start, cpu_start = time.perf_counter(), time.process_time()
+                normalized = self._pipelined(pool, batches, 2 * workers)
+                elapsed = time.perf_counter() - start
+                cpu = time.process_time() - cpu_start
+            finally:
+                pool.shutdown()
+            if normalized != expected:
+                self.stderr.write(f"⚠️ {workers} workers: results differ from in-process normalization")
+            self._report(f'{workers} workers', elapsed, baseline, cpu, len(payloads), total_assets)
+
+    def _pipelined(self, pool, batches, max_in_flight):
+        """Normalize every batch keeping `max_in_flight` ahead, collecting results in order"""
+        normalized = []
+        in_flight = deque()
+        for batch in batches:
+            if len(in_flight) >= max_in_flight:
+                normalized.extend(pool.result(in_flight.popleft()))
+            in_flight.append(pool.submit(batch))
+        while in_flight:
+            normalized.extend(pool.result(in_flight.popleft()))
+        return normalized
+
+    def _report(self, label, elapsed, baseline, cpu, payload_count, total_assets):
+        # CPU spent in this process (splitting, encoding, reassembling) is
+        # what no number of workers can take off the committer
+        self.stdout.write(
+            f"{label:>12}: {elapsed:7.3f}s  {payload_count / elapsed:8.0f} payloads/s  "
+            f"{total_assets / elapsed:10.0f} assets/s  x{baseline / elapsed:4.2f}  "
+            f"committer CPU {cpu / payload_count * 1e6:6.0f} µs/payload (ceiling {payload_count / cpu:6.0f} payloads/s)"
+        )
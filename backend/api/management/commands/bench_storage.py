@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import ingest
+from api.models import Service, Asset, IncomingIoTData
+from api.service_cache import service_cache
+from api.storage import STORAGE_BACKENDS, create_storage
+from api.management.commands.bench_ingest import make_payloads
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rows/second of the storage backends on a throwaway copy of the default database. "
+        "Run once per IOT_DB_ENGINE to compare SQLite with PostgreSQL."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payloads', type=int, default=2000)
+        parser.add_argument('--services', type=int, default=4)
+        parser.add_argument('--assets', type=int, default=10, help="Assets per service")
+        parser.add_argument('--batch-size', type=int, default=ingest.INGEST_BATCH_SIZE)
+        parser.add_argument(
+            '--backend', action='append', choices=sorted(STORAGE_BACKENDS),
+            help="Backend(s) to run (default: every backend the database supports)"
+        )
+
+    def handle(self, *args, **options):
+        backends = options['backend'] or (
+            ['sqlite', 'postgresql'] if connection.vendor == 'postgresql' else ['sqlite']
+        )
+        if 'postgresql' in backends and connection.vendor != 'postgresql':
+            raise CommandError("The postgresql backend needs IOT_DB_ENGINE=postgresql")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if connection.vendor == 'sqlite':
+                # On-disk, so commit costs are realistic
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self._run(backends, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, backends, options):
+        payload_count = options['payloads']
+        total_assets = payload_count * options['services'] * options['assets']
+        batch_size = options['batch_size']
+        self.stdout.write(
+            f"📊 {connection.vendor}: {payload_count} payloads, {total_assets} asset rows, batches of {batch_size}"
+        )
+
+        for backend in backends:
+            storage = create_storage(backend)
+            payloads = make_payloads(payload_count, options['services'], options['assets'])
+            normalized = [ingest.normalize_payload(external_data) for external_data in payloads]
+            self._reset()
+
+            start = time.perf_counter()
+            for i in range(0, payload_count, batch_size):
+                storage.persist_batch(payloads[i:i + batch_size], normalized[i:i + batch_size])
+            elapsed = time.perf_counter() - start
+
+            stored = Asset.objects.count()
+            if stored != total_assets:
+                self.stderr.write(f"⚠️ {backend}: expected {total_assets} asset rows, found {stored}")
+            self.stdout.write(
+                f"{backend:>12}: {elapsed:8.3f}s  {total_assets / elapsed:10.0f} rows/s  "
+                f"{payload_count / elapsed:8.0f} payloads/s"
+            )
+
+    def _reset(self):
+        Asset.objects.all().delete()
+        IncomingIoTData.objects.all().delete()
+        Service.objects.all().delete()
+        service_cache.invalidate()
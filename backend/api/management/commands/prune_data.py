@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import retention
+
+
+class Command(BaseCommand):
+    help = "Apply IOT_RETENTION_POLICIES now: delete aged rows in small chunks, optionally compacting SQLite"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that would be deleted")
+        parser.add_argument('--chunk-size', type=int, default=retention.RETENTION_CHUNK_ROWS, help="Rows per DELETE")
+        parser.add_argument('--pause-ms', type=int, default=retention.RETENTION_CHUNK_PAUSE_MS, help="Pause between chunks")
+        parser.add_argument('--vacuum', action='store_true', help="Run PRAGMA incremental_vacuum afterwards")
+        parser.add_argument('--vacuum-pages', type=int, default=0, help="Pages to free with --vacuum (0 = all)")
+        parser.add_argument(
+            '--enable-incremental-vacuum', action='store_true',
+            help="Switch SQLite to auto_vacuum=INCREMENTAL (one full VACUUM; stop ingest first)"
+        )
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if connection.vendor != 'sqlite':
+                raise CommandError("Incremental VACUUM only applies to SQLite")
+            size_before, _ = retention.database_size()
+            retention.enable_incremental_vacuum()
+            size_after, _ = retention.database_size()
+            self.stdout.write(f"🗜️ auto_vacuum=INCREMENTAL enabled; full VACUUM reclaimed {size_before - size_after} bytes")
+
+        deleted = retention.prune_all(
+            chunk_rows=options['chunk_size'],
+            pause_ms=options['pause_ms'],
+            dry_run=options['dry_run']
+        )
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        for table, count in deleted.items():
+            self.stdout.write(f"🧹 {verb} {count} rows from {table} (older than {retention.RETENTION_POLICIES[table]}s)")
+        if not deleted:
+            self.stdout.write("No retention policies configured")
+
+        if options['vacuum'] and not options['dry_run']:
+            reclaimed = retention.incremental_vacuum(options['vacuum_pages'] or None)
+            if reclaimed is None:
+                self.stdout.write("⚠️ Incremental VACUUM unavailable (not SQLite, or run --enable-incremental-vacuum once)")
+            else:
+                self.stdout.write(f"🗜️ Incremental VACUUM reclaimed {reclaimed} bytes")
+
+        size = retention.database_size()
+        if size is not None:
+            self.stdout.write(f"💾 Database: {size[0]} bytes, {size[1]} free pages")
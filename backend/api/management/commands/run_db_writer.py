@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.db_writer import DB_WRITER_MAX_BATCH, DB_WRITER_SOCKET, DatabaseWriterServer
+from api.retention import start_background_pruner
+from api.service_cache import service_cache
+
+
+class Command(BaseCommand):
+    help = "Run the single database writer that owns all IoT data writes for IOT_DB_WRITER=process"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=DB_WRITER_SOCKET, help="Unix socket path to listen on")
+        parser.add_argument('--max-batch', type=int, default=DB_WRITER_MAX_BATCH, help="Max payloads per commit")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"🗂️ Service cache warmed with {service_cache.warm()} services")
+        server = DatabaseWriterServer(options['socket'], options['max_batch'])
+        # Retention deletes are writes too, so they belong to this process
+        start_background_pruner()
+        self.stdout.write(f"💾 Database writer listening on {server.path} (max batch: {server.max_batch})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
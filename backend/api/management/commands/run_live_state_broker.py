@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.live_state import LIVE_STATE_SOCKET, LiveStateBroker
+
+
+class Command(BaseCommand):
+    help = "Run the Unix-socket broker that holds live IoT state for IOT_LIVE_STATE_BACKEND=broker"
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=LIVE_STATE_SOCKET, help="Unix socket path to listen on")
+
+    def handle(self, *args, **options):
+        broker = LiveStateBroker(options['socket'])
+        self.stdout.write(f"📡 Live state broker listening on {broker.path}")
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.server_close()
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from api import mqtt_bridge
+from api.db_writer import create_db_writer
+from api.live_state import LIVE_STATE_BACKEND, create_live_state
+from api.service_cache import service_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Subscribe to MQTT topics and ingest their payloads in batches, acknowledging after persistence. "
+        "Updates reach the web workers through a shared IOT_LIVE_STATE_BACKEND (shared_memory or broker)."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=mqtt_bridge.MQTT_HOST)
+        parser.add_argument('--port', type=int, default=mqtt_bridge.MQTT_PORT)
+        parser.add_argument('--client-id', default=mqtt_bridge.MQTT_CLIENT_ID)
+        parser.add_argument(
+            '--topic', action='append',
+            help="Topic pattern, repeatable; a {service} level names the service (default: IOT_MQTT_TOPICS)"
+        )
+        parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=mqtt_bridge.MQTT_QOS)
+        parser.add_argument('--batch-size', type=int, default=None, help="Max messages per commit")
+
+    def handle(self, *args, **options):
+        if LIVE_STATE_BACKEND == 'local':
+            self.stderr.write("⚠️ IOT_LIVE_STATE_BACKEND=local: web workers will not see MQTT updates live")
+        self.stdout.write(f"🗂️ Service cache warmed with {service_cache.warm()} services")
+
+        client = mqtt_bridge.create_mqtt_client(options['client_id'])
+        bridge = mqtt_bridge.MqttIngestBridge(
+            client,
+            topics=options['topic'],
+            qos=options['qos'],
+            store=create_live_state(),
+            writer=create_db_writer(),
+            batch_size=options['batch_size']
+        )
+        bridge.start()
+        self.stdout.write(f"📡 MQTT bridge connecting to {options['host']}:{options['port']}")
+        client.connect(options['host'], options['port'], mqtt_bridge.MQTT_KEEPALIVE)
+        try:
+            client.loop_forever(retry_first_connection=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            bridge.stop()
+            client.disconnect()
+            self.stdout.write(f"📊 {bridge.stats}")
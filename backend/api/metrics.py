@@ -0,0 +1,420 @@
+# metrics.py - Low-overhead counters and histograms, aggregated across workers
+from django.conf import settings
+from bisect import bisect_left
+import fcntl
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+# ==================== CONFIGURATION ====================
+# Each process writes its values to <IOT_METRICS_DIR>/<pid>.json every
+# METRICS_FLUSH_SECONDS; /metrics sums the files of all processes. Empty
+# disables the files and /metrics shows this process only.
+METRICS_DIR = getattr(settings, 'IOT_METRICS_DIR', '/dev/shm/iot_metrics')
+METRICS_FLUSH_SECONDS = getattr(settings, 'IOT_METRICS_FLUSH_SECONDS', 1.0)
+# Sampled log lines: at most one per event and interval, with totals since the last
+LOG_SAMPLE_SECONDS = getattr(settings, 'IOT_LOG_SAMPLE_SECONDS', 10.0)
+
+# Seconds; from 0.5 ms (an in-memory publish) to 10 s (a stuck write)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVE_FILE = '_archive.json'
+
+# ==================== METRIC TYPES ====================
+
+class Counter:
+    """Monotonic count, optionally split by label values (see labels())"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def labels(self, *values):
+        return _Child(self, tuple(str(value) for value in values))
+
+    def inc(self, amount=1, _key=()):
+        with self._lock:
+            self._values[_key] = self._values.get(_key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) of observed values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def labels(self, *values):
+        return _Child(self, tuple(str(value) for value in values))
+
+    def _series(self, key):
+        series = self._values.get(key)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), sum
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        return series
+
+    def observe(self, value, _key=()):
+        with self._lock:
+            series = self._series(_key)
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def observe_many(self, values, _key=()):
+        """observe() each of `values` under one lock acquisition"""
+        buckets = self.buckets
+        with self._lock:
+            counts, total = self._series(_key)
+            for value in values:
+                counts[bisect_left(buckets, value)] += 1
+                total += value
+            self._values[_key][1] = total
+
+    def time(self):
+        return _Timer(self)
+
+    def timed(self):
+        return _timed(self)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): [list(counts), total] for key, (counts, total) in self._values.items()}
+
+class Gauge:
+    """Current value read from `function` when metrics are collected"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+
+    def snapshot(self):
+        """`function` returns a number, or {label values tuple: number}"""
+        try:
+            value = self.function()
+        except Exception:
+            return {}
+        if isinstance(value, dict):
+            return {json.dumps([str(label) for label in key]): number for key, number in value.items()}
+        return {json.dumps(()): value}
+
+class _Child:
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric.inc(amount, self.key)
+
+    def observe(self, value):
+        self.metric.observe(value, self.key)
+
+    def observe_many(self, values):
+        self.metric.observe_many(values, self.key)
+
+    def time(self):
+        return _Timer(self)
+
+    def timed(self):
+        return _timed(self)
+
+def _timed(metric):
+    """Decorator observing the duration of every call of a function into `metric`"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class _Timer:
+    __slots__ = ('metric', 'start')
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.start)
+
+# ==================== REGISTRY ====================
+
+def _merge(total, snapshot):
+    """Add a registry snapshot into `total` (counters and histograms sum)"""
+    for name, series in snapshot.items():
+        merged = total.setdefault(name, {})
+        for key, value in series.items():
+            if isinstance(value, list):
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = [list(value[0]), value[1]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return total
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class MetricsRegistry:
+    """
+    The process's metrics, and their aggregation across processes.
+
+    Once start()ed in a process, a daemon thread rewrites
+    <directory>/<pid>.json every flush_seconds. collect() sums the
+    counters and histograms of every file; gauges only count for
+    processes still alive. Files of exited processes are folded into
+    _archive.json so totals stay monotonic as gunicorn recycles workers.
+    """
+    def __init__(self, directory=None, flush_seconds=None):
+        self.directory = METRICS_DIR if directory is None else directory
+        self.flush_seconds = flush_seconds or METRICS_FLUSH_SECONDS
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        return self.register(Gauge(name, documentation, function, labelnames))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'counters': {m.name: m.snapshot() for m in metrics if m.kind != 'gauge'},
+            'gauges': {m.name: m.snapshot() for m in metrics if m.kind == 'gauge'},
+        }
+
+    # files ---------------------------------------------------------------
+
+    def start(self):
+        """Start writing this process's file (once per process; no-op without a directory)"""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher[0] == os.getpid():
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"⚠️ Metrics directory {self.directory} unavailable, metrics are per-process: {e}")
+                self.directory = ''
+                return
+            thread = threading.Thread(target=self._flush_forever, daemon=True)
+            self._flusher = (os.getpid(), thread)
+            thread.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Metrics flush failed: {e}")
+
+    def flush(self):
+        """Write this process's snapshot (atomically replacing the last one)"""
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fold_exited(self, exited):
+        """Add the counters of exited processes to the archive and drop their files"""
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = self._read(archive_path) or {}
+            for path in exited:
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    _merge(archive, snapshot['counters'])
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            with open(f'{archive_path}.tmp', 'w') as f:
+                json.dump(archive, f)
+            os.replace(f'{archive_path}.tmp', archive_path)
+
+    def collect(self):
+        """{'counters': ..., 'gauges': ...} summed over every process"""
+        self.start()
+        if not self.directory:
+            local = self.snapshot()
+            return {'counters': _merge({}, local['counters']), 'gauges': _merge({}, local['gauges'])}
+        self.flush()
+        counters, gauges, exited = {}, {}, []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == ARCHIVE_FILE:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[:-len('.json')])
+            except ValueError:
+                continue
+            if not _pid_alive(pid):
+                exited.append(path)
+                continue
+            snapshot = self._read(path)
+            if snapshot is not None:
+                _merge(counters, snapshot['counters'])
+                _merge(gauges, snapshot['gauges'])
+        if exited:
+            self._fold_exited(exited)
+        _merge(counters, self._read(os.path.join(self.directory, ARCHIVE_FILE)) or {})
+        return {'counters': counters, 'gauges': gauges}
+
+    # exposition ----------------------------------------------------------
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        collected = self.collect()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            series = collected['gauges' if metric.kind == 'gauge' else 'counters'].get(metric.name, {})
+            name = metric.name + ('_total' if metric.kind == 'counter' else '')
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, value in sorted(series.items()):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{self._labels(labels)} {value}')
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{self._labels(labels + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(labels)} {total}')
+                lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in pairs) + '}'
+
+# ==================== SAMPLED LOGGING ====================
+
+class SampledLog:
+    """
+    Structured (one JSON object per line) log events, sampled in time: an
+    event is written at most once per `interval` seconds, with how many
+    times it happened since the last line. Fields named in `totals` are
+    summed over those occurrences; the others show the latest values.
+    """
+    def __init__(self, logger, interval=None):
+        self.logger = logger
+        self.interval = LOG_SAMPLE_SECONDS if interval is None else interval
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def event(self, event, level=logging.INFO, totals=(), **fields):
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.get(event)
+            if pending is None:
+                # First occurrence is written at once
+                pending = self._pending[event] = {'since': None, 'count': 0, 'totals': dict.fromkeys(totals, 0)}
+            pending['count'] += 1
+            summed = pending['totals']
+            for name in totals:
+                summed[name] += fields[name]
+            since = pending['since']
+            if since is not None and now - since < self.interval:
+                return
+            record = {'event': event, 'count': pending['count'], 'window_s': round(now - (since or now), 3)}
+            record.update(fields)
+            record.update(summed)
+            pending.update(since=now, count=0, totals=dict.fromkeys(totals, 0))
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, json.dumps(record, default=str))
+
+
+# Process-wide registry behind /metrics
+registry = MetricsRegistry()
+
+# ==================== INGEST METRICS ====================
+
+QUEUE_WAIT = registry.histogram(
+    'iot_ingest_queue_wait_seconds', 'Time from a payload being received to its batch being drained from the ingest queue')
+PARSE_SECONDS = registry.histogram(
+    'iot_ingest_parse_seconds', 'Normalization (parsing) time per drained batch, as waited for by the committer')
+DB_WRITE_SECONDS = registry.histogram(
+    'iot_ingest_db_write_seconds', 'Database write time per batch')
+DB_WRITE_ERRORS = registry.counter(
+    'iot_ingest_db_write_errors', 'Batches whose database write failed')
+PUBLISH_LATENCY = registry.histogram(
+    'iot_ingest_publish_latency_seconds', 'Time from a payload being received to its live update being published')
+PAYLOADS = registry.counter(
+    'iot_ingest_payloads', 'Payloads published to the live state')
+ASSETS = registry.counter(
+    'iot_ingest_assets', 'Asset readings published to the live state (rate() gives assets per second)')
+BATCHES = registry.counter(
+    'iot_ingest_batches', 'Batches drained from the ingest queue')
+LIVE_UPDATES = registry.counter(
+    'iot_live_updates', 'Live-state updates published (fewer than payloads while coalescing)')
+REQUEST_SECONDS = registry.histogram(
+    'iot_http_request_seconds', 'Handling time of the ingest endpoints', labelnames=('endpoint',))
+REJECTIONS = registry.counter(
+    'iot_http_rejections', 'Requests answered 503 (ingest queue full, upstream unavailable)', labelnames=('endpoint',))
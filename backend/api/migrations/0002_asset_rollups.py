@@ -0,0 +1,80 @@
+# Generated by Django 5.2.3 on 2026-10-17 04:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetRollup1h',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=100)),
+                ('bucket', models.DateTimeField(help_text='Start of the bucket (UTC)')),
+                ('sample_count', models.IntegerField(default=0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('last_value', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='api.service')),
+            ],
+            options={
+                'verbose_name': 'Asset Rollup (1h)',
+                'verbose_name_plural': 'Asset Rollups (1h)',
+                'db_table': 'asset_rollups_1h',
+                'abstract': False,
+                'unique_together': {('service', 'asset_id', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AssetRollup1m',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=100)),
+                ('bucket', models.DateTimeField(help_text='Start of the bucket (UTC)')),
+                ('sample_count', models.IntegerField(default=0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('last_value', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='api.service')),
+            ],
+            options={
+                'verbose_name': 'Asset Rollup (1m)',
+                'verbose_name_plural': 'Asset Rollups (1m)',
+                'db_table': 'asset_rollups_1m',
+                'abstract': False,
+                'unique_together': {('service', 'asset_id', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AssetRollup1s',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.CharField(max_length=100)),
+                ('bucket', models.DateTimeField(help_text='Start of the bucket (UTC)')),
+                ('sample_count', models.IntegerField(default=0)),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('last_value', models.FloatField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_set', to='api.service')),
+            ],
+            options={
+                'verbose_name': 'Asset Rollup (1s)',
+                'verbose_name_plural': 'Asset Rollups (1s)',
+                'db_table': 'asset_rollups_1s',
+                'abstract': False,
+                'unique_together': {('service', 'asset_id', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_asset_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incomingiotdata',
+            index=models.Index(fields=['received_at'], name='incoming_io_receive_6a58b5_idx'),
+        ),
+    ]
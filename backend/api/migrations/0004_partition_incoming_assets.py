@@ -0,0 +1,86 @@
+from datetime import datetime, time, timedelta, timezone
+
+from django.db import migrations
+
+PARTITION_DAYS_AHEAD = 7
+
+
+def create_day_partition(cursor, day):
+    start = datetime.combine(day, time.min, timezone.utc)
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "incoming_assets_{day:%Y%m%d}" PARTITION OF incoming_assets '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + timedelta(days=1)).isoformat()}')"
+    )
+
+
+def partition_incoming_assets(apps, schema_editor):
+    """
+    PostgreSQL only: rebuild incoming_assets as a table range-partitioned by
+    day on "timestamp". The primary key becomes (id, timestamp), since every
+    unique constraint on a partitioned table must contain the partition key;
+    all other constraint and index names are kept.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, 'incoming_assets')
+        cursor.execute('ALTER TABLE incoming_assets RENAME TO incoming_assets_unpartitioned')
+        cursor.execute(
+            'CREATE TABLE incoming_assets ('
+            'id bigint GENERATED BY DEFAULT AS IDENTITY NOT NULL, '
+            'asset_id varchar(100) NOT NULL, '
+            'value double precision NOT NULL, '
+            '"timestamp" timestamp with time zone NOT NULL, '
+            'created_at timestamp with time zone NOT NULL, '
+            'service_id bigint NOT NULL'
+            ') PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute('CREATE TABLE incoming_assets_default PARTITION OF incoming_assets DEFAULT')
+
+        cursor.execute(
+            'SELECT DISTINCT ("timestamp" AT TIME ZONE \'UTC\')::date FROM incoming_assets_unpartitioned'
+        )
+        today = datetime.now(timezone.utc).date()
+        days = {row[0] for row in cursor.fetchall()}
+        days.update(today + timedelta(days=n) for n in range(PARTITION_DAYS_AHEAD + 1))
+        for day in sorted(days):
+            create_day_partition(cursor, day)
+
+        cursor.execute(
+            'INSERT INTO incoming_assets (id, asset_id, value, "timestamp", created_at, service_id) '
+            'SELECT id, asset_id, value, "timestamp", created_at, service_id FROM incoming_assets_unpartitioned'
+        )
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('incoming_assets', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM incoming_assets), 0) + 1, false)"
+        )
+        cursor.execute('DROP TABLE incoming_assets_unpartitioned')
+
+        # Recreate constraints and indexes under their original names
+        for name, info in constraints.items():
+            columns = ', '.join(f'"{column}"' for column in info['columns'])
+            if info['primary_key']:
+                cursor.execute(f'ALTER TABLE incoming_assets ADD CONSTRAINT "{name}" PRIMARY KEY (id, "timestamp")')
+            elif info['unique']:
+                cursor.execute(f'ALTER TABLE incoming_assets ADD CONSTRAINT "{name}" UNIQUE ({columns})')
+            elif info['foreign_key']:
+                table, column = info['foreign_key']
+                cursor.execute(
+                    f'ALTER TABLE incoming_assets ADD CONSTRAINT "{name}" FOREIGN KEY ({columns}) '
+                    f'REFERENCES "{table}" ("{column}") DEFERRABLE INITIALLY DEFERRED'
+                )
+            elif info['index']:
+                cursor.execute(f'CREATE INDEX "{name}" ON incoming_assets ({columns})')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_incomingiotdata_received_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_incoming_assets, migrations.RunPython.noop),
+    ]
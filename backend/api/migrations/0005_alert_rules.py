@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-17 05:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_partition_incoming_assets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('asset_id', models.CharField(max_length=100)),
+                ('rule_type', models.CharField(choices=[('threshold', 'Threshold'), ('rate_of_change', 'Rate of change'), ('sustained', 'Sustained for duration'), ('missing_data', 'Missing data')], default='threshold', max_length=20)),
+                ('operator', models.CharField(choices=[('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<=')], default='gt', max_length=3)),
+                ('threshold', models.FloatField(blank=True, help_text='Value limit; units per second for rate-of-change rules (unused for missing data)', null=True)),
+                ('duration_seconds', models.FloatField(default=0, help_text='Sustained: how long the condition must hold. Rate of change: window the rate is measured over (0 = between consecutive readings). Missing data: silence before firing.')),
+                ('severity', models.CharField(choices=[('info', 'Info'), ('warning', 'Warning'), ('critical', 'Critical')], default='warning', max_length=10)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to='api.service')),
+            ],
+            options={
+                'verbose_name': 'Alert Rule',
+                'verbose_name_plural': 'Alert Rules',
+                'db_table': 'alert_rules',
+            },
+        ),
+        migrations.CreateModel(
+            name='AlertEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('firing', 'Firing'), ('resolved', 'Resolved')], max_length=10)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('triggered_at', models.DateTimeField(help_text='Sample time of the transition')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='api.alertrule')),
+            ],
+            options={
+                'verbose_name': 'Alert Event',
+                'verbose_name_plural': 'Alert Events',
+                'db_table': 'alert_events',
+                'ordering': ['-triggered_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='alertrule',
+            index=models.Index(fields=['service', 'asset_id'], name='alert_rules_service_2313c2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(fields=['triggered_at'], name='alert_event_trigger_03b735_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='alertevent',
+            unique_together={('rule', 'state', 'triggered_at')},
+        ),
+    ]
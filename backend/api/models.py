@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 
@@ -53,4 +54,137 @@ class IncomingIoTData(models.Model):
         db_table = 'incoming_iot_data'
         verbose_name = 'Incoming IoT Data'
         verbose_name_plural = 'Incoming IoT Data'
-        ordering = ['-received_at']
\ No newline at end of file
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['received_at']),
+        ]
+
+class AssetRollup(models.Model):
+    """Downsampled asset values per (service, asset_id, bucket) at a fixed resolution"""
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='%(class)s_set')
+    asset_id = models.CharField(max_length=100)
+    bucket = models.DateTimeField(help_text="Start of the bucket (UTC)")
+    sample_count = models.IntegerField(default=0)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()
+    last_value = models.FloatField()
+    last_timestamp = models.DateTimeField()
+
+    # Bucket width in seconds, set by each concrete resolution
+    resolution_seconds = None
+
+    def __str__(self):
+        return f"{self.service.name} - {self.asset_id} @ {self.bucket}"
+
+    class Meta:
+        abstract = True
+        unique_together = ['service', 'asset_id', 'bucket']
+
+
+class AssetRollup1s(AssetRollup):
+    resolution_seconds = 1
+
+    class Meta(AssetRollup.Meta):
+        db_table = 'asset_rollups_1s'
+        verbose_name = 'Asset Rollup (1s)'
+        verbose_name_plural = 'Asset Rollups (1s)'
+
+
+class AssetRollup1m(AssetRollup):
+    resolution_seconds = 60
+
+    class Meta(AssetRollup.Meta):
+        db_table = 'asset_rollups_1m'
+        verbose_name = 'Asset Rollup (1m)'
+        verbose_name_plural = 'Asset Rollups (1m)'
+
+
+class AssetRollup1h(AssetRollup):
+    resolution_seconds = 3600
+
+    class Meta(AssetRollup.Meta):
+        db_table = 'asset_rollups_1h'
+        verbose_name = 'Asset Rollup (1h)'
+        verbose_name_plural = 'Asset Rollups (1h)'
+
+
+class AlertRule(models.Model):
+    """Condition on one asset's readings, evaluated by the rule engine on every update"""
+    THRESHOLD = 'threshold'
+    RATE_OF_CHANGE = 'rate_of_change'
+    SUSTAINED = 'sustained'
+    MISSING_DATA = 'missing_data'
+    RULE_TYPES = [
+        (THRESHOLD, 'Threshold'),
+        (RATE_OF_CHANGE, 'Rate of change'),
+        (SUSTAINED, 'Sustained for duration'),
+        (MISSING_DATA, 'Missing data'),
+    ]
+    OPERATORS = [('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<=')]
+    SEVERITIES = [('info', 'Info'), ('warning', 'Warning'), ('critical', 'Critical')]
+
+    name = models.CharField(max_length=100)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='alert_rules')
+    asset_id = models.CharField(max_length=100)
+    rule_type = models.CharField(max_length=20, choices=RULE_TYPES, default=THRESHOLD)
+    operator = models.CharField(max_length=3, choices=OPERATORS, default='gt')
+    threshold = models.FloatField(
+        null=True, blank=True,
+        help_text="Value limit; units per second for rate-of-change rules (unused for missing data)"
+    )
+    duration_seconds = models.FloatField(
+        default=0,
+        help_text="Sustained: how long the condition must hold. Rate of change: window the rate is "
+                  "measured over (0 = between consecutive readings). Missing data: silence before firing."
+    )
+    severity = models.CharField(max_length=10, choices=SEVERITIES, default='warning')
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        if self.rule_type != self.MISSING_DATA and self.threshold is None:
+            raise ValidationError({'threshold': "Required for this rule type"})
+        if self.rule_type in (self.SUSTAINED, self.MISSING_DATA) and self.duration_seconds <= 0:
+            raise ValidationError({'duration_seconds': "Must be positive for this rule type"})
+
+    def __str__(self):
+        return f"{self.name} ({self.service.name} - {self.asset_id})"
+
+    class Meta:
+        db_table = 'alert_rules'
+        verbose_name = 'Alert Rule'
+        verbose_name_plural = 'Alert Rules'
+        indexes = [
+            models.Index(fields=['service', 'asset_id']),
+        ]
+
+
+class AlertEvent(models.Model):
+    """A rule entering (firing) or leaving (resolved) its alert state"""
+    FIRING = 'firing'
+    RESOLVED = 'resolved'
+    STATES = [(FIRING, 'Firing'), (RESOLVED, 'Resolved')]
+
+    rule = models.ForeignKey(AlertRule, on_delete=models.CASCADE, related_name='events')
+    state = models.CharField(max_length=10, choices=STATES)
+    value = models.FloatField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    triggered_at = models.DateTimeField(help_text="Sample time of the transition")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.rule.name} {self.state} @ {self.triggered_at}"
+
+    class Meta:
+        db_table = 'alert_events'
+        verbose_name = 'Alert Event'
+        verbose_name_plural = 'Alert Events'
+        ordering = ['-triggered_at']
+        # Workers evaluating the same shared updates record the same
+        # transition; the duplicates are dropped on insert
+        unique_together = ['rule', 'state', 'triggered_at']
+        indexes = [
+            models.Index(fields=['triggered_at']),
+        ]
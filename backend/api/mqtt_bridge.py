@@ -0,0 +1,255 @@
+# mqtt_bridge.py - MQTT subscriber feeding the batched ingest pipeline
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection
+from datetime import datetime
+import json
+import queue
+import re
+import threading
+
+from . import ingest
+from .ipc import IPCError
+
+# ==================== CONFIGURATION ====================
+MQTT_HOST = getattr(settings, 'IOT_MQTT_HOST', 'localhost')
+MQTT_PORT = getattr(settings, 'IOT_MQTT_PORT', 1883)
+MQTT_USERNAME = getattr(settings, 'IOT_MQTT_USERNAME', '')
+MQTT_PASSWORD = getattr(settings, 'IOT_MQTT_PASSWORD', '')
+MQTT_CLIENT_ID = getattr(settings, 'IOT_MQTT_CLIENT_ID', 'iot-ingest-bridge')
+MQTT_KEEPALIVE = getattr(settings, 'IOT_MQTT_KEEPALIVE', 60)
+# Topic patterns: MQTT wildcards plus an optional {service} level that names
+# the service for payloads that do not carry one
+MQTT_TOPICS = getattr(settings, 'IOT_MQTT_TOPICS', ['iot/#'])
+MQTT_QOS = getattr(settings, 'IOT_MQTT_QOS', 1)
+# Delays between retries of a write that failed transiently; the last one
+# repeats until the write succeeds or the bridge stops. Messages stay
+# unacknowledged meanwhile, so the broker still holds them.
+MQTT_RETRY_SECONDS = (0.5, 1, 2, 5, 10)
+# JSON-lines file receiving payloads that can never be persisted (then
+# acknowledged); empty only logs them
+MQTT_DEAD_LETTER_PATH = getattr(settings, 'IOT_MQTT_DEAD_LETTER_PATH', '')
+
+# Failures worth retrying: database lock/connection errors, the writer process
+# being unreachable. Anything else (DataError, IntegrityError, ...) is the
+# message's fault and fails the same way every time.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, OSError, IPCError)
+
+# ==================== TOPIC PATTERNS ====================
+
+class TopicPattern:
+    """
+    A subscription such as 'plant/{service}/telemetry'. The {service} level
+    subscribes as '+', and the matching topic level becomes the service name.
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.subscription = pattern.replace('{service}', '+')
+        parts = []
+        for level in pattern.split('/'):
+            if level == '{service}':
+                parts.append('(?P<service>[^/]+)')
+            elif level == '+':
+                parts.append('[^/]+')
+            elif level == '#':
+                parts.append('.*')
+            else:
+                parts.append(re.escape(level))
+        self._regex = re.compile('^' + '/'.join(parts).replace('/.*', '(?:/.*)?') + '$')
+
+    def match(self, topic):
+        """None if the topic does not match, else the service name ('' when not in the pattern)"""
+        match = self._regex.match(topic)
+        if match is None:
+            return None
+        return match.groupdict().get('service') or ''
+
+def parse_message(payload, service_name=''):
+    """
+    Decode one MQTT payload in any format receive_iot_data accepts. A single
+    service without a "name" takes it from the topic. Returns None if invalid.
+    """
+    try:
+        data = json.loads(payload)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, (dict, list)):
+        return None
+    if isinstance(data, dict) and service_name and 'name' not in data and 'services' not in data:
+        data = {'name': service_name, **data}
+    return data
+
+# ==================== BRIDGE ====================
+
+class MqttIngestBridge:
+    """
+    Subscribes to the topic patterns and persists messages in batches.
+
+    Messages are acknowledged only once their batch has been committed
+    (paho manual_ack), so QoS 1/2 messages that were never persisted are
+    redelivered by the broker after a reconnect or restart. Transient write
+    failures (database locked or down, writer process unreachable) are
+    retried with backoff for as long as they last, and the batch stays
+    unacknowledged; only a message whose own data cannot be written is
+    dead-lettered (see IOT_MQTT_DEAD_LETTER_PATH) and acknowledged, so it
+    never stalls the messages behind it. The MQTT client is injected: anything with paho's subscribe()/ack() and on_connect /
+    on_message callbacks works, including an in-process fake.
+    """
+    def __init__(self, client, topics=None, qos=None, store=None, writer=None,
+                 batch_size=None, flush_interval_ms=None):
+        self.client = client
+        self.patterns = [TopicPattern(topic) for topic in (topics or MQTT_TOPICS)]
+        self.qos = MQTT_QOS if qos is None else qos
+        self.store = store
+        self.writer = writer
+        self.batch_size = batch_size or ingest.INGEST_BATCH_SIZE
+        self.flush_interval_ms = flush_interval_ms
+        self.messages = queue.Queue()
+        self.stats = {
+            'received': 0, 'persisted': 0, 'invalid': 0, 'acked': 0, 'retries': 0, 'batches': 0, 'dead_lettered': 0
+        }
+        self._stop = threading.Event()
+        self._thread = None
+
+        client.on_connect = self._on_connect
+        client.on_message = self._on_message
+
+    # paho callbacks (network thread) -------------------------------------
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        print(f"📡 MQTT connected ({reason_code}); subscribing to {', '.join(p.subscription for p in self.patterns)}")
+        client.subscribe([(pattern.subscription, self.qos) for pattern in self.patterns])
+
+    def _on_message(self, client, userdata, message):
+        self.messages.put(message)
+
+    # batching (bridge thread) --------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                batch = ingest.drain_batch(self.messages, self.batch_size, self.flush_interval_ms, timeout=0.5)
+            except queue.Empty:
+                continue
+            self.process_batch(batch)
+
+    def service_for(self, topic):
+        for pattern in self.patterns:
+            service_name = pattern.match(topic)
+            if service_name is not None:
+                return service_name
+        return ''
+
+    def process_batch(self, messages):
+        """Persist one batch of messages, publish it live, then acknowledge it"""
+        self.stats['received'] += len(messages)
+        payloads = []
+        for message in messages:
+            external_data = parse_message(message.payload, self.service_for(message.topic))
+            if external_data is None:
+                self.stats['invalid'] += 1
+            else:
+                payloads.append(external_data)
+
+        if payloads:
+            normalized = [ingest.normalize_payload(external_data) for external_data in payloads]
+            failed = self._persist(payloads, normalized)
+            self.stats['persisted'] += len(payloads) - len(failed)
+            self.stats['batches'] += 1
+            if self.store is not None:
+                for index, (processed_services, _) in enumerate(normalized):
+                    if index not in failed:
+                        self.store.atomic_update(processed_services)
+
+        # Invalid and dead-lettered messages are acknowledged too - redelivery
+        # cannot fix them
+        for message in messages:
+            if message.qos > 0:
+                self.client.ack(message.mid, message.qos)
+                self.stats['acked'] += 1
+
+    def _persist(self, payloads, normalized):
+        """Write the batch; returns the indexes of the payloads dead-lettered instead"""
+        error = self._write(payloads, normalized)
+        if error is None:
+            return set()
+        if len(payloads) == 1:
+            self._dead_letter(payloads, error)
+            return set(range(len(payloads)))
+        # One bad message fails its whole batch - write them one at a time so
+        # only the bad ones are dead-lettered
+        failed = set()
+        for index in range(len(payloads)):
+            error = self._write(payloads[index:index + 1], normalized[index:index + 1])
+            if error is not None:
+                self._dead_letter(payloads[index:index + 1], error)
+                failed.add(index)
+        return failed
+
+    def _write(self, payloads, normalized):
+        """
+        Write payloads, retrying transient failures with backoff until they
+        commit. Returns None once committed, else the (non-transient) error.
+        """
+        attempt = 0
+        while True:
+            try:
+                if self.writer is None:
+                    ingest.write_batch(payloads, normalized)
+                else:
+                    self.writer.write(payloads, normalized)
+                return None
+            except TRANSIENT_ERRORS as e:
+                if self.writer is None or self.writer.backend == 'local':
+                    # Start the retry on a fresh connection
+                    connection.close()
+                delay = MQTT_RETRY_SECONDS[min(attempt, len(MQTT_RETRY_SECONDS) - 1)]
+                attempt += 1
+                print(f"⚠️ MQTT batch write failed ({e}); retrying in {delay}s")
+                self.stats['retries'] += 1
+                if self._stop.wait(delay):
+                    # Shutting down: leave the batch unacknowledged for redelivery
+                    raise
+            except Exception as e:
+                return e
+
+    def _dead_letter(self, payloads, error):
+        print(f"⚠️ {len(payloads)} MQTT payload(s) not persisted ({type(error).__name__}: {error}); acknowledging")
+        self.stats['dead_lettered'] += len(payloads)
+        if not MQTT_DEAD_LETTER_PATH:
+            return
+        failed_at = datetime.now().isoformat() + 'Z'
+        try:
+            with open(MQTT_DEAD_LETTER_PATH, 'a') as f:
+                for external_data in payloads:
+                    f.write(json.dumps({
+                        "failed_at": failed_at,
+                        "error": f"{type(error).__name__}: {error}",
+                        "payload": external_data
+                    }, default=str) + '\n')
+        except OSError as e:
+            print(f"⚠️ Could not write the MQTT dead-letter file: {e}")
+
+def create_mqtt_client(client_id=None):
+    """paho-mqtt 2.x client with manual acknowledgement and a persistent session"""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        client_id=client_id or MQTT_CLIENT_ID,
+        # Keep the session so unacknowledged messages survive a restart
+        clean_session=False,
+        manual_ack=True
+    )
+    if MQTT_USERNAME:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD or None)
+    return client
@@ -0,0 +1,135 @@
+# profiling.py - On-demand sampling profiler for the ingest threads and request handlers
+from django.conf import settings
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+# ==================== CONFIGURATION ====================
+# Longest window /api/debug/profile may sample, and the default one
+PROFILE_MAX_SECONDS = getattr(settings, 'IOT_PROFILE_MAX_SECONDS', 60)
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_DEFAULT_INTERVAL_MS = 5
+# Lets scripts profile with an X-Profile-Token header instead of a staff session
+PROFILE_TOKEN = getattr(settings, 'IOT_PROFILE_TOKEN', '')
+
+# Threads are picked by their default name, which ends in "(<target function>)"
+PROCESSOR_THREADS = ('background_data_processor', 'dispatch_forever', '_persist_forever')
+TARGETS = ('processor', 'requests', 'all')
+
+# Leaf frames of a thread blocked waiting for work (left out unless include_idle)
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'), ('queue.py', 'get'), ('thread.py', '_worker'),
+}
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this process"""
+
+# ==================== SAMPLING PROFILER ====================
+
+def thread_role(thread):
+    if thread is threading.main_thread():
+        # The ASGI event loop: async views and streaming responses
+        return 'requests'
+    if any(name in thread.name for name in PROCESSOR_THREADS):
+        return 'processor'
+    if thread.name.startswith('ThreadPoolExecutor') or 'process_request_thread' in thread.name:
+        # Sync views (asgiref's executor under ASGI, runserver's per-request threads)
+        return 'requests'
+    return 'other'
+
+class SamplingProfiler:
+    """
+    Statistical profiler: every `interval` seconds the Python stack of
+    each selected thread is read with sys._current_frames() and counted.
+    Nothing is installed in the profiled threads - no trace or profile
+    hooks - so it costs nothing outside a window and, during one, only
+    the sampling thread's own time.
+
+    The result is in collapsed-stack format ("thread;outer;...;leaf count"
+    per line), readable by flamegraph.pl, speedscope and inferno.
+    """
+    def __init__(self, target='all', interval=None, include_idle=False):
+        if target not in TARGETS:
+            raise ValueError(f"Unknown profile target {target!r} (expected one of {', '.join(TARGETS)})")
+        self.target = target
+        self.interval = interval or PROFILE_DEFAULT_INTERVAL_MS / 1000
+        self.include_idle = include_idle
+        self.samples = 0
+        self.stacks = Counter()
+        self._labels = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for prefix in [str(settings.BASE_DIR)] + sys.path:
+                if prefix and filename.startswith(prefix):
+                    filename = filename[len(prefix):].lstrip(os.sep)
+                    break
+            label = self._labels[code] = f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+        return label
+
+    def _selected(self):
+        me = threading.get_ident()
+        threads = {}
+        for thread in threading.enumerate():
+            if thread.ident == me:
+                continue
+            role = thread_role(thread)
+            if self.target == 'all' or role == self.target:
+                threads[thread.ident] = f"{role}:{thread.name}"
+        return threads
+
+    def sample(self, threads):
+        frames = sys._current_frames()
+        for ident, name in threads.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            code = frame.f_code
+            if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(name)
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """Sample for `seconds` on the calling thread; returns the collapsed stacks"""
+        deadline = time.monotonic() + seconds
+        threads, refreshed = self._selected(), time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now - refreshed > 1.0:
+                # Pick up threads started during the window
+                threads, refreshed = self._selected(), now
+            self.sample(threads)
+            time.sleep(min(self.interval, max(0.0, deadline - time.monotonic())))
+        return self.collapsed()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+_active = threading.Lock()
+
+def profile(seconds, target='all', interval=None, include_idle=False):
+    """
+    Run one SamplingProfiler window (blocking) and return it; raises
+    ProfilerBusy if another window is running in this process.
+    """
+    if not _active.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running in this process")
+    try:
+        profiler = SamplingProfiler(target, interval, include_idle)
+        profiler.run(min(seconds, PROFILE_MAX_SECONDS))
+        return profiler
+    finally:
+        _active.release()
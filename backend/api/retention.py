@@ -0,0 +1,179 @@
+# retention.py - Chunked pruning of aged rows and optional SQLite compaction
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from datetime import timedelta
+import fcntl
+import os
+import threading
+import time
+
+from .models import IncomingIoTData, Asset, AssetRollup1s, AssetRollup1m, AssetRollup1h
+from .storage import get_storage
+
+# ==================== CONFIGURATION ====================
+# Max age in seconds per table; None keeps rows forever
+RETENTION_POLICIES = getattr(settings, 'IOT_RETENTION_POLICIES', {
+    'incoming_iot_data': 24 * 3600,
+    'incoming_assets': 30 * 86400,
+})
+RETENTION_ENABLED = getattr(settings, 'IOT_RETENTION_ENABLED', False)
+RETENTION_INTERVAL_SECONDS = getattr(settings, 'IOT_RETENTION_INTERVAL_SECONDS', 300)
+# Rows per DELETE, and the pause between chunks that lets ingest take the write lock
+RETENTION_CHUNK_ROWS = getattr(settings, 'IOT_RETENTION_CHUNK_ROWS', 2000)
+RETENTION_CHUNK_PAUSE_MS = getattr(settings, 'IOT_RETENTION_CHUNK_PAUSE_MS', 50)
+# Free pages returned to the filesystem per run (0 disables incremental VACUUM)
+RETENTION_VACUUM_PAGES = getattr(settings, 'IOT_RETENTION_VACUUM_PAGES', 0)
+RETENTION_LOCK_PATH = getattr(settings, 'IOT_RETENTION_LOCK_PATH', '/tmp/iot_retention.lock')
+
+# Prunable models and the column that dates their rows
+RETENTION_FIELDS = {
+    IncomingIoTData: 'received_at',
+    Asset: 'timestamp',
+    AssetRollup1s: 'bucket',
+    AssetRollup1m: 'bucket',
+    AssetRollup1h: 'bucket',
+}
+
+# ==================== PRUNING ====================
+
+def retention_for(model):
+    """Max age of `model` rows as a timedelta, or None to keep them forever"""
+    seconds = RETENTION_POLICIES.get(model._meta.db_table)
+    return timedelta(seconds=seconds) if seconds else None
+
+def prune_model(model, cutoff, chunk_rows=None, pause_ms=None, dry_run=False):
+    """
+    Delete rows of `model` older than `cutoff`, `chunk_rows` at a time.
+
+    Expired rows are found oldest first through the date column's index and
+    each chunk is its own short autocommit transaction deleting by primary
+    key, so the write lock is only ever held for one small DELETE. Returns
+    the number of rows deleted (or that would be, with `dry_run`).
+    """
+    chunk_rows = chunk_rows or RETENTION_CHUNK_ROWS
+    pause_ms = RETENTION_CHUNK_PAUSE_MS if pause_ms is None else pause_ms
+    field = RETENTION_FIELDS[model]
+    expired = model.objects.filter(**{f'{field}__lt': cutoff}).order_by(field)
+    if dry_run:
+        return expired.count()
+
+    deleted = 0
+    while True:
+        pks = list(expired.values_list('pk', flat=True)[:chunk_rows])
+        if not pks:
+            return deleted
+        count, _ = model.objects.filter(pk__in=pks).delete()
+        deleted += count
+        if len(pks) < chunk_rows:
+            return deleted
+        if pause_ms:
+            time.sleep(pause_ms / 1000.0)
+
+def prune_all(now=None, chunk_rows=None, pause_ms=None, dry_run=False):
+    """Apply every retention policy; returns {db_table: rows deleted}"""
+    now = now or timezone.now()
+    results = {}
+    for model in RETENTION_FIELDS:
+        max_age = retention_for(model)
+        if max_age is None:
+            continue
+        if model is Asset and not dry_run:
+            # Day partitions past the cutoff go in one DROP each
+            storage = get_storage()
+            if hasattr(storage, 'drop_partitions_before'):
+                dropped = storage.drop_partitions_before(now - max_age)
+                if dropped:
+                    print(f"🧹 Dropped partitions: {', '.join(dropped)}")
+        results[model._meta.db_table] = prune_model(model, now - max_age, chunk_rows, pause_ms, dry_run)
+    return results
+
+# ==================== COMPACTION ====================
+
+def database_size():
+    """(page_count * page_size, freelist pages) of the SQLite file, or None elsewhere"""
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA freelist_count")
+        free_pages = cursor.fetchone()[0]
+    return page_count * page_size, free_pages
+
+def incremental_vacuum_enabled():
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum")
+        return cursor.fetchone()[0] == 2
+
+def enable_incremental_vacuum():
+    """
+    Switch the database to auto_vacuum=INCREMENTAL. This needs one full
+    VACUUM, which rewrites the whole file - run it during maintenance.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+
+def incremental_vacuum(pages=None):
+    """
+    Return up to `pages` free pages (all of them when None) to the
+    filesystem. Returns the bytes reclaimed, or None when not applicable.
+    """
+    if connection.vendor != 'sqlite' or not incremental_vacuum_enabled():
+        return None
+    size_before, _ = database_size()
+    # The pragma frees one page per step and a cursor only steps it once;
+    # executescript runs it to completion
+    connection.ensure_connection()
+    connection.connection.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)});")
+    size_after, _ = database_size()
+    return size_before - size_after
+
+# ==================== BACKGROUND PRUNER ====================
+
+def run_retention_pass():
+    """One prune (+ optional vacuum) pass; returns a summary dict"""
+    start = time.perf_counter()
+    deleted = prune_all()
+    reclaimed = incremental_vacuum(RETENTION_VACUUM_PAGES) if RETENTION_VACUUM_PAGES else None
+    return {
+        "deleted": deleted,
+        "reclaimed_bytes": reclaimed,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+def background_pruner():
+    """
+    Prune every RETENTION_INTERVAL_SECONDS. The first worker to take the
+    retention lock file keeps it for life and is the only one pruning; the
+    others keep trying so one of them takes over if it exits.
+    """
+    lock_file = open(RETENTION_LOCK_PATH, 'a')
+    is_leader = False
+    while True:
+        time.sleep(RETENTION_INTERVAL_SECONDS)
+        if not is_leader:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                is_leader = True
+            except OSError:
+                continue
+        try:
+            summary = run_retention_pass()
+            if any(summary['deleted'].values()) or summary['reclaimed_bytes']:
+                print(f"🧹 Retention pass (pid {os.getpid()}): {summary}")
+        except Exception as e:
+            print(f"⚠️ Retention pass failed: {e}")
+        finally:
+            connection.close()
+
+def start_background_pruner():
+    """Start the pruner thread when IOT_RETENTION_ENABLED; returns it or None"""
+    if not RETENTION_ENABLED or not any(RETENTION_POLICIES.values()):
+        return None
+    thread = threading.Thread(target=background_pruner, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,109 @@
+# rollups.py - Incrementally maintained downsampled asset tables
+from django.db import connection
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+import math
+
+from .models import AssetRollup1s, AssetRollup1m, AssetRollup1h
+
+# ==================== CONFIGURATION ====================
+# Finest first; the time-series query walks this backwards to pick the
+# coarsest resolution that still fits the requested step
+ROLLUP_MODELS = (AssetRollup1s, AssetRollup1m, AssetRollup1h)
+
+UPSERT_CHUNK_ROWS = 500
+
+# ==================== BUCKETING ====================
+
+def bucket_start(timestamp, resolution_seconds):
+    """Floor a datetime to the start of its bucket, as an aware UTC datetime"""
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    epoch = math.floor(timestamp.timestamp() / resolution_seconds) * resolution_seconds
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+def aggregate_rows(asset_rows, service_ids, resolution_seconds):
+    """
+    Fold (service_name, asset_id, value, timestamp) rows into one partial
+    rollup per (service_id, asset_id, bucket):
+    [count, min, max, sum, last_value, last_timestamp]
+    """
+    partials = {}
+    for service_name, asset_id, value, asset_timestamp in asset_rows:
+        if timezone.is_naive(asset_timestamp):
+            asset_timestamp = timezone.make_aware(asset_timestamp)
+        key = (service_ids[service_name], str(asset_id), bucket_start(asset_timestamp, resolution_seconds))
+        partial = partials.get(key)
+        if partial is None:
+            partials[key] = [1, value, value, value, value, asset_timestamp]
+            continue
+        partial[0] += 1
+        if value < partial[1]:
+            partial[1] = value
+        if value > partial[2]:
+            partial[2] = value
+        partial[3] += value
+        if asset_timestamp >= partial[5]:
+            partial[4] = value
+            partial[5] = asset_timestamp
+    return partials
+
+# ==================== UPSERT ====================
+
+def upsert_sql(model, vendor):
+    """
+    INSERT ... ON CONFLICT statement merging one partial rollup into `model`.
+    SQLite spells two-argument min/max as MIN/MAX, PostgreSQL as LEAST/GREATEST.
+    """
+    if vendor == 'sqlite':
+        least, greatest = 'MIN', 'MAX'
+    elif vendor == 'postgresql':
+        least, greatest = 'LEAST', 'GREATEST'
+    else:
+        raise NotImplementedError(f"Rollups are not supported on {vendor}")
+    table = model._meta.db_table
+    return (
+        f"INSERT INTO {table} "
+        f"(service_id, asset_id, bucket, sample_count, min_value, max_value, sum_value, last_value, last_timestamp) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT (service_id, asset_id, bucket) DO UPDATE SET "
+        f"sample_count = {table}.sample_count + excluded.sample_count, "
+        f"min_value = {least}({table}.min_value, excluded.min_value), "
+        f"max_value = {greatest}({table}.max_value, excluded.max_value), "
+        f"sum_value = {table}.sum_value + excluded.sum_value, "
+        f"last_value = CASE WHEN excluded.last_timestamp >= {table}.last_timestamp "
+        f"THEN excluded.last_value ELSE {table}.last_value END, "
+        f"last_timestamp = {greatest}({table}.last_timestamp, excluded.last_timestamp)"
+    )
+
+def update_rollups(asset_rows, service_ids, db_connection=None):
+    """
+    Merge newly persisted asset rows into every rollup table. Must run
+    inside the transaction that inserted the rows so both commit together.
+    Returns the number of rollup rows touched per table.
+    """
+    db_connection = db_connection or connection
+    adapt = db_connection.ops.adapt_datetimefield_value
+    touched = {}
+    with db_connection.cursor() as cursor:
+        for model in ROLLUP_MODELS:
+            partials = aggregate_rows(asset_rows, service_ids, model.resolution_seconds)
+            params = [
+                (service_id, asset_id, adapt(bucket), count, min_value, max_value, sum_value,
+                 last_value, adapt(last_timestamp))
+                for (service_id, asset_id, bucket), (count, min_value, max_value, sum_value, last_value, last_timestamp)
+                in partials.items()
+            ]
+            sql = upsert_sql(model, db_connection.vendor)
+            for start in range(0, len(params), UPSERT_CHUNK_ROWS):
+                cursor.executemany(sql, params[start:start + UPSERT_CHUNK_ROWS])
+            touched[model._meta.db_table] = len(params)
+    return touched
+
+def resolution_for_step(step):
+    """Coarsest rollup model whose buckets tile `step` exactly, or None for raw rows"""
+    for model in reversed(ROLLUP_MODELS):
+        resolution = model.resolution_seconds
+        if step >= resolution and abs(step / resolution - round(step / resolution)) < 1e-9:
+            return model
+    return None
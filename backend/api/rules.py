@@ -0,0 +1,333 @@
+# rules.py - Streaming alert rules evaluated against every live update
+from django.conf import settings
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+import operator
+import threading
+import time
+
+from .ingest import parse_asset_timestamp
+from .models import AlertRule, AlertEvent
+
+# ==================== CONFIGURATION ====================
+RULES_ENABLED = getattr(settings, 'IOT_RULES_ENABLED', True)
+# Rules edited in another process are picked up within this interval
+RULES_RELOAD_SECONDS = getattr(settings, 'IOT_RULES_RELOAD_SECONDS', 30)
+# How often missing-data rules are checked
+RULES_TICK_SECONDS = 1.0
+
+OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+def _isoformat(moment):
+    return moment.isoformat().replace('+00:00', 'Z')
+
+# ==================== COMPILED RULES ====================
+
+class CompiledRule:
+    """
+    In-memory form of one AlertRule plus its evaluation state. Readings are
+    fed in sample-time order; observe() and check_missing() return a
+    transition dict when the rule starts or stops firing, else None.
+    """
+    __slots__ = ('id', 'name', 'service_name', 'asset_id', 'rule_type', 'operator', 'compare',
+                 'threshold', 'duration', 'severity', 'signature', 'firing', 'since', 'samples',
+                 'last_sample_time', 'last_arrival')
+
+    def __init__(self, rule, firing=False):
+        self.id = rule.id
+        self.name = rule.name
+        self.service_name = rule.service.name
+        self.asset_id = rule.asset_id
+        self.rule_type = rule.rule_type
+        self.operator = rule.operator
+        self.compare = OPERATORS[rule.operator]
+        self.threshold = rule.threshold
+        self.duration = max(rule.duration_seconds or 0.0, 0.0)
+        self.severity = rule.severity
+        # Evaluation state survives a reload only while these are unchanged
+        self.signature = (self.service_name, self.asset_id, self.rule_type, self.operator,
+                          self.threshold, self.duration)
+        self.firing = firing
+        self.since = None              # sample time the sustained condition started holding
+        self.samples = deque()         # (sample time, value) inside the rate-of-change window
+        self.last_sample_time = None
+        self.last_arrival = time.time()
+
+    def observe(self, value, sample_time, arrival):
+        """Evaluate one reading (sample_time in epoch seconds)"""
+        if self.last_sample_time is not None and sample_time < self.last_sample_time:
+            # Late reading - it still proves the asset is reporting
+            self.last_arrival = arrival
+            return None
+        self.last_sample_time = sample_time
+        self.last_arrival = arrival
+
+        if self.rule_type == AlertRule.MISSING_DATA:
+            active = False
+        elif self.threshold is None:
+            return None
+        elif self.rule_type == AlertRule.THRESHOLD:
+            active = self.compare(value, self.threshold)
+        elif self.rule_type == AlertRule.SUSTAINED:
+            if self.compare(value, self.threshold):
+                if self.since is None:
+                    self.since = sample_time
+                active = sample_time - self.since >= self.duration
+            else:
+                self.since = None
+                active = False
+        elif self.rule_type == AlertRule.RATE_OF_CHANGE:
+            samples = self.samples
+            samples.append((sample_time, value))
+            # Keep the newest reading at or before the window start as the baseline
+            while len(samples) > 2 and samples[1][0] <= sample_time - self.duration:
+                samples.popleft()
+            first_time, first_value = samples[0]
+            if sample_time <= first_time:
+                return None
+            value = (value - first_value) / (sample_time - first_time)
+            active = self.compare(value, self.threshold)
+        return self._transition(active, value, sample_time)
+
+    def check_missing(self, now):
+        """Fire a missing-data rule once nothing arrived for `duration` seconds"""
+        if self.rule_type != AlertRule.MISSING_DATA or self.firing:
+            return None
+        if now - self.last_arrival < self.duration:
+            return None
+        # Stamped on the sample clock when one is known, so workers agree
+        if self.last_sample_time is not None:
+            triggered = self.last_sample_time + self.duration
+        else:
+            triggered = self.last_arrival + self.duration
+        return self._transition(True, None, triggered)
+
+    def _transition(self, active, value, sample_time):
+        if active == self.firing:
+            return None
+        self.firing = active
+        state = AlertEvent.FIRING if active else AlertEvent.RESOLVED
+        return {
+            'rule_id': self.id,
+            'rule': self.name,
+            'type': self.rule_type,
+            'severity': self.severity,
+            'service': self.service_name,
+            'id': self.asset_id,
+            'state': state,
+            'value': value,
+            'message': self.describe(state, value),
+            'triggered_at': _isoformat(datetime.fromtimestamp(sample_time, dt_timezone.utc))
+        }
+
+    def describe(self, state, value):
+        target = f"{self.service_name}/{self.asset_id}"
+        if state == AlertEvent.RESOLVED:
+            return f"{self.name}: {target} back to normal"
+        symbol = dict(AlertRule.OPERATORS)[self.operator]
+        if self.rule_type == AlertRule.MISSING_DATA:
+            return f"{self.name}: no data from {target} for {self.duration:g}s"
+        if self.rule_type == AlertRule.RATE_OF_CHANGE:
+            return f"{self.name}: {target} changing at {value:g}/s ({symbol} {self.threshold:g}/s)"
+        if self.rule_type == AlertRule.SUSTAINED:
+            return f"{self.name}: {target} = {value:g} ({symbol} {self.threshold:g} for {self.duration:g}s)"
+        return f"{self.name}: {target} = {value:g} ({symbol} {self.threshold:g})"
+
+    def status(self):
+        return {
+            'rule_id': self.id,
+            'rule': self.name,
+            'type': self.rule_type,
+            'severity': self.severity,
+            'service': self.service_name,
+            'id': self.asset_id
+        }
+
+# ==================== ENGINE ====================
+
+class RuleEngine:
+    """
+    Evaluates enabled AlertRules against live updates.
+
+    Rules are indexed by (service, asset id), so an update costs one dict
+    lookup per asset plus the rules that reference it - thousands of rules
+    on other assets add nothing. Runs as a live-state listener, so with a
+    shared live-state backend every worker evaluates every update; they
+    all derive the same transitions, which the AlertEvent unique
+    constraint collapses into one row. Transitions are persisted (through
+    the database writer when one is given to start()), then handed to
+    listeners (the live streams).
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rules = {}
+        self._index = {}
+        self._missing = []
+        self._listeners = []
+        self._loaded = False
+        self._version = 0
+        self._thread = None
+        # Database writer (see db_writer) persisting the transitions; None
+        # writes through this process's own connection
+        self.writer = None
+
+    def add_listener(self, callback):
+        """Call `callback(version, transitions)` after transitions are persisted"""
+        self._listeners.append(callback)
+
+    def load(self):
+        """(Re)load enabled rules, keeping the state of rules whose definition is unchanged"""
+        last_state = AlertEvent.objects.filter(rule=OuterRef('pk')).order_by('-triggered_at', '-id').values('state')[:1]
+        rules = (
+            AlertRule.objects.filter(enabled=True)
+            .select_related('service')
+            .annotate(last_state=Subquery(last_state))
+        )
+        with self._lock:
+            compiled = {}
+            for rule in rules:
+                current = CompiledRule(rule, firing=rule.last_state == AlertEvent.FIRING)
+                previous = self._rules.get(rule.id)
+                if previous is not None and previous.signature == current.signature:
+                    for field in ('firing', 'since', 'samples', 'last_sample_time', 'last_arrival'):
+                        setattr(current, field, getattr(previous, field))
+                compiled[rule.id] = current
+            index = {}
+            for rule in compiled.values():
+                index.setdefault((rule.service_name, rule.asset_id), []).append(rule)
+            self._rules = compiled
+            self._index = index
+            self._missing = [rule for rule in compiled.values() if rule.rule_type == AlertRule.MISSING_DATA]
+            self._loaded = True
+        return len(compiled)
+
+    def invalidate(self):
+        """Reload before the next evaluation"""
+        with self._lock:
+            self._loaded = False
+
+    def evaluate(self, services_data):
+        """Run the rules referencing the assets in one services list; returns transitions"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            index = self._index
+            if not index:
+                return []
+            transitions = []
+            arrival = time.time()
+            parsed = {}
+            for service in services_data:
+                service_name = service.get('name')
+                for asset in service.get('assets', []):
+                    rules = index.get((service_name, str(asset.get('id'))))
+                    if rules is None:
+                        continue
+                    try:
+                        value = float(str(asset.get('value')))
+                    except (TypeError, ValueError):
+                        continue
+                    raw_timestamp = asset.get('timestamp')
+                    sample_time = parsed.get(raw_timestamp)
+                    if sample_time is None:
+                        sample_time = parsed[raw_timestamp] = parse_asset_timestamp(raw_timestamp).timestamp()
+                    for rule in rules:
+                        transition = rule.observe(value, sample_time, arrival)
+                        if transition is not None:
+                            transitions.append(transition)
+            return transitions
+
+    def check_missing(self, now=None):
+        """Transitions of missing-data rules whose asset went quiet"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [t for t in (rule.check_missing(now) for rule in self._missing) if t is not None]
+
+    def active_alerts(self):
+        """Status of every rule currently firing"""
+        with self._lock:
+            return [rule.status() for rule in self._rules.values() if rule.firing]
+
+    def on_update(self, version, timestamp, services_data, changes, removed):
+        """Live-state listener"""
+        self._version = version
+        transitions = self.evaluate(services_data)
+        if transitions:
+            self._emit(version, transitions)
+
+    def _emit(self, version, transitions):
+        try:
+            if self.writer is None:
+                persist_alert_events(transitions)
+            else:
+                self.writer.write_alert_events(transitions)
+        except Exception as e:
+            print(f"⚠️ Alert events not persisted: {e}")
+        for t in transitions:
+            print(f"🚨 {t['message']}" if t['state'] == AlertEvent.FIRING else f"✅ {t['message']}")
+        for callback in list(self._listeners):
+            try:
+                callback(version, transitions)
+            except Exception as e:
+                print(f"⚠️ Alert listener error: {e}")
+
+    def run(self):
+        """Check missing-data rules every tick and reload rules periodically"""
+        last_reload = time.monotonic()
+        while True:
+            time.sleep(RULES_TICK_SECONDS)
+            try:
+                if time.monotonic() - last_reload >= RULES_RELOAD_SECONDS:
+                    self.load()
+                    last_reload = time.monotonic()
+                elif not self._loaded:
+                    self.load()
+                transitions = self.check_missing()
+                if transitions:
+                    self._emit(self._version, transitions)
+            except Exception as e:
+                print(f"⚠️ Rule engine tick failed: {e}")
+            finally:
+                connection.close()
+
+    def start(self, writer=None):
+        """Start the tick thread when IOT_RULES_ENABLED; returns it or None"""
+        if not RULES_ENABLED:
+            return None
+        self.writer = writer
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+
+def persist_alert_events(transitions):
+    """Insert AlertEvents for transitions; ones already recorded (by another worker) are dropped"""
+    AlertEvent.objects.bulk_create([
+        AlertEvent(
+            rule_id=t['rule_id'],
+            state=t['state'],
+            value=t['value'],
+            message=t['message'][:255],
+            triggered_at=datetime.fromisoformat(t['triggered_at'].replace('Z', '+00:00'))
+        )
+        for t in transitions
+    ], ignore_conflicts=True)
+
+
+# Process-wide engine fed by the live-state listener in views
+rule_engine = RuleEngine()
+
+
+@receiver(post_save, sender=AlertRule)
+@receiver(post_delete, sender=AlertRule)
+def _rule_changed(sender, instance, **kwargs):
+    rule_engine.invalidate()
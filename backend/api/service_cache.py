@@ -0,0 +1,74 @@
+# service_cache.py - In-process Service name -> primary key cache
+import threading
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Service
+
+
+class ServiceCache:
+    """
+    Maps service names to primary keys so the ingest hot loop never needs a
+    SELECT per service per payload.
+
+    Unknown names are inserted with INSERT ... ON CONFLICT DO NOTHING and then
+    read back, so concurrent gunicorn workers racing on the unique `name`
+    constraint all converge on the same row instead of raising IntegrityError.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def warm(self):
+        """Load every known service from the received_services table"""
+        ids = dict(Service.objects.values_list('name', 'id'))
+        with self._lock:
+            self._ids = ids
+        return len(ids)
+
+    def resolve(self, service_names):
+        """Return {name: pk} for the given names, creating any missing services"""
+        with self._lock:
+            service_ids = {name: self._ids[name] for name in service_names if name in self._ids}
+        missing = [name for name in service_names if name not in service_ids]
+        if not missing:
+            return service_ids
+
+        # Another worker may insert the same name concurrently - ignore the
+        # conflict and read back whichever row won.
+        Service.objects.bulk_create([Service(name=name) for name in missing], ignore_conflicts=True)
+        created = dict(Service.objects.filter(name__in=missing).values_list('name', 'id'))
+
+        with self._lock:
+            self._ids.update(created)
+        service_ids.update(created)
+        return service_ids
+
+    def invalidate(self, service_name=None):
+        """Drop one cached name, or the whole cache when no name is given"""
+        with self._lock:
+            if service_name is None:
+                self._ids = {}
+            else:
+                self._ids.pop(service_name, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+
+# Process-wide cache shared by the ingest pipeline
+service_cache = ServiceCache()
+
+
+@receiver(post_save, sender=Service)
+def _service_saved(sender, instance, created, **kwargs):
+    # A rename through the admin leaves the old name pointing at this row
+    if not created:
+        service_cache.invalidate()
+
+
+@receiver(post_delete, sender=Service)
+def _service_deleted(sender, instance, **kwargs):
+    service_cache.invalidate(instance.name)
@@ -0,0 +1,298 @@
+# storage.py - Pluggable storage backends for persisting ingest batches
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+import csv
+import io
+import json
+import threading
+
+try:
+    import psycopg
+except ImportError:  # psycopg2, or not running on PostgreSQL at all
+    psycopg = None
+
+from .models import Asset, IncomingIoTData
+from .rollups import update_rollups
+from .service_cache import service_cache
+
+# ==================== CONFIGURATION ====================
+# 'auto' picks the backend matching the default database's vendor
+STORAGE_BACKEND = getattr(settings, 'IOT_STORAGE_BACKEND', 'auto')
+# Daily incoming_assets partitions created ahead of time on PostgreSQL
+PARTITION_DAYS_AHEAD = getattr(settings, 'IOT_PARTITION_DAYS_AHEAD', 7)
+
+ASSET_COLUMNS = ('service_id', 'asset_id', 'value', '"timestamp"', 'created_at')
+PAYLOAD_COLUMNS = ('raw_data', 'total_services', 'total_assets', 'received_at', 'processed')
+
+# ==================== BACKENDS ====================
+
+class StorageBackend:
+    """
+    Persists one normalized ingest batch - raw payloads, asset rows and
+    rollups - in a single transaction. Subclasses implement the inserts.
+    """
+    name = None
+
+    def persist_batch(self, payloads, normalized):
+        """
+        `payloads` are the raw payloads and `normalized` the matching
+        normalize_payload() results. Returns the number of asset rows written.
+        """
+        service_names = {row[0] for _, asset_rows in normalized for row in asset_rows}
+        service_names.update(
+            service['name'] for processed_services, _ in normalized for service in processed_services
+        )
+
+        # Resolved outside the batch transaction so a rollback never leaves
+        # uncommitted primary keys in the cache
+        service_ids = service_cache.resolve(sorted(service_names))
+
+        asset_rows = [row for _, rows in normalized for row in rows]
+        payload_rows = [
+            (
+                raw_data,
+                len(processed_services),
+                sum(len(service['assets']) for service in processed_services)
+            )
+            for raw_data, (processed_services, _) in zip(payloads, normalized)
+        ]
+
+        self.prepare_batch(asset_rows)
+
+        with transaction.atomic():
+            self.insert_payloads(payload_rows)
+            inserted = self.insert_assets(asset_rows, service_ids)
+            # Rollups are merged in the same transaction, so they never drift
+            # from the raw rows they summarize
+            update_rollups(inserted, service_ids)
+
+        return len(asset_rows)
+
+    def prepare_batch(self, asset_rows):
+        """Schema upkeep needed before the batch transaction (none by default)"""
+
+    def insert_payloads(self, payload_rows):
+        """Store (raw_data, total_services, total_assets) rows as processed payloads"""
+        raise NotImplementedError
+
+    def insert_assets(self, asset_rows, service_ids):
+        """
+        Store (service_name, asset_id, value, timestamp) rows, skipping
+        readings already stored. Returns the rows actually inserted.
+        """
+        raise NotImplementedError
+
+
+class SQLiteStorage(StorageBackend):
+    """ORM bulk_create path - the SQLite backend, portable to any Django database"""
+    name = 'sqlite'
+
+    def insert_payloads(self, payload_rows):
+        IncomingIoTData.objects.bulk_create([
+            IncomingIoTData(raw_data=raw_data, total_services=total_services, total_assets=total_assets, processed=True)
+            for raw_data, total_services, total_assets in payload_rows
+        ])
+
+    def insert_assets(self, asset_rows, service_ids):
+        # bulk_create cannot report which rows were skipped, so find the new
+        # ones first
+        inserted = new_asset_rows(asset_rows, service_ids)
+        Asset.objects.bulk_create([
+            Asset(
+                service_id=service_ids[service_name],
+                asset_id=asset_id,
+                value=value,
+                timestamp=asset_timestamp
+            )
+            for service_name, asset_id, value, asset_timestamp in asset_rows
+        ], batch_size=500, ignore_conflicts=True)
+        return inserted
+
+
+class PostgreSQLStorage(StorageBackend):
+    """
+    COPY-based bulk loading. Asset rows are copied into a temporary staging
+    table and moved into the day-partitioned incoming_assets with
+    INSERT ... ON CONFLICT DO NOTHING RETURNING, which also yields exactly
+    the rows that were new.
+    """
+    name = 'postgresql'
+
+    def __init__(self):
+        self._partitions = set()
+        self._partitions_lock = threading.Lock()
+
+    def insert_payloads(self, payload_rows):
+        now = datetime.now(dt_timezone.utc)
+        with connection.cursor() as cursor:
+            copy_rows(cursor, IncomingIoTData._meta.db_table, PAYLOAD_COLUMNS, [
+                (json.dumps(raw_data, default=str), total_services, total_assets, now, True)
+                for raw_data, total_services, total_assets in payload_rows
+            ])
+
+    def prepare_batch(self, asset_rows):
+        # Created outside the batch transaction so the lock on the parent
+        # table is not held for the whole batch
+        self.ensure_partitions({
+            asset_timestamp.astimezone(dt_timezone.utc).date() for _, _, _, asset_timestamp in asset_rows
+        })
+
+    def insert_assets(self, asset_rows, service_ids):
+        if not asset_rows:
+            return []
+        now = datetime.now(dt_timezone.utc)
+        names = {service_id: name for name, service_id in service_ids.items()}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS incoming_assets_staging ("
+                "service_id bigint, asset_id varchar(100), value double precision, "
+                "\"timestamp\" timestamp with time zone, created_at timestamp with time zone"
+                ") ON COMMIT DELETE ROWS"
+            )
+            copy_rows(cursor, 'incoming_assets_staging', ASSET_COLUMNS, [
+                (service_ids[service_name], str(asset_id), value, asset_timestamp, now)
+                for service_name, asset_id, value, asset_timestamp in asset_rows
+            ])
+            columns = ', '.join(ASSET_COLUMNS)
+            cursor.execute(
+                f"INSERT INTO incoming_assets ({columns}) SELECT {columns} FROM incoming_assets_staging "
+                f"ON CONFLICT DO NOTHING RETURNING service_id, asset_id, value, \"timestamp\""
+            )
+            inserted = [(names[service_id], asset_id, value, ts) for service_id, asset_id, value, ts in cursor.fetchall()]
+            # Emptied now too, in case several batches share a transaction
+            cursor.execute("TRUNCATE incoming_assets_staging")
+        return inserted
+
+    def ensure_partitions(self, days):
+        """Create the daily partitions for `days` (and the days ahead) if missing"""
+        today = datetime.now(dt_timezone.utc).date()
+        days = set(days) | {today + timedelta(days=n) for n in range(PARTITION_DAYS_AHEAD + 1)}
+        with self._partitions_lock:
+            missing = days - self._partitions
+            if not missing:
+                return
+            with connection.cursor() as cursor:
+                for day in sorted(missing):
+                    try:
+                        create_day_partition(cursor, day)
+                    except DatabaseError as e:
+                        # e.g. rows for that day already sit in the DEFAULT
+                        # partition - they keep landing there
+                        print(f"⚠️ Could not create partition for {day}: {e}")
+            self._partitions.update(missing)
+
+    def drop_partitions_before(self, cutoff):
+        """Drop whole daily partitions that end before `cutoff`; returns their names"""
+        dropped = []
+        with connection.cursor() as cursor:
+            for name, day in list_day_partitions(cursor):
+                if datetime.combine(day + timedelta(days=1), dt_time.min, dt_timezone.utc) <= cutoff:
+                    cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+                    dropped.append(name)
+        with self._partitions_lock:
+            self._partitions.clear()
+        return dropped
+
+# ==================== HELPERS ====================
+
+def new_asset_rows(asset_rows, service_ids):
+    """
+    Drop rows the asset insert will skip as duplicates - repeats within the
+    batch and readings already stored - so rollups count each sample once.
+    """
+    unique_rows = {}
+    for row in asset_rows:
+        key = (service_ids[row[0]], str(row[1]), row[3])
+        unique_rows.setdefault(key, row)
+    if not unique_rows:
+        return []
+
+    # One lookup per chunk of distinct timestamps; constraining all three
+    # columns lets it probe the (service, asset_id, timestamp) unique index
+    existing = set()
+    service_id_set = {key[0] for key in unique_rows}
+    asset_id_set = {key[1] for key in unique_rows}
+    timestamps = sorted({key[2] for key in unique_rows})
+    for start in range(0, len(timestamps), 500):
+        existing.update(
+            Asset.objects.filter(
+                service_id__in=service_id_set,
+                asset_id__in=asset_id_set,
+                timestamp__in=timestamps[start:start + 500]
+            ).values_list('service_id', 'asset_id', 'timestamp')
+        )
+    return [row for key, row in unique_rows.items() if key not in existing]
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY rows into `table` through psycopg 3 or psycopg2"""
+    if not rows:
+        return
+    raw_cursor = cursor.cursor
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    if psycopg is not None and isinstance(raw_cursor, psycopg.Cursor):
+        with raw_cursor.copy(sql) as copy:
+            for row in rows:
+                copy.write_row(row)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+    buffer.seek(0)
+    raw_cursor.copy_expert(f"{sql} WITH (FORMAT csv)", buffer)
+
+def day_partition_name(day):
+    return f"incoming_assets_{day:%Y%m%d}"
+
+def create_day_partition(cursor, day):
+    """Create the incoming_assets partition holding `day` (UTC)"""
+    start = datetime.combine(day, dt_time.min, dt_timezone.utc)
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{day_partition_name(day)}" PARTITION OF incoming_assets '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{(start + timedelta(days=1)).isoformat()}')"
+    )
+
+def list_day_partitions(cursor):
+    """(name, day) of every daily incoming_assets partition"""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'incoming_assets'"
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        try:
+            partitions.append((name, datetime.strptime(name[-8:], '%Y%m%d').date()))
+        except ValueError:
+            continue  # the DEFAULT partition
+    return partitions
+
+# ==================== BACKEND SELECTION ====================
+
+STORAGE_BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'postgresql': PostgreSQLStorage,
+}
+
+_storage = None
+
+def create_storage(backend=None):
+    """Instantiate a storage backend; 'auto' follows the database vendor"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'auto':
+        backend = 'postgresql' if connection.vendor == 'postgresql' else 'sqlite'
+    try:
+        return STORAGE_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown IOT_STORAGE_BACKEND '{backend}' (choose from auto, {', '.join(STORAGE_BACKENDS)})"
+        )
+
+def get_storage():
+    """Process-wide storage backend, created on first use"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
@@ -0,0 +1,268 @@
+# streaming.py - Async fan-out of live-state updates to streaming subscribers
+from django.conf import settings
+import asyncio
+import json
+import threading
+
+# ==================== CONFIGURATION ====================
+SSE_HEARTBEAT_SECONDS = getattr(settings, 'IOT_SSE_HEARTBEAT_SECONDS', 15)
+SSE_CLIENT_QUEUE_SIZE = getattr(settings, 'IOT_SSE_CLIENT_QUEUE_SIZE', 64)
+
+# ==================== SUBSCRIPTIONS ====================
+
+class Subscription:
+    """
+    One connected client: a bounded asyncio queue living on the client's
+    event loop. When the queue fills up the client is a slow consumer: it is
+    either dropped, or - with `conflate` - its backlog is replaced by the
+    newest message so it skips straight to the latest state.
+    """
+    def __init__(self, loop, maxsize, conflate=False):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.conflate = conflate
+        self.dropped = False
+        self.conflated = 0
+
+    def deliver(self, message):
+        """Enqueue a message - must run on self.loop"""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Discard the backlog; either keep only the newest message or
+            # wake the consumer with None so it can close. Durable messages
+            # (alerts) are not superseded by newer state, so they stay.
+            durable = []
+            while not self.queue.empty():
+                queued = self.queue.get_nowait()
+                if getattr(queued, 'durable', False):
+                    durable.append(queued)
+                else:
+                    self.conflated += 1
+            if self.conflate:
+                for queued in durable[-(self.queue.maxsize - 1):]:
+                    self.queue.put_nowait(queued)
+                self.queue.put_nowait(message)
+            else:
+                self.dropped = True
+                self.queue.put_nowait(None)
+
+    async def get(self, timeout=None):
+        """Next message, None once dropped; raises asyncio.TimeoutError on timeout"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class UpdateBroadcaster:
+    """
+    Fans messages out from the processor thread to asyncio subscribers.
+
+    publish() is thread-safe and never blocks: it schedules one callback per
+    event loop, which then enqueues into every subscriber on that loop.
+    """
+    def __init__(self, queue_size=None, conflate=False):
+        self.queue_size = queue_size or SSE_CLIENT_QUEUE_SIZE
+        self.conflate = conflate
+        self._lock = threading.Lock()
+        self._subscribers = {}  # loop -> set of Subscription
+        self.dropped_total = 0
+
+    def subscribe(self, maxsize=None):
+        """Register a subscriber on the running event loop"""
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(loop, maxsize or self.queue_size, self.conflate)
+        with self._lock:
+            self._subscribers.setdefault(loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.loop)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.loop]
+        if subscription.dropped:
+            self.dropped_total += 1
+
+    def publish(self, message):
+        with self._lock:
+            targets = [(loop, list(subscribers)) for loop, subscribers in self._subscribers.items()]
+        for loop, subscribers in targets:
+            try:
+                loop.call_soon_threadsafe(self._deliver_all, subscribers, message)
+            except RuntimeError:
+                # Event loop already closed - forget its subscribers
+                with self._lock:
+                    self._subscribers.pop(loop, None)
+
+    @staticmethod
+    def _deliver_all(subscribers, message):
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+# ==================== SERVER-SENT EVENTS ====================
+
+def format_sse_frame(version, text, event=None):
+    """Encode one SSE frame from JSON text; `id` lets EventSource resume with Last-Event-ID"""
+    lines = [f"id: {version}"]
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {text}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+def format_sse_event(version, data, event=None):
+    """Encode one SSE frame from a JSON-serializable dict"""
+    return format_sse_frame(version, json.dumps(data), event)
+
+SSE_HEARTBEAT = b": heartbeat\n\n"
+
+# ==================== SUBSCRIPTION FILTERS ====================
+
+def parse_filter(services=None, assets=None):
+    """
+    Build a hashable filter from service names and "service:asset_id" strings.
+    Returns None when the client wants everything.
+    """
+    services = frozenset(s for s in (services or []) if s)
+    asset_pairs = set()
+    for asset in assets or []:
+        service_name, sep, asset_id = str(asset).partition(':')
+        if sep and service_name and asset_id:
+            asset_pairs.add((service_name, asset_id))
+    if not services and not asset_pairs:
+        return None
+    return services, frozenset(asset_pairs)
+
+def apply_filter(services_data, subscription_filter):
+    """Keep only the subscribed services and assets"""
+    if subscription_filter is None:
+        return services_data
+    services, asset_pairs = subscription_filter
+    asset_services = {service_name for service_name, _ in asset_pairs}
+    filtered = []
+    for service in services_data:
+        name = service.get('name')
+        if name in services:
+            filtered.append(service)
+        elif name in asset_services:
+            assets = [a for a in service.get('assets', []) if (name, str(a.get('id'))) in asset_pairs]
+            if assets:
+                filtered.append({'name': name, 'assets': assets})
+    return filtered
+
+# ==================== ENCODE-ONCE UPDATES ====================
+
+def filter_changes(items, subscription_filter):
+    """Keep only the delta items ({service, id, ...}) a client subscribed to"""
+    if subscription_filter is None:
+        return items
+    services, asset_pairs = subscription_filter
+    return [
+        item for item in items
+        if item['service'] in services or (item['service'], str(item['id'])) in asset_pairs
+    ]
+
+class LiveUpdate:
+    """
+    One processed update shared by every connection. The JSON text is
+    encoded at most once per (subscription filter, full/delta) combination,
+    however many clients share it.
+    """
+    __slots__ = ('version', 'timestamp', 'services', 'changes', 'removed', 'queue_size', '_encoded', '_frames')
+    durable = False
+
+    def __init__(self, version, timestamp, services, changes=None, removed=None, queue_size=0):
+        self.version = version
+        self.timestamp = timestamp
+        self.services = services
+        self.changes = changes
+        self.removed = removed
+        self.queue_size = queue_size
+        self._encoded = {}
+        self._frames = {}
+
+    def encode(self, subscription_filter=None, delta=False):
+        """
+        JSON text for this filter, or None when nothing subscribed changed.
+        Deltas need `changes`; without them the full state is sent.
+        """
+        delta = delta and self.changes is not None
+        key = (subscription_filter, delta)
+        if key in self._encoded:
+            return self._encoded[key]
+        text = None
+        if delta:
+            changes = filter_changes(self.changes, subscription_filter)
+            removed = filter_changes(self.removed or [], subscription_filter)
+            if changes or removed or subscription_filter is None:
+                text = json.dumps({
+                    "type": "iot_data_delta",
+                    "version": self.version,
+                    "timestamp": self.timestamp,
+                    "changes": changes,
+                    "removed": removed,
+                    "queue_size": self.queue_size
+                })
+        else:
+            services = apply_filter(self.services, subscription_filter)
+            if services or subscription_filter is None:
+                text = json.dumps({
+                    "type": "iot_data_update",
+                    "version": self.version,
+                    "timestamp": self.timestamp,
+                    "services": services,
+                    "queue_size": self.queue_size
+                })
+        self._encoded[key] = text
+        return text
+
+    def sse_frame(self, delta=False):
+        """Unfiltered SSE frame, built once per mode"""
+        frame = self._frames.get(delta)
+        if frame is None:
+            frame = format_sse_frame(self.version, self.encode(delta=delta))
+            self._frames[delta] = frame
+        return frame
+
+class AlertUpdate:
+    """
+    Alert state transitions (see rules), pushed on the same streams as live
+    updates. They are not a state version: SSE frames carry no id (so
+    Last-Event-ID keeps tracking the data), and slow-consumer conflation
+    never discards them.
+    """
+    __slots__ = ('version', 'alerts', '_encoded', '_frame')
+    durable = True
+
+    def __init__(self, version, alerts):
+        self.version = version
+        self.alerts = alerts
+        self._encoded = {}
+        self._frame = None
+
+    def encode(self, subscription_filter=None, delta=False):
+        """JSON text of the transitions on subscribed assets, or None when there are none"""
+        if subscription_filter in self._encoded:
+            return self._encoded[subscription_filter]
+        alerts = filter_changes(self.alerts, subscription_filter)
+        text = json.dumps({"type": "alert", "version": self.version, "alerts": alerts}) if alerts else None
+        self._encoded[subscription_filter] = text
+        return text
+
+    def sse_frame(self, delta=False):
+        if self._frame is None:
+            self._frame = f"event: alert\ndata: {self.encode()}\n\n".encode('utf-8')
+        return self._frame
+
+# Process-wide broadcaster feeding /api/stream/iot-data
+sse_broadcaster = UpdateBroadcaster()
@@ -0,0 +1,142 @@
+# test_asset_stats.py - Rolling per-asset windows checked against a brute-force window
+import math
+import random
+import statistics
+
+from django.test import SimpleTestCase
+
+from api.asset_stats import AssetStatsRegistry, AssetWindow
+
+class BruteForceWindow:
+    """The same window kept as a plain list, with every statistic recomputed on read"""
+    def __init__(self, depth, window_seconds=0):
+        self.depth = depth
+        self.window_seconds = window_seconds
+        self.samples = []
+
+    def add(self, timestamp, value):
+        if self.samples and timestamp <= self.samples[-1][0]:
+            return False
+        self.samples = self.samples[-(self.depth - 1):] + [(timestamp, value)]
+        if self.window_seconds:
+            self.samples = [sample for sample in self.samples if sample[0] >= timestamp - self.window_seconds]
+        return True
+
+    def stats(self):
+        values = [value for _, value in self.samples]
+        (first_time, first_value), (last_time, last_value) = self.samples[0], self.samples[-1]
+        return {
+            'count': len(values),
+            'mean': statistics.fmean(values),
+            'min': min(values),
+            'max': max(values),
+            'stddev': statistics.pstdev(values),
+            'rate_per_second': (last_value - first_value) / (last_time - first_time) if last_time > first_time else None,
+            'last_value': last_value,
+            'span_seconds': last_time - first_time,
+        }
+
+class AssetWindowTests(SimpleTestCase):
+    def assertMatches(self, window, reference, tolerance=1e-6):
+        stats, expected = window.stats(), reference.stats()
+        for key in ('count', 'min', 'max', 'last_value', 'span_seconds'):
+            self.assertEqual(stats[key], expected[key], key)
+        # Relative to the spread of the values, which is what the sums have to resolve
+        scale = max(expected['max'] - expected['min'], 1.0)
+        self.assertAlmostEqual(stats['mean'], expected['mean'], delta=tolerance * scale)
+        self.assertAlmostEqual(stats['stddev'], expected['stddev'], delta=tolerance * scale)
+        if expected['rate_per_second'] is None:
+            self.assertIsNone(stats['rate_per_second'])
+        else:
+            self.assertAlmostEqual(stats['rate_per_second'], expected['rate_per_second'], delta=tolerance * scale)
+
+    def feed(self, window, reference, samples):
+        for timestamp, value in samples:
+            self.assertEqual(window.add(timestamp, value), reference.add(timestamp, value))
+            self.assertMatches(window, reference)
+
+    def test_count_eviction_matches_brute_force(self):
+        rng = random.Random(1)
+        samples = [(float(second), rng.uniform(-50, 50)) for second in range(200)]
+        self.feed(AssetWindow(depth=16, window_seconds=0), BruteForceWindow(16), samples)
+
+    def test_time_window_eviction_matches_brute_force(self):
+        rng = random.Random(2)
+        timestamp, samples = 0.0, []
+        for _ in range(300):
+            # Bursts and gaps longer than the window, so it empties down to one sample too
+            timestamp += rng.choice([0.01, 0.1, 0.5, 3.0, 12.0])
+            samples.append((timestamp, rng.gauss(20, 5)))
+        self.feed(AssetWindow(depth=64, window_seconds=10), BruteForceWindow(64, window_seconds=10), samples)
+
+    def test_monotonic_runs_keep_min_and_max_exact(self):
+        window, reference = AssetWindow(depth=8, window_seconds=0), BruteForceWindow(8)
+        # Rising, falling, flat and repeated extremes - each one pops or keeps deque entries
+        values = list(range(20)) + list(range(20, 0, -1)) + [5.0] * 10 + [9, 1, 9, 1, 9, 1]
+        self.feed(window, reference, [(float(t), float(v)) for t, v in enumerate(values)])
+
+    def test_shifted_sums_survive_a_large_offset(self):
+        # Naive sums of squares of values near 1e9 lose the variance entirely
+        rng = random.Random(3)
+        samples = [(float(t), 1e9 + rng.uniform(-1, 1)) for t in range(100)]
+        window, reference = AssetWindow(depth=20, window_seconds=0), BruteForceWindow(20)
+        self.feed(window, reference, samples)
+        self.assertGreater(window.stats()['stddev'], 0.3)
+
+    def test_sums_are_recomputed_once_per_depth_evictions(self):
+        window = AssetWindow(depth=10, window_seconds=0)
+        for t in range(10):
+            window.add(float(t), 1000.0 + t)
+        self.assertEqual((window._evictions, window._shift), (0, 1000.0))
+
+        for t in range(10, 19):
+            window.add(float(t), 1000.0 + t)
+        self.assertEqual(window._evictions, 9)
+        window.add(19.0, 1019.0)
+        # The tenth eviction re-sums around the oldest retained value
+        self.assertEqual((window._evictions, window._shift), (0, 1010.0))
+        self.assertEqual(window._sum, math.fsum(range(10)))
+
+    def test_drifting_values_stay_accurate_over_many_resums(self):
+        rng = random.Random(4)
+        samples = [(float(t), t * 1e4 + rng.uniform(-1, 1)) for t in range(2000)]
+        window, reference = AssetWindow(depth=25, window_seconds=0), BruteForceWindow(25)
+        for timestamp, value in samples:
+            window.add(timestamp, value)
+            reference.add(timestamp, value)
+        self.assertMatches(window, reference, tolerance=1e-9)
+
+    def test_repeated_and_out_of_order_timestamps_are_ignored(self):
+        window = AssetWindow(depth=4, window_seconds=0)
+        self.assertTrue(window.add(10.0, 1.0))
+        self.assertFalse(window.add(10.0, 2.0))
+        self.assertFalse(window.add(9.0, 3.0))
+        self.assertEqual(window.stats()['count'], 1)
+        self.assertIsNone(window.stats()['rate_per_second'])
+
+    def test_samples_are_the_newest_oldest_first(self):
+        window = AssetWindow(depth=3, window_seconds=0)
+        for t in range(5):
+            window.add(t + 0.5, float(t))
+        self.assertEqual(window.samples(), [[2500, 2.0], [3500, 3.0], [4500, 4.0]])
+        self.assertEqual(window.samples(2), [[3500, 3.0], [4500, 4.0]])
+        self.assertEqual(AssetWindow(depth=3).stats(), {'count': 0})
+
+
+class AssetStatsRegistryTests(SimpleTestCase):
+    def test_numeric_readings_are_recorded_per_asset(self):
+        registry = AssetStatsRegistry(depth=10, window_seconds=0)
+        added = registry.record([{'name': 'crane', 'assets': [
+            {'id': 7, 'value': '3.5', 'timestamp': '2030-01-01T00:00:00Z'},
+            {'id': 'mode', 'value': 'auto', 'timestamp': '2030-01-01T00:00:00Z'},
+            {'id': 'bad', 'value': float('nan'), 'timestamp': '2030-01-01T00:00:00Z'},
+        ]}])
+        registry.record([{'name': 'crane', 'assets': [{'id': '7', 'value': 4.5, 'timestamp': '2030-01-01T00:00:02Z'}]}])
+
+        self.assertEqual(added, 1)
+        self.assertEqual(len(registry), 1)
+        stats = registry.stats('crane', 7, samples=5)
+        self.assertEqual((stats['count'], stats['mean'], stats['rate_per_second']), (2, 4.0, 0.5))
+        self.assertEqual(stats['first_timestamp'], '2030-01-01T00:00:00Z')
+        self.assertEqual(len(stats['samples']), 2)
+        self.assertIsNone(registry.stats('crane', 'mode'))
@@ -0,0 +1,143 @@
+# test_batch_ingest.py - Batch body decoding, the payload-counted queue and the batch endpoint
+import gzip
+import json
+import queue
+import zlib
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase
+
+from api import batch_ingest
+from api.batch_ingest import BatchDecodeError, count_assets, decode_batch
+from api.coalesce import PayloadQueue
+from api.ingest import PayloadBatch, drain_batch
+
+def payload(value, name='batch_test'):
+    return {'name': name, 'assets': [{'id': 'load', 'value': value}]}
+
+PAYLOADS = [payload(1), {'services': [payload(2), payload(3, 'other')]}, [payload(4)]]
+
+class DecodeBatchTests(SimpleTestCase):
+    def test_ndjson_skips_blank_lines_and_reports_bad_ones(self):
+        body = b'\n'.join([json.dumps(PAYLOADS[0]).encode(), b'', b'{not json', b'42', json.dumps(PAYLOADS[1]).encode()])
+        payloads, errors, rejected = decode_batch(body, 'application/x-ndjson; charset=utf-8')
+
+        self.assertEqual(payloads, PAYLOADS[:2])
+        self.assertEqual(rejected, 2)
+        self.assertTrue(errors[0].startswith('line 3:'))
+        self.assertEqual(errors[1], 'entry 1: not a payload object')
+
+    def test_json_array_or_single_object(self):
+        self.assertEqual(decode_batch(json.dumps(PAYLOADS).encode(), 'application/json'), (PAYLOADS, [], 0))
+        self.assertEqual(decode_batch(json.dumps(PAYLOADS[0]).encode(), 'application/json'), ([PAYLOADS[0]], [], 0))
+
+    def test_unreadable_bodies_raise_with_their_status(self):
+        cases = [
+            (b'[1,', 'application/json', None, 400),
+            (b'"text"', 'application/json', None, 400),
+            (b'{}', 'text/plain', None, 415),
+            (b'{}', 'application/json', 'br', 415),
+            (b'not gzip', 'application/json', 'gzip', 400),
+        ]
+        for body, content_type, encoding, status in cases:
+            with self.subTest(content_type=content_type, encoding=encoding):
+                with self.assertRaises(BatchDecodeError) as raised:
+                    decode_batch(body, content_type, encoding)
+                self.assertEqual(raised.exception.status, status)
+
+    def test_gzip_and_deflate_bodies(self):
+        body = json.dumps(PAYLOADS).encode()
+        self.assertEqual(decode_batch(gzip.compress(body), 'application/json', 'gzip')[0], PAYLOADS)
+        self.assertEqual(decode_batch(zlib.compress(body), 'application/json', 'deflate')[0], PAYLOADS)
+
+    @skipUnless(batch_ingest.msgpack, 'msgpack not installed')
+    def test_msgpack_body(self):
+        body = batch_ingest.msgpack.packb(PAYLOADS)
+        self.assertEqual(decode_batch(body, 'application/msgpack')[0], PAYLOADS)
+        with self.assertRaises(BatchDecodeError):
+            decode_batch(b'\xc1', 'application/msgpack')
+
+    @skipUnless(batch_ingest.zstandard, 'zstandard not installed')
+    def test_zstd_body(self):
+        body = batch_ingest.zstandard.ZstdCompressor().compress(json.dumps(PAYLOADS).encode())
+        self.assertEqual(decode_batch(body, 'application/json', 'zstd')[0], PAYLOADS)
+
+    def test_bodies_inflating_past_the_limit_are_refused(self):
+        body = gzip.compress(b'[' + b' ' * 4096 + b']')
+        with mock.patch.object(batch_ingest, 'BATCH_MAX_DECODED_BYTES', 1024):
+            with self.assertRaises(BatchDecodeError) as raised:
+                decode_batch(body, 'application/json', 'gzip')
+        self.assertEqual(raised.exception.status, 413)
+
+    def test_too_many_payloads_are_refused(self):
+        with mock.patch.object(batch_ingest, 'BATCH_MAX_PAYLOADS', 2):
+            with self.assertRaises(BatchDecodeError) as raised:
+                decode_batch(json.dumps(PAYLOADS).encode(), 'application/json')
+        self.assertEqual(raised.exception.status, 413)
+
+    def test_count_assets_across_payload_shapes(self):
+        self.assertEqual(count_assets(PAYLOADS), 4)
+
+
+class PayloadQueueTests(SimpleTestCase):
+    def test_batches_count_as_their_payloads(self):
+        data_queue = PayloadQueue(maxsize=10)
+        data_queue.put((PayloadBatch([{}] * 8), None), block=False)
+        self.assertEqual(data_queue.qsize(), 8)
+        with self.assertRaises(queue.Full):
+            data_queue.put((PayloadBatch([{}] * 3), None), block=False)
+        data_queue.put(({}, None), block=False)
+        data_queue.put(({}, None), block=False)
+        self.assertEqual(data_queue.qsize(), 10)
+        with self.assertRaises(queue.Full):
+            data_queue.put(({}, None), block=False)
+
+        self.assertEqual(len(drain_batch(data_queue, 100, 0)), 8)
+        self.assertEqual(data_queue.qsize(), 2)
+
+    def test_oversized_batch_still_fits_an_empty_queue(self):
+        data_queue = PayloadQueue(maxsize=10)
+        data_queue.put((PayloadBatch([{}] * 50), None), block=False)
+        self.assertEqual(data_queue.qsize(), 50)
+        with self.assertRaises(queue.Full):
+            data_queue.put(({}, None), block=False)
+
+
+class BatchEndpointTests(SimpleTestCase):
+    def post(self, data_queue, body, content_type='application/json', **headers):
+        with mock.patch('api.views.iot_data_store', SimpleNamespace(data_queue=data_queue)):
+            return self.client.post('/api/iot-data/receive/batch', body, content_type=content_type, headers=headers)
+
+    def test_batch_is_queued_as_one_item(self):
+        data_queue = PayloadQueue(maxsize=100)
+        body = b'\n'.join(json.dumps(p).encode() for p in PAYLOADS) + b'\n{bad'
+        response = self.post(data_queue, body, 'application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEqual((result['accepted'], result['rejected'], result['received_assets']), (3, 1, 4))
+        batch, _ = data_queue.get_nowait()
+        self.assertIsInstance(batch, PayloadBatch)
+        self.assertEqual(list(batch), PAYLOADS)
+
+    @skipUnless(batch_ingest.msgpack and batch_ingest.zstandard, 'msgpack and zstandard not installed')
+    def test_compressed_msgpack_batch(self):
+        body = batch_ingest.zstandard.ZstdCompressor().compress(batch_ingest.msgpack.packb(PAYLOADS))
+        response = self.post(PayloadQueue(maxsize=100), body, 'application/msgpack', content_encoding='zstd')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['accepted'], 3)
+
+    def test_full_queue_answers_503(self):
+        data_queue = PayloadQueue(maxsize=4)
+        data_queue.put((PayloadBatch([{}] * 2), None), block=False)
+        response = self.post(data_queue, json.dumps(PAYLOADS).encode())
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)['rejected'], 3)
+        self.assertEqual(data_queue.qsize(), 2)
+
+    def test_undecodable_body_answers_with_its_status(self):
+        response = self.post(PayloadQueue(maxsize=4), b'{}', 'text/csv')
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(json.loads(response.content)['success'])
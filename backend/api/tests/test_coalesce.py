@@ -0,0 +1,118 @@
+# test_coalesce.py - Coalescing ingest queue: merged updates, drops and the persister
+import logging
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import ingest
+from api.coalesce import CoalescingQueue, coalesce_services
+from api.ingest import PayloadBatch
+
+def service(name, *assets):
+    return {'name': name, 'assets': [{'id': asset_id, 'value': value} for asset_id, value in assets]}
+
+class CoalesceServicesTests(SimpleTestCase):
+    def test_newest_reading_per_asset_wins_in_first_seen_order(self):
+        services, superseded = coalesce_services([
+            [service('crane', ('load', 1), ('angle', 10))],
+            [service('hoist', ('speed', 5)), service('crane', ('load', 2))],
+            [service('crane', ('load', 3), ('wind', 7))],
+        ])
+
+        self.assertEqual(services, [
+            service('crane', ('load', 3), ('angle', 10), ('wind', 7)),
+            service('hoist', ('speed', 5)),
+        ])
+        self.assertEqual(superseded, 2)
+
+    def test_asset_ids_match_across_types(self):
+        services, superseded = coalesce_services([[service('crane', (1, 'a'))], [service('crane', ('1', 'b'))]])
+        self.assertEqual(services, [service('crane', ('1', 'b'))])
+        self.assertEqual(superseded, 1)
+
+
+class DropTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ingest, 'ingest_log')
+        self.log = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = CoalescingQueue(maxsize=5, threshold=2)
+
+    def test_overflow_drops_the_oldest_payloads_and_logs_them(self):
+        for value in range(3):
+            self.queue.put(({'value': value}, None))
+        self.assertFalse(self.log.event.called)
+        self.queue.put((PayloadBatch([{}] * 4), None))
+
+        self.assertEqual(self.queue.qsize(), 5)
+        self.assertEqual(self.queue.get_nowait(), ({'value': 2}, None))
+        metrics = self.queue.get_metrics()
+        self.assertEqual((metrics['received'], metrics['dropped'], metrics['queue_size'], metrics['queued_items']),
+                         (7, 2, 4, 1))
+        self.log.event.assert_called_once_with(
+            'coalesce_dropped', logging.WARNING, totals=('payloads',), payloads=2, pending=5, max_pending=5
+        )
+
+    def test_qsize_counts_payloads_like_the_fifo_queue(self):
+        self.queue.put((PayloadBatch([{}] * 3), None))
+        self.assertEqual(self.queue.qsize(), 3)
+        self.assertTrue(self.queue.backed_up())
+        self.queue.get_nowait()
+        self.assertEqual(self.queue.qsize(), 0)
+        self.assertTrue(self.queue.empty())
+
+    def test_a_batch_larger_than_the_backlog_replaces_it(self):
+        self.queue.put(({}, None))
+        self.queue.put((PayloadBatch([{}] * 9), None))
+        self.assertEqual(self.queue.qsize(), 9)
+        self.assertEqual(self.queue.get_metrics()['dropped'], 1)
+
+
+class PersisterTests(SimpleTestCase):
+    """The persister thread, writing through a gate the test opens"""
+    def setUp(self):
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+        self.written = []
+        patcher = mock.patch.object(ingest, 'persist_normalized', self.persist_normalized)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.gate.set)
+        self.queue = CoalescingQueue(maxsize=4, persist_batch_size=10)
+
+    def persist_normalized(self, payloads, normalized, writer=None):
+        self.writing.set()
+        self.gate.wait()
+        self.written.append(list(payloads))
+
+    def persist(self, *payloads):
+        self.queue.persist(list(payloads), [None] * len(payloads))
+
+    def test_wait_persisted_blocks_until_the_backlog_is_written(self):
+        self.persist(1, 2)
+        self.assertTrue(self.writing.wait(5))
+        self.persist(3)
+        self.assertFalse(self.queue.wait_persisted(timeout=0.05))
+
+        self.gate.set()
+        self.assertTrue(self.queue.wait_persisted(timeout=5))
+        self.assertEqual(self.written, [[1, 2], [3]])
+        self.assertEqual(self.queue.get_metrics()['persisted'], 3)
+
+    def test_a_slow_persister_holds_up_the_processor_instead_of_losing_writes(self):
+        self.persist(1, 2, 3)
+        self.assertTrue(self.writing.wait(5))
+        self.persist(4, 5, 6)
+
+        handed_over = threading.Thread(target=self.persist, args=(7, 8))
+        handed_over.start()
+        handed_over.join(0.1)
+        self.assertTrue(handed_over.is_alive())
+        self.assertEqual(self.queue.get_metrics()['pending_writes'], 6)
+
+        self.gate.set()
+        handed_over.join(5)
+        self.assertFalse(handed_over.is_alive())
+        self.assertTrue(self.queue.wait_persisted(timeout=5))
+        self.assertEqual(sorted(p for chunk in self.written for p in chunk), list(range(1, 9)))
@@ -0,0 +1,139 @@
+# test_config_proxy.py - Cached crane-config proxy against a local stand-in upstream
+import asyncio
+import json
+from unittest import mock
+
+from django.test import AsyncClient, SimpleTestCase
+
+from api.config_proxy import CraneConfigProxy
+from api.management.commands.bench_config_proxy import StandInUpstream
+from api.upstream import CircuitBreaker, UpstreamGateway
+
+def config_of(entry):
+    return json.loads(entry.body)['data']
+
+async def wait_for(condition, timeout=5.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met in time")
+
+class ConfigProxyTestCase(SimpleTestCase):
+    ttl_seconds = 60.0
+
+    def setUp(self):
+        self.upstream = StandInUpstream()
+        self.addCleanup(self.upstream.stop)
+        self.gateway = UpstreamGateway(
+            base_url=self.upstream.base_url, timeout=2.0, breaker=CircuitBreaker(failures=3, reset_seconds=60)
+        )
+        self.addCleanup(self.gateway.close)
+        self.proxy = CraneConfigProxy(self.gateway, ttl_seconds=self.ttl_seconds, stale_seconds=60.0)
+
+
+class FreshCacheTests(ConfigProxyTestCase):
+    async def test_first_read_fetches_and_later_reads_hit_the_cache(self):
+        entry, state = await self.proxy.get()
+        self.assertEqual((entry.status, state), (200, 'miss'))
+        self.assertEqual(config_of(entry), {"crane_id": "stand-in", "revision": 0})
+
+        again, state = await self.proxy.get()
+        self.assertEqual(state, 'hit')
+        self.assertIs(again, entry)
+        self.assertEqual(self.upstream.requests, 1)
+
+    async def test_concurrent_cold_reads_share_one_upstream_call(self):
+        self.upstream.delay = 0.2
+        results = await asyncio.gather(*(self.proxy.get() for _ in range(10)))
+
+        self.assertEqual({entry.status for entry, _ in results}, {200})
+        self.assertEqual(self.upstream.requests, 1)
+        self.assertEqual(self.gateway.shared, 9)
+
+    async def test_update_is_forwarded_and_drops_the_cached_config(self):
+        await self.proxy.get()
+        status = await self.proxy.update({"crane_id": "stand-in", "revision": 1})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.upstream.config['revision'], 1)
+
+        entry, state = await self.proxy.get()
+        self.assertEqual(state, 'miss')
+        self.assertEqual(config_of(entry)['revision'], 1)
+
+    async def test_upstream_errors_are_not_cached(self):
+        self.upstream.failing = True
+        entry, _ = await self.proxy.get()
+        self.assertEqual(entry.status, 500)
+
+        self.upstream.failing = False
+        entry, state = await self.proxy.get()
+        self.assertEqual((entry.status, state), (200, 'miss'))
+
+    async def test_unreachable_upstream_answers_503(self):
+        self.upstream.stop()
+        entry, _ = await self.proxy.get()
+        self.assertEqual(entry.status, 503)
+        self.assertFalse(json.loads(entry.body)['success'])
+
+
+class StaleCacheTests(ConfigProxyTestCase):
+    # Everything cached is past its TTL but inside the stale window
+    ttl_seconds = 0.0
+
+    async def test_stale_config_is_served_while_one_refresh_runs(self):
+        first, _ = await self.proxy.get()
+        self.upstream.config = {"crane_id": "stand-in", "revision": 2}
+        self.upstream.delay = 0.1
+
+        stale = [await self.proxy.get() for _ in range(5)]
+        self.assertEqual({state for _, state in stale}, {'stale'})
+        self.assertTrue(all(entry is first for entry, _ in stale))
+        await wait_for(lambda: not self.proxy._refreshing)
+        # The cold fetch plus a single background refresh
+        self.assertEqual(self.upstream.requests, 2)
+        self.assertEqual(self.proxy.refreshes, 1)
+
+        entry, state = await self.proxy.get()
+        self.assertEqual(state, 'stale')
+        self.assertEqual(config_of(entry)['revision'], 2)
+        await wait_for(lambda: not self.proxy._refreshing)
+
+    async def test_failed_refresh_keeps_the_last_good_config(self):
+        first, _ = await self.proxy.get()
+        self.upstream.failing = True
+
+        await self.proxy.get()
+        await wait_for(lambda: not self.proxy._refreshing)
+        entry, _ = await self.proxy.get()
+        self.assertIs(entry, first)
+        self.assertEqual(entry.status, 200)
+        self.assertGreaterEqual(self.proxy.errors, 1)
+        await wait_for(lambda: not self.proxy._refreshing)
+
+
+class ProxyEndpointTests(ConfigProxyTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.views.crane_config', self.proxy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_get_serves_the_cached_body_with_an_etag(self):
+        client = AsyncClient()
+        response = await client.get('/api/proxy/config')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(json.loads(response.content)['data']['crane_id'], 'stand-in')
+
+        response = await client.get('/api/proxy/config', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Cache'], 'hit')
+        self.assertEqual(self.upstream.requests, 1)
+
+    async def test_update_endpoint_forwards_the_body(self):
+        response = await AsyncClient().post(
+            '/api/proxy/config/update', json.dumps({"crane_id": "posted"}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.upstream.config, {"crane_id": "posted"})
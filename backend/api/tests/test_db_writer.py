@@ -0,0 +1,131 @@
+# test_db_writer.py - Writer process group commits and the worker socket round-trip
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.db import IntegrityError, OperationalError
+from django.test import SimpleTestCase
+
+from api import db_writer
+from api.db_writer import (
+    DatabaseWriterServer, RemoteDatabaseWriter, WriteRejected, _PendingWrite, decode_normalized, encode_normalized
+)
+from api.ipc import IPCError
+
+STAMP = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+def pending_write(*values):
+    """One worker batch: a payload per value, one asset row each"""
+    payloads = [{'name': 'writer_test', 'assets': [{'id': 'load', 'value': value}]} for value in values]
+    normalized = [([{'name': 'writer_test'}], [('writer_test', 'load', value, STAMP)]) for value in values]
+    return _PendingWrite(payloads, normalized)
+
+def values_of(payloads):
+    return [p['assets'][0]['value'] for p in payloads]
+
+class RecordingBatches:
+    """ingest.write_batch stand-in committing batches without a 'bad' value"""
+    def __init__(self, error=IntegrityError):
+        self.error = error
+        self.attempts = []
+        self.committed = []
+
+    def __call__(self, payloads, normalized):
+        self.attempts.append(values_of(payloads))
+        if 'bad' in values_of(payloads):
+            raise self.error('bad row')
+        self.committed.append(values_of(payloads))
+        return len(normalized)
+
+
+class WriterServerTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.server = DatabaseWriterServer(path=os.path.join(directory, 'writer.sock'), max_batch=100)
+        self.addCleanup(self.server.server_close)
+        self.batches = RecordingBatches()
+        for patcher in (mock.patch.object(db_writer.ingest, 'write_batch', self.batches),
+                        mock.patch.object(db_writer, 'connection')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class GroupCommitTests(WriterServerTestCase):
+    def test_group_is_committed_in_one_transaction(self):
+        group = [pending_write(1, 2), pending_write(3)]
+        self.server._write_group(group)
+
+        self.assertEqual(self.batches.committed, [[1, 2, 3]])
+        self.assertEqual([(pending.rows, pending.error) for pending in group], [(2, None), (1, None)])
+        self.assertTrue(all(pending.done.is_set() for pending in group))
+        self.assertEqual(self.server.metrics.snapshot()['commits'], 1)
+
+    def test_bad_batch_fails_alone_and_the_rest_commit(self):
+        group = [pending_write(1), pending_write(2, 'bad'), pending_write(3)]
+        self.server._write_group(group)
+
+        self.assertEqual(self.batches.committed, [[1], [3]])
+        self.assertEqual([pending.error for pending in group], [None, 'bad row', None])
+        self.assertFalse(group[1].transient)
+        self.assertEqual([pending.rows for pending in group], [1, 0, 1])
+        self.assertTrue(all(pending.done.is_set() for pending in group))
+        snapshot = self.server.metrics.snapshot()
+        self.assertEqual((snapshot['commits'], snapshot['errors']), (2, 2))
+
+    def test_transient_failure_fails_the_group_for_the_workers_to_retry(self):
+        self.batches.error = OperationalError
+        group = [pending_write(1), pending_write('bad')]
+        self.server._write_group(group)
+
+        # No per-batch retries - a locked database would fail them all again
+        self.assertEqual(self.batches.attempts, [[1, 'bad']])
+        self.assertEqual([(pending.error, pending.transient) for pending in group], [('bad row', True)] * 2)
+
+    def test_submit_waits_for_the_writer_thread(self):
+        self.assertEqual(self.server.submit(pending_write(1, 2)), {'rows': 2})
+        self.assertEqual(self.server.submit(pending_write('bad')), {'error': 'bad row', 'transient': False})
+
+
+class SocketRoundTripTests(WriterServerTestCase):
+    def setUp(self):
+        super().setUp()
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        self.addCleanup(self.server.shutdown)
+        self.writer = RemoteDatabaseWriter(path=self.server.path)
+
+    def test_rows_normalized_by_the_worker_reach_the_writer_unchanged(self):
+        written = []
+        def write_batch(payloads, normalized):
+            written.append(normalized)
+            return len(normalized)
+        pending = pending_write(1.5, 2)
+
+        with mock.patch.object(db_writer.ingest, 'write_batch', write_batch):
+            rows = self.writer.write(pending.payloads, pending.normalized)
+
+        self.assertEqual(rows, 2)
+        self.assertEqual(written, [pending.normalized])
+        self.assertEqual(decode_normalized(encode_normalized(pending.normalized)), pending.normalized)
+
+    def test_errors_come_back_as_rejected_or_transient(self):
+        bad = pending_write('bad')
+        with self.assertRaises(WriteRejected):
+            self.writer.write(bad.payloads, bad.normalized)
+
+        self.batches.error = OperationalError
+        with self.assertRaises(IPCError):
+            self.writer.write(bad.payloads, bad.normalized)
+
+    def test_metrics_are_served_by_the_writer_process(self):
+        good = pending_write(1)
+        self.writer.write(good.payloads, good.normalized)
+
+        metrics = self.writer.get_metrics()
+        self.assertEqual((metrics['backend'], metrics['pid'], metrics['commits']), ('process', os.getpid(), 1))
+
+    def test_writes_without_normalized_rows_are_refused(self):
+        reply = self.writer.client.request({'op': 'write', 'payloads': [{'name': 'writer_test', 'assets': []}]})
+        self.assertEqual(reply, {'error': "write without normalized rows", 'transient': False})
+        self.assertEqual(self.batches.attempts, [])
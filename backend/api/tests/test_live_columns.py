@@ -0,0 +1,165 @@
+# test_live_columns.py - Columnar live-state history: diffs, merged deltas and decoding
+from django.test import SimpleTestCase
+
+from api.live_columns import LiveColumns
+
+def services(*assets, service='crane', stamp='2030-01-01T00:00:00Z'):
+    """One service of (asset id, value) pairs sharing a timestamp"""
+    return [{'name': service, 'assets': [{'id': asset_id, 'value': value, 'timestamp': stamp} for asset_id, value in assets]}]
+
+def values(changes):
+    return {change['id']: change['value'] for change in changes}
+
+def ids(removed):
+    return sorted(entry['id'] for entry in removed)
+
+class AppendTests(SimpleTestCase):
+    def setUp(self):
+        self.columns = LiveColumns(10)
+
+    def test_first_version_reports_every_asset_as_changed(self):
+        changes, removed = self.columns.append(1, 't1', services(('load', 1.5), ('mode', 'auto')))
+        self.assertEqual(values(changes), {'load': 1.5, 'mode': 'auto'})
+        self.assertEqual(removed, [])
+
+    def test_only_differing_values_count_as_changes(self):
+        self.columns.append(1, 't1', services(('load', 1.0), ('angle', 2.0)))
+        changes, removed = self.columns.append(2, 't2', services(('load', 1.0), ('angle', 3.0)))
+        self.assertEqual(changes, [{'service': 'crane', 'id': 'angle', 'value': 3.0, 'timestamp': '2030-01-01T00:00:00Z'}])
+        self.assertEqual(removed, [])
+
+    def test_a_new_timestamp_counts_as_a_change(self):
+        self.columns.append(1, 't1', services(('load', 1.0), ('angle', 2.0)))
+        changes, _ = self.columns.append(2, 't2', services(('load', 1.0), ('angle', 2.0), stamp='2030-01-01T00:00:01Z'))
+        self.assertEqual(values(changes), {'load': 1.0, 'angle': 2.0})
+        self.assertEqual({change['timestamp'] for change in changes}, {'2030-01-01T00:00:01Z'})
+
+        # Per-asset timestamps, only one of them moving
+        first = [{'name': 'crane', 'assets': [{'id': 'load', 'value': 1.0, 'timestamp': 'a'},
+                                              {'id': 'angle', 'value': 2.0, 'timestamp': 'b'}]}]
+        second = [{'name': 'crane', 'assets': [{'id': 'load', 'value': 1.0, 'timestamp': 'a'},
+                                               {'id': 'angle', 'value': 2.0, 'timestamp': 'c'}]}]
+        self.columns.append(3, 't3', first)
+        changes, _ = self.columns.append(4, 't4', second)
+        self.assertEqual([(change['id'], change['timestamp']) for change in changes], [('angle', 'c')])
+
+    def test_a_value_changing_type_counts_as_a_change(self):
+        self.columns.append(1, 't1', services(('load', 1), ('mode', 1), ('flag', True), ('big', 2 ** 60)))
+        changes, _ = self.columns.append(2, 't2', services(('load', 1.0), ('mode', 1), ('flag', 1), ('big', 2.0 ** 60)))
+        self.assertEqual([(change['id'], type(change['value'])) for change in changes],
+                         [('load', float), ('flag', int), ('big', float)])
+
+    def test_assets_missing_from_an_update_are_removed(self):
+        self.columns.append(1, 't1', services(('load', 1.0), ('angle', 2.0)))
+        changes, removed = self.columns.append(2, 't2', services(('load', 1.0)))
+        self.assertEqual(changes, [])
+        self.assertEqual(removed, [{'service': 'crane', 'id': 'angle'}])
+
+
+class SinceTests(SimpleTestCase):
+    def setUp(self):
+        self.columns = LiveColumns(5)
+
+    def append(self, version, *assets):
+        self.columns.append(version, f't{version}', services(*assets))
+
+    def test_caught_up_client_gets_an_empty_delta(self):
+        self.append(1, ('load', 1.0))
+        self.assertEqual(self.columns.since(1), (1, [], []))
+
+    def test_changes_merge_to_the_latest_value_per_asset(self):
+        self.append(1, ('load', 1.0), ('angle', 0.0), ('mode', 'auto'))
+        self.append(2, ('load', 2.0), ('angle', 0.0), ('mode', 'auto'))
+        self.append(3, ('load', 3.0), ('angle', 5.0), ('mode', 'auto'))
+
+        version, changes, removed = self.columns.since(1)
+        self.assertEqual(version, 3)
+        self.assertEqual(values(changes), {'load': 3.0, 'angle': 5.0})
+        self.assertEqual(removed, [])
+
+    def test_removed_asset_is_reported_as_removed_only(self):
+        self.append(1, ('load', 1.0), ('angle', 0.0))
+        self.append(2, ('load', 1.0), ('angle', 4.0))
+        self.append(3, ('load', 1.0))
+
+        _, changes, removed = self.columns.since(1)
+        self.assertEqual(values(changes), {})
+        self.assertEqual(ids(removed), ['angle'])
+
+    def test_removed_then_readded_asset_is_a_change_with_its_new_value(self):
+        self.append(1, ('load', 1.0), ('angle', 0.0))
+        self.append(2, ('load', 1.0))
+        self.append(3, ('load', 1.0), ('angle', 0.0))
+
+        _, changes, removed = self.columns.since(1)
+        # Back with the value the client already had - still sent, as the
+        # client may have dropped it on the removal it never saw undone
+        self.assertEqual(values(changes), {'angle': 0.0})
+        self.assertEqual(removed, [])
+
+        # A client that saw the removal gets the asset back
+        _, changes, removed = self.columns.since(2)
+        self.assertEqual(values(changes), {'angle': 0.0})
+        self.assertEqual(removed, [])
+
+    def test_added_then_removed_asset_is_reported_as_removed(self):
+        self.append(1, ('load', 1.0))
+        self.append(2, ('load', 1.0), ('angle', 7.0))
+        self.append(3, ('load', 1.0))
+
+        _, changes, removed = self.columns.since(1)
+        self.assertEqual(values(changes), {})
+        self.assertEqual(ids(removed), ['angle'])
+
+    def test_assets_moving_between_services_are_separate_keys(self):
+        self.columns.append(1, 't1', services(('load', 1.0), service='a'))
+        self.columns.append(2, 't2', services(('load', 1.0), service='b'))
+
+        _, changes, removed = self.columns.since(1)
+        self.assertEqual([(c['service'], c['id']) for c in changes], [('b', 'load')])
+        self.assertEqual([(r['service'], r['id']) for r in removed], [('a', 'load')])
+
+    def test_versions_older_than_the_ring_need_a_snapshot(self):
+        for version in range(1, 9):
+            self.append(version, ('load', float(version)))
+        # Rows 4-8 retained: a client at 3 can still be caught up, one at 2 cannot
+        self.assertEqual(values(self.columns.since(3)[1]), {'load': 8.0})
+        self.assertIsNone(self.columns.since(2))
+
+    def test_version_ahead_of_the_history_needs_a_snapshot(self):
+        self.append(1, ('load', 1.0))
+        self.assertIsNone(self.columns.since(5))
+
+    def test_skipped_versions_break_the_chain(self):
+        self.append(1, ('load', 1.0))
+        self.append(2, ('load', 2.0))
+        self.append(7, ('load', 3.0))
+        self.assertIsNone(self.columns.since(2))
+        self.assertEqual(self.columns.since(7), (7, [], []))
+
+
+class DecodeTests(SimpleTestCase):
+    def test_older_rows_decode_with_their_types_and_timestamps(self):
+        columns = LiveColumns(5)
+        first = [{'name': 'crane', 'assets': [
+            {'id': 'count', 'value': 3, 'timestamp': 'a'},
+            {'id': 'big', 'value': 2 ** 60, 'timestamp': 'b'},
+            {'id': 'mode', 'value': 'auto', 'timestamp': 'a'},
+            {'id': 'load', 'value': 1.25, 'timestamp': 'b'},
+        ]}]
+        columns.append(1, 't1', first)
+        columns.append(2, 't2', services(('load', 2.0)))
+
+        self.assertEqual([(version, timestamp) for version, timestamp, _ in columns.entries()], [(1, 't1'), (2, 't2')])
+        # Only the newest row keeps its services list; this one is decoded
+        (_, _, decoded), _ = columns.entries()
+        self.assertEqual(decoded, first)
+        self.assertIs(type(decoded[0]['assets'][0]['value']), int)
+        self.assertIs(type(decoded[0]['assets'][1]['value']), int)
+
+    def test_entries_after_a_version(self):
+        columns = LiveColumns(5)
+        for version in range(1, 5):
+            columns.append(version, f't{version}', services(('load', float(version))))
+        self.assertEqual([entry[0] for entry in columns.entries(after=2)], [3, 4])
+        self.assertEqual(columns.oldest_version(), 1)
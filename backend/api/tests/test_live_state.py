@@ -0,0 +1,53 @@
+# test_live_state.py - Shared-memory live state: ring slots and growing them for large updates
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from api.live_state import SharedMemoryIoTData
+
+def services(value, padding=0):
+    return [{'name': 'crane', 'assets': [{'id': 'load', 'value': value, 'note': 'x' * padding}]}]
+
+def values(entries):
+    return [services_data[0]['assets'][0]['value'] for _, _, services_data in entries]
+
+class SharedMemoryTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'live_state')
+        self.store = self.open()
+
+    def open(self):
+        return SharedMemoryIoTData(path=self.path, slot_bytes=256, slots=4)
+
+    def test_history_is_a_ring_of_the_newest_updates(self):
+        for value in range(1, 7):
+            self.store.atomic_update(services(value))
+
+        version, entries = self.store.history_entries()
+        self.assertEqual(version, 6)
+        self.assertEqual(values(entries), [3, 4, 5, 6])
+        self.assertEqual(self.store.updates_since(4), entries[2:])
+
+    def test_oversized_update_grows_the_slots_and_keeps_the_history(self):
+        self.store.atomic_update(services(1))
+        self.store.atomic_update(services(2, padding=1000))
+
+        _, entries = self.store.history_entries()
+        self.assertEqual(values(entries), [1, 2])
+        self.assertEqual(len(entries[1][2][0]['assets'][0]['note']), 1000)
+        self.assertEqual(self.store.slot_bytes, 2048)
+        self.assertEqual(os.path.getsize(self.path), SharedMemoryIoTData.HEADER.size + 4 * 2048)
+
+    def test_other_processes_follow_the_grown_layout(self):
+        other = self.open()
+        self.assertEqual(other.history_entries(), (0, []))
+
+        self.store.atomic_update(services(1, padding=1000))
+        _, entries = other.history_entries()
+        self.assertEqual(values(entries), [1])
+        self.assertEqual(other.slot_bytes, 2048)
+
+        # Publishing through the remapped view, and a late opener keeping it
+        other.atomic_update(services(2))
+        self.assertEqual(values(self.open().history_entries()[1]), [1, 2])
@@ -0,0 +1,232 @@
+# test_mqtt_bridge.py - MQTT bridge: topic patterns, ack-after-persist, retries and dead letters
+import json
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db import IntegrityError, OperationalError
+from django.test import SimpleTestCase, TestCase
+
+from api import ingest, mqtt_bridge
+from api.db_writer import LocalDatabaseWriter
+from api.models import Asset, IncomingIoTData
+from api.mqtt_bridge import MqttIngestBridge, TopicPattern, parse_message
+from api.service_cache import service_cache
+
+class FakeClient:
+    """paho stand-in: records subscriptions, and what was persisted at each ack"""
+    def __init__(self, persisted=None):
+        self.persisted = persisted or (lambda: None)
+        self.subscriptions = []
+        self.acks = []
+        self.acked = threading.Event()
+        self.on_connect = None
+        self.on_message = None
+
+    def subscribe(self, topics):
+        self.subscriptions.extend(topics)
+
+    def ack(self, mid, qos):
+        self.acks.append((mid, qos, self.persisted()))
+        self.acked.set()
+
+def message(mid, topic, body, qos=1):
+    payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    return SimpleNamespace(mid=mid, topic=topic, payload=payload, qos=qos)
+
+def reading(value, asset_id='load', clock='00:00:01'):
+    return {'assets': [{'id': asset_id, 'value': value, 'timestamp': f'2030-01-01T{clock}Z'}]}
+
+class RecordingWriter:
+    """Database writer stand-in; `fail` decides per call which exception to raise, if any"""
+    backend = 'process'
+
+    def __init__(self, fail=None):
+        self.fail = fail or (lambda payloads: None)
+        self.batches = []
+
+    def write(self, payloads, normalized):
+        error = self.fail(payloads)
+        if error is not None:
+            raise error
+        self.batches.append(payloads)
+        return sum(len(rows) for _, rows in normalized)
+
+
+class TopicPatternTests(SimpleTestCase):
+    def test_service_level_subscribes_as_wildcard_and_names_the_service(self):
+        pattern = TopicPattern('plant/{service}/telemetry')
+        self.assertEqual(pattern.subscription, 'plant/+/telemetry')
+        self.assertEqual(pattern.match('plant/LoadCell/telemetry'), 'LoadCell')
+        self.assertIsNone(pattern.match('plant/LoadCell/status'))
+        self.assertIsNone(pattern.match('plant/a/b/telemetry'))
+
+    def test_multi_level_wildcard_matches_its_parent_too(self):
+        pattern = TopicPattern('iot/#')
+        self.assertEqual(pattern.match('iot'), '')
+        self.assertEqual(pattern.match('iot/crane/1'), '')
+        self.assertIsNone(pattern.match('other/crane'))
+
+    def test_parse_message_takes_the_service_from_the_topic(self):
+        self.assertEqual(parse_message(b'{"assets": []}', 'LoadCell'), {'name': 'LoadCell', 'assets': []})
+        self.assertEqual(parse_message(b'{"name": "own", "assets": []}', 'LoadCell')['name'], 'own')
+        self.assertIsNone(parse_message(b'not json'))
+        self.assertIsNone(parse_message(b'42'))
+
+
+class AckAfterPersistTests(TestCase):
+    def setUp(self):
+        service_cache.invalidate()
+        self.client = FakeClient(persisted=lambda: Asset.objects.filter(service__name='mqtt_test').count())
+        self.store = mock.Mock()
+        self.bridge = MqttIngestBridge(self.client, topics=['plant/{service}/telemetry'], qos=1, store=self.store)
+
+    def test_on_connect_subscribes_every_pattern(self):
+        self.client.on_connect(self.client, None, {}, 0)
+        self.assertEqual(self.client.subscriptions, [('plant/+/telemetry', 1)])
+
+    def test_batch_is_committed_before_any_message_is_acknowledged(self):
+        self.bridge.process_batch([
+            message(1, 'plant/mqtt_test/telemetry', reading(1, clock='00:00:01')),
+            message(2, 'plant/mqtt_test/telemetry', reading(2, clock='00:00:02')),
+            message(3, 'plant/mqtt_test/telemetry', reading(3, clock='00:00:03'), qos=0),
+        ])
+
+        # QoS 0 messages have nothing to acknowledge
+        self.assertEqual(self.client.acks, [(1, 1, 3), (2, 1, 3)])
+        self.assertEqual(IncomingIoTData.objects.count(), 3)
+        self.assertEqual(self.store.atomic_update.call_count, 3)
+        self.assertEqual(self.store.atomic_update.call_args_list[0].args[0][0]['name'], 'mqtt_test')
+        self.assertEqual(self.bridge.stats['persisted'], 3)
+
+    def test_invalid_messages_are_acknowledged_without_persisting(self):
+        self.bridge.process_batch([message(1, 'plant/mqtt_test/telemetry', b'{broken')])
+
+        self.assertEqual(self.client.acks, [(1, 1, 0)])
+        self.assertEqual(self.bridge.stats['invalid'], 1)
+        self.assertFalse(self.store.atomic_update.called)
+
+
+@mock.patch.object(mqtt_bridge, 'MQTT_RETRY_SECONDS', (0, 0))
+class WriteFailureTests(SimpleTestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        directory = tempfile.mkdtemp()
+        self.dead_letters = os.path.join(directory, 'dead.jsonl')
+        patcher = mock.patch.object(mqtt_bridge, 'MQTT_DEAD_LETTER_PATH', self.dead_letters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bridge(self, writer, store=None):
+        return MqttIngestBridge(self.client, topics=['iot/{service}'], store=store, writer=writer)
+
+    def read_dead_letters(self):
+        if not os.path.exists(self.dead_letters):
+            return []
+        with open(self.dead_letters) as f:
+            return [json.loads(line) for line in f]
+
+    def test_transient_failure_is_retried_then_acknowledged(self):
+        errors = iter([OperationalError('database is locked')])
+        writer = RecordingWriter(fail=lambda payloads: next(errors, None))
+        bridge = self.bridge(writer)
+        bridge.process_batch([message(1, 'iot/crane', reading(1))])
+
+        self.assertEqual(len(writer.batches), 1)
+        self.assertEqual(bridge.stats['retries'], 1)
+        self.assertEqual([mid for mid, _, _ in self.client.acks], [1])
+        self.assertEqual(self.read_dead_letters(), [])
+
+    def test_local_writer_retries_on_a_fresh_connection(self):
+        bridge = self.bridge(LocalDatabaseWriter())
+        with mock.patch.object(ingest, 'write_batch', side_effect=[OperationalError('database is locked'), 1]), \
+                mock.patch.object(mqtt_bridge, 'connection') as connection:
+            bridge.process_batch([message(1, 'iot/crane', reading(1))])
+
+        connection.close.assert_called_once_with()
+        self.assertEqual([mid for mid, _, _ in self.client.acks], [1])
+
+    def test_writer_process_failures_keep_this_connection(self):
+        errors = iter([OperationalError('database is locked')])
+        bridge = self.bridge(RecordingWriter(fail=lambda payloads: next(errors, None)))
+        with mock.patch.object(mqtt_bridge, 'connection') as connection:
+            bridge.process_batch([message(1, 'iot/crane', reading(1))])
+        self.assertFalse(connection.close.called)
+
+    def test_bad_message_is_dead_lettered_and_the_rest_persisted(self):
+        def fail(payloads):
+            if any(p['assets'][0]['value'] == 'bad' for p in payloads):
+                return IntegrityError('bad row')
+        writer = RecordingWriter(fail=fail)
+        store = mock.Mock()
+        bridge = self.bridge(writer, store)
+        bridge.process_batch([
+            message(1, 'iot/crane', reading(1)),
+            message(2, 'iot/crane', reading('bad')),
+            message(3, 'iot/crane', reading(3)),
+        ])
+
+        self.assertEqual([[p['assets'][0]['value'] for p in batch] for batch in writer.batches], [[1], [3]])
+        self.assertEqual([mid for mid, _, _ in self.client.acks], [1, 2, 3])
+        self.assertEqual(store.atomic_update.call_count, 2)
+        self.assertEqual(bridge.stats['dead_lettered'], 1)
+        self.assertEqual(bridge.stats['retries'], 0)
+        dead, = self.read_dead_letters()
+        self.assertEqual(dead['payload']['assets'][0]['value'], 'bad')
+        self.assertEqual(dead['error'], 'IntegrityError: bad row')
+
+    def test_lasting_transient_failure_is_retried_not_dead_lettered(self):
+        errors = iter([OperationalError('disk I/O error')] * 5)
+        writer = RecordingWriter(fail=lambda payloads: next(errors, None))
+        bridge = self.bridge(writer)
+        bridge.process_batch([message(1, 'iot/crane', reading(1)), message(2, 'iot/crane', reading(2))])
+
+        # Past the configured delays the last one repeats until the write commits
+        self.assertEqual(bridge.stats['retries'], 5)
+        self.assertEqual(len(writer.batches), 1)
+        self.assertEqual(bridge.stats['dead_lettered'], 0)
+        self.assertEqual([mid for mid, _, _ in self.client.acks], [1, 2])
+        self.assertEqual(self.read_dead_letters(), [])
+
+    def test_transient_failure_never_acknowledges_until_the_bridge_stops(self):
+        def fail(payloads):
+            if bridge.stats['retries'] == 10:
+                bridge._stop.set()
+            return OperationalError('disk I/O error')
+        bridge = self.bridge(RecordingWriter(fail=fail))
+        with self.assertRaises(OperationalError):
+            bridge.process_batch([message(1, 'iot/crane', reading(1)), message(2, 'iot/crane', reading(2))])
+
+        self.assertEqual(self.client.acks, [])
+        self.assertEqual(bridge.stats['dead_lettered'], 0)
+        self.assertEqual(self.read_dead_letters(), [])
+
+    def test_shutdown_during_retry_leaves_the_batch_unacknowledged(self):
+        bridge = self.bridge(RecordingWriter(fail=lambda payloads: OperationalError('locked')))
+        bridge._stop.set()
+        with self.assertRaises(OperationalError):
+            bridge.process_batch([message(1, 'iot/crane', reading(1))])
+        self.assertEqual(self.client.acks, [])
+        self.assertEqual(self.read_dead_letters(), [])
+
+
+class BridgeThreadTests(SimpleTestCase):
+    def test_messages_from_the_client_callback_are_batched_and_acknowledged(self):
+        client = FakeClient()
+        writer = RecordingWriter()
+        bridge = MqttIngestBridge(client, topics=['iot/{service}'], writer=writer, batch_size=10, flush_interval_ms=20)
+        bridge.start()
+        self.addCleanup(bridge.stop)
+        for mid in range(1, 4):
+            client.on_message(client, None, message(mid, 'iot/crane', reading(mid, clock=f'00:00:0{mid}')))
+
+        for _ in range(50):
+            if len(client.acks) == 3:
+                break
+            client.acked.wait(0.1)
+            client.acked.clear()
+        self.assertEqual(sorted(mid for mid, _, _ in client.acks), [1, 2, 3])
+        self.assertEqual(sum(len(batch) for batch in writer.batches), 3)
+        self.assertEqual(writer.batches[0][0]['name'], 'crane')
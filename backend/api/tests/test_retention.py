@@ -0,0 +1,92 @@
+# test_retention.py - Chunked retention pruning and the background pass summary
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api import retention
+from api.models import Asset, AssetRollup1m, IncomingIoTData, Service
+from api.retention import prune_all, prune_model, run_retention_pass
+
+POLICIES = {'incoming_iot_data': 3600, 'incoming_assets': 86400}
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.service = Service.objects.create(name='retention_test')
+        for patcher in (mock.patch.object(retention, 'RETENTION_POLICIES', POLICIES),
+                        mock.patch.object(retention, 'RETENTION_CHUNK_PAUSE_MS', 0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def payloads(self, *ages):
+        """IncomingIoTData rows received `ages` ago; received_at is auto_now_add, so set afterwards"""
+        for age in ages:
+            row = IncomingIoTData.objects.create(raw_data={'age': age.total_seconds()})
+            IncomingIoTData.objects.filter(pk=row.pk).update(received_at=self.now - age)
+
+    def assets(self, *ages):
+        Asset.objects.bulk_create([
+            Asset(service=self.service, asset_id='load', value=index, timestamp=self.now - age)
+            for index, age in enumerate(ages)
+        ])
+
+    def remaining_ages(self):
+        return sorted(row.raw_data['age'] for row in IncomingIoTData.objects.all())
+
+    def test_only_expired_rows_are_deleted_in_chunks(self):
+        self.payloads(*[timedelta(hours=2, minutes=minute) for minute in range(7)])
+        self.payloads(timedelta(minutes=59), timedelta(seconds=1))
+
+        with mock.patch.object(retention.time, 'sleep') as sleep:
+            deleted = prune_model(IncomingIoTData, self.now - timedelta(hours=1), chunk_rows=3, pause_ms=5)
+
+        self.assertEqual(deleted, 7)
+        self.assertEqual(self.remaining_ages(), [1.0, 59 * 60.0])
+        # Chunks of 3, 3 and 1 - a pause after each full one
+        self.assertEqual(sleep.call_args_list, [mock.call(0.005)] * 2)
+
+    def test_dry_run_counts_without_deleting(self):
+        self.payloads(timedelta(hours=2), timedelta(hours=3), timedelta(minutes=5))
+        self.assertEqual(prune_model(IncomingIoTData, self.now - timedelta(hours=1), dry_run=True), 2)
+        self.assertEqual(IncomingIoTData.objects.count(), 3)
+
+    def test_every_policy_applies_to_its_own_table(self):
+        self.payloads(timedelta(hours=2), timedelta(minutes=30))
+        self.assets(timedelta(days=2), timedelta(days=1, seconds=1), timedelta(hours=23))
+        AssetRollup1m.objects.create(
+            service=self.service, asset_id='load', bucket=self.now - timedelta(days=400), sample_count=1,
+            min_value=1.0, max_value=1.0, sum_value=1.0, last_value=1.0, last_timestamp=self.now - timedelta(days=400)
+        )
+
+        deleted = prune_all(now=self.now, chunk_rows=2)
+
+        # Rollups have no policy and are kept
+        self.assertEqual(deleted, {'incoming_iot_data': 1, 'incoming_assets': 2})
+        self.assertEqual(self.remaining_ages(), [30 * 60.0])
+        self.assertEqual(list(Asset.objects.values_list('value', flat=True)), [2.0])
+        self.assertEqual(AssetRollup1m.objects.count(), 1)
+
+    def test_pass_summary_reports_deleted_rows_and_reclaimed_bytes(self):
+        self.payloads(timedelta(hours=2))
+        self.assets(timedelta(days=3))
+
+        with mock.patch.object(retention, 'RETENTION_VACUUM_PAGES', 100), \
+                mock.patch.object(retention, 'incremental_vacuum', return_value=8192) as vacuum:
+            summary = run_retention_pass()
+
+        vacuum.assert_called_once_with(100)
+        self.assertEqual(summary['deleted'], {'incoming_iot_data': 1, 'incoming_assets': 1})
+        self.assertEqual(summary['reclaimed_bytes'], 8192)
+        self.assertGreaterEqual(summary['duration_ms'], 0)
+
+    def test_pass_without_vacuum_reclaims_nothing(self):
+        with mock.patch.object(retention, 'RETENTION_VACUUM_PAGES', 0):
+            summary = run_retention_pass()
+        self.assertEqual(summary['deleted'], {'incoming_iot_data': 0, 'incoming_assets': 0})
+        self.assertIsNone(summary['reclaimed_bytes'])
+
+    def test_incremental_vacuum_needs_it_enabled(self):
+        # The test database keeps the default auto_vacuum=NONE
+        self.assertIsNone(retention.incremental_vacuum(10))
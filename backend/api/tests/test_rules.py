@@ -0,0 +1,174 @@
+# test_rules.py - Alert rules: rule types, firing/resolved transitions and reloads
+from datetime import datetime, timezone
+
+from django.test import TestCase
+
+from api.models import AlertEvent, AlertRule, Service
+from api.rules import RuleEngine, persist_alert_events
+
+START = datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp()
+
+def update(value, second, asset_id='load', service='rules_test'):
+    """A services list with one reading taken `second` seconds after START"""
+    stamp = datetime.fromtimestamp(START + second, timezone.utc).isoformat().replace('+00:00', 'Z')
+    return [{'name': service, 'assets': [{'id': asset_id, 'value': value, 'timestamp': stamp}]}]
+
+def states(transitions):
+    return [transition['state'] for transition in transitions]
+
+class RuleEngineTestCase(TestCase):
+    def setUp(self):
+        self.service = Service.objects.create(name='rules_test')
+        self.engine = RuleEngine()
+
+    def rule(self, rule_type=AlertRule.THRESHOLD, threshold=10.0, duration=0.0, operator='gt', asset_id='load'):
+        return AlertRule.objects.create(
+            name=f'{rule_type} rule', service=self.service, asset_id=asset_id, rule_type=rule_type,
+            operator=operator, threshold=threshold, duration_seconds=duration
+        )
+
+    def feed(self, *readings):
+        """Evaluate (value, second) readings in order; returns every transition"""
+        transitions = []
+        for value, second in readings:
+            transitions.extend(self.engine.evaluate(update(value, second)))
+        return transitions
+
+
+class ThresholdTests(RuleEngineTestCase):
+    def test_fires_once_while_above_and_resolves_below(self):
+        rule = self.rule()
+        transitions = self.feed((5, 0), (12, 1), (15, 2), (8, 3))
+
+        self.assertEqual(states(transitions), [AlertEvent.FIRING, AlertEvent.RESOLVED])
+        firing, resolved = transitions
+        self.assertEqual((firing['rule_id'], firing['value'], firing['triggered_at']),
+                         (rule.id, 12.0, '2030-01-01T00:00:01Z'))
+        self.assertEqual(firing['message'], 'threshold rule: rules_test/load = 12 (> 10)')
+        self.assertEqual(resolved['message'], 'threshold rule: rules_test/load back to normal')
+        self.assertEqual(self.engine.active_alerts(), [])
+
+    def test_active_alerts_list_firing_rules(self):
+        rule = self.rule(operator='lte', threshold=0)
+        self.feed((0, 0))
+        self.assertEqual([alert['rule_id'] for alert in self.engine.active_alerts()], [rule.id])
+
+    def test_other_assets_and_unreadable_values_are_ignored(self):
+        self.rule()
+        self.assertEqual(self.engine.evaluate(update(50, 0, asset_id='angle')), [])
+        self.assertEqual(self.engine.evaluate(update('n/a', 1)), [])
+        self.assertEqual(self.engine.evaluate(update(50, 2, service='other')), [])
+
+    def test_numeric_asset_ids_match_their_string_form(self):
+        self.rule(asset_id='7')
+        self.assertEqual(states(self.engine.evaluate(update(50, 0, asset_id=7))), [AlertEvent.FIRING])
+
+    def test_late_readings_are_not_evaluated(self):
+        self.rule()
+        self.feed((12, 5))
+        self.assertEqual(self.feed((1, 4)), [])
+        self.assertEqual(len(self.engine.active_alerts()), 1)
+
+
+class SustainedTests(RuleEngineTestCase):
+    def test_fires_only_once_the_condition_held_for_the_duration(self):
+        self.rule(AlertRule.SUSTAINED, duration=10)
+        self.assertEqual(self.feed((12, 0), (13, 5), (14, 9)), [])
+
+        transitions = self.feed((15, 10))
+        self.assertEqual(states(transitions), [AlertEvent.FIRING])
+        self.assertEqual(transitions[0]['triggered_at'], '2030-01-01T00:00:10Z')
+        self.assertEqual(states(self.feed((1, 11))), [AlertEvent.RESOLVED])
+
+    def test_a_break_restarts_the_clock(self):
+        self.rule(AlertRule.SUSTAINED, duration=10)
+        self.assertEqual(self.feed((12, 0), (5, 6), (12, 8), (12, 16)), [])
+        self.assertEqual(states(self.feed((12, 18))), [AlertEvent.FIRING])
+
+
+class RateOfChangeTests(RuleEngineTestCase):
+    def test_rate_between_consecutive_readings(self):
+        self.rule(AlertRule.RATE_OF_CHANGE, threshold=2.0)
+        transitions = self.feed((0, 0), (1, 1), (6, 2))
+
+        self.assertEqual(states(transitions), [AlertEvent.FIRING])
+        self.assertEqual(transitions[0]['value'], 5.0)
+        self.assertEqual(states(self.feed((7, 3))), [AlertEvent.RESOLVED])
+
+    def test_rate_over_a_window(self):
+        # +1 every second is 1/s however it is measured; the jump to 17 at 8s
+        # is measured against the reading at 3s, the start of the window
+        self.rule(AlertRule.RATE_OF_CHANGE, threshold=2.5, duration=5)
+        self.assertEqual(self.feed(*[(second, second) for second in range(8)]), [])
+
+        transitions = self.feed((17, 8))
+        self.assertEqual(states(transitions), [AlertEvent.FIRING])
+        self.assertAlmostEqual(transitions[0]['value'], (17 - 3) / 5)
+
+    def test_falling_rates_with_a_lower_bound(self):
+        self.rule(AlertRule.RATE_OF_CHANGE, threshold=-1.0, operator='lt')
+        self.assertEqual(states(self.feed((10, 0), (5, 1))), [AlertEvent.FIRING])
+
+
+class MissingDataTests(RuleEngineTestCase):
+    def test_fires_after_silence_and_resolves_on_the_next_reading(self):
+        self.rule(AlertRule.MISSING_DATA, threshold=None, duration=30)
+        self.feed((1, 0))
+        arrival = self.engine._rules[AlertRule.objects.get().id].last_arrival
+
+        self.assertEqual(self.engine.check_missing(arrival + 29), [])
+        transitions = self.engine.check_missing(arrival + 30)
+        self.assertEqual(states(transitions), [AlertEvent.FIRING])
+        # Stamped on the sample clock: the last reading plus the silence allowed
+        self.assertEqual(transitions[0]['triggered_at'], '2030-01-01T00:00:30Z')
+        self.assertEqual(transitions[0]['message'], 'missing_data rule: no data from rules_test/load for 30s')
+        self.assertEqual(self.engine.check_missing(arrival + 60), [])
+
+        self.assertEqual(states(self.feed((1, 90))), [AlertEvent.RESOLVED])
+
+    def test_never_reporting_asset_fires_from_the_load_time(self):
+        self.rule(AlertRule.MISSING_DATA, threshold=None, duration=30)
+        self.engine.load()
+        loaded = self.engine._rules[AlertRule.objects.get().id].last_arrival
+        self.assertEqual(states(self.engine.check_missing(loaded + 30)), [AlertEvent.FIRING])
+
+
+class ReloadTests(RuleEngineTestCase):
+    def test_unchanged_rules_keep_their_state_across_reloads(self):
+        self.rule(AlertRule.SUSTAINED, duration=10)
+        self.feed((12, 0), (12, 5))
+        self.engine.load()
+
+        # The condition started at 0 before the reload
+        self.assertEqual(states(self.feed((12, 10))), [AlertEvent.FIRING])
+        self.engine.load()
+        self.assertEqual(len(self.engine.active_alerts()), 1)
+        self.assertEqual(states(self.feed((1, 11))), [AlertEvent.RESOLVED])
+
+    def test_edited_rules_start_over(self):
+        rule = self.rule(AlertRule.SUSTAINED, duration=10)
+        self.feed((12, 0), (12, 5))
+        rule.duration_seconds = 8
+        rule.save()
+        self.engine.load()
+
+        self.assertEqual(self.feed((12, 10)), [])
+        self.assertEqual(states(self.feed((12, 18))), [AlertEvent.FIRING])
+
+    def test_firing_state_is_restored_from_the_last_event(self):
+        self.rule()
+        persist_alert_events(self.feed((12, 0)))
+
+        restarted = RuleEngine()
+        self.assertEqual(len(restarted.evaluate(update(15, 1))), 0)
+        self.assertEqual(states(restarted.evaluate(update(5, 2))), [AlertEvent.RESOLVED])
+
+    def test_disabled_rules_are_dropped_on_reload(self):
+        rule = self.rule()
+        self.feed((12, 0))
+        rule.enabled = False
+        rule.save()
+        self.engine.load()
+
+        self.assertEqual(self.engine.active_alerts(), [])
+        self.assertEqual(self.feed((5, 1), (12, 2)), [])
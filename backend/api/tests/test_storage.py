@@ -0,0 +1,166 @@
+# test_storage.py - Batch persistence and rollup upserts per storage backend
+from datetime import datetime, timezone
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from api import storage
+from api.ingest import normalize_payload
+from api.models import Asset, AssetRollup1h, AssetRollup1m, AssetRollup1s, IncomingIoTData, Service
+from api.rollups import update_rollups, upsert_sql
+from api.service_cache import service_cache
+
+def payload(*readings, service='storage_test'):
+    """One payload of (asset_id, value, 'HH:MM:SS') readings on 2030-01-01"""
+    return {'services': [{'name': service, 'assets': [
+        {'id': asset_id, 'value': value, 'timestamp': f'2030-01-01T{clock}Z'} for asset_id, value, clock in readings
+    ]}]}
+
+def persist(backend, *payloads):
+    return backend.persist_batch(list(payloads), [normalize_payload(p) for p in payloads])
+
+class PersistBatchTests:
+    """Shared by every backend that can run against the test database"""
+    backend_class = None
+
+    def setUp(self):
+        service_cache.invalidate()
+        self.backend = self.backend_class()
+
+    def rollup(self, model, asset_id='load'):
+        return model.objects.get(service__name='storage_test', asset_id=asset_id)
+
+    def test_writes_payloads_assets_and_rollups(self):
+        written = persist(self.backend, payload(('load', 10, '00:00:01'), ('load', 30, '00:00:02'), ('mode', 'auto', '00:00:01')))
+
+        self.assertEqual(written, 2)  # non-numeric 'mode' stays out of the asset table
+        self.assertEqual(IncomingIoTData.objects.count(), 1)
+        self.assertEqual(IncomingIoTData.objects.get().total_assets, 3)
+        self.assertEqual(Asset.objects.filter(service__name='storage_test').count(), 2)
+        self.assertEqual(AssetRollup1s.objects.filter(service__name='storage_test').count(), 2)
+        for model in (AssetRollup1m, AssetRollup1h):
+            rollup = self.rollup(model)
+            self.assertEqual(
+                (rollup.sample_count, rollup.min_value, rollup.max_value, rollup.sum_value, rollup.last_value),
+                (2, 10, 30, 40, 30)
+            )
+            self.assertEqual(rollup.last_timestamp, datetime(2030, 1, 1, 0, 0, 2, tzinfo=timezone.utc))
+
+    def test_later_batches_merge_into_existing_buckets(self):
+        persist(self.backend, payload(('load', 10, '00:00:05')))
+        # A late reading lowers the minimum but does not replace the last value
+        persist(self.backend, payload(('load', 50, '00:00:10'), ('load', 2, '00:00:01')))
+
+        rollup = self.rollup(AssetRollup1m)
+        self.assertEqual(
+            (rollup.sample_count, rollup.min_value, rollup.max_value, rollup.sum_value, rollup.last_value),
+            (3, 2, 50, 62, 50)
+        )
+
+    def test_repeated_readings_are_stored_and_counted_once(self):
+        persist(self.backend, payload(('load', 10, '00:00:01')))
+        # A gateway retry: the same reading again, once more within the batch, plus a new one
+        persist(self.backend, payload(('load', 10, '00:00:01'), ('load', 10, '00:00:01'), ('load', 20, '00:00:02')))
+
+        self.assertEqual(Asset.objects.filter(service__name='storage_test').count(), 2)
+        rollup = self.rollup(AssetRollup1m)
+        self.assertEqual((rollup.sample_count, rollup.sum_value), (2, 30))
+
+    def test_creates_unknown_services(self):
+        persist(self.backend, payload(('load', 1, '00:00:01'), service='storage_new'))
+        self.assertTrue(Service.objects.filter(name='storage_new').exists())
+        self.assertEqual(Asset.objects.filter(service__name='storage_new').count(), 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite database')
+class SQLiteStorageTests(PersistBatchTests, TestCase):
+    backend_class = storage.SQLiteStorage
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL database')
+class PostgreSQLStorageTests(PersistBatchTests, TestCase):
+    backend_class = storage.PostgreSQLStorage
+
+# ==================== POSTGRESQL STAND-IN ====================
+
+class FakeCursor:
+    """Records SQL and COPY input; fetchall() answers with the queued rows"""
+    def __init__(self, database):
+        self.database = database
+        self.cursor = self  # the raw driver cursor, as on Django's CursorWrapper
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        self.database.statements.append((sql, params))
+
+    def executemany(self, sql, param_list):
+        self.database.statements.append((sql, list(param_list)))
+
+    def copy_expert(self, sql, buffer):
+        self.database.copies.append((sql, buffer.read()))
+
+    def fetchall(self):
+        return self.database.returning
+
+
+class FakePostgreSQL:
+    """Enough of a PostgreSQL connection for storage.py and rollups.py"""
+    vendor = 'postgresql'
+
+    def __init__(self, returning=()):
+        self.statements = []
+        self.copies = []
+        self.returning = list(returning)
+        self.ops = mock.Mock(adapt_datetimefield_value=lambda value: value)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class PostgreSQLStandInTests(TestCase):
+    def test_assets_are_copied_through_staging_and_returned_rows_are_new(self):
+        stamp = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        database = FakePostgreSQL(returning=[(7, 'load', 10.0, stamp)])
+        rows = [('crane', 'load', 10.0, stamp), ('crane', 'load', 10.0, stamp)]
+        with mock.patch.object(storage, 'connection', database), mock.patch.object(storage, 'psycopg', None):
+            inserted = storage.PostgreSQLStorage().insert_assets(rows, {'crane': 7})
+
+        self.assertEqual(inserted, [('crane', 'load', 10.0, stamp)])
+        (copy_sql, body), = database.copies
+        self.assertIn('COPY incoming_assets_staging (service_id, asset_id, value, "timestamp", created_at)', copy_sql)
+        self.assertIn('FORMAT csv', copy_sql)
+        self.assertEqual(len(body.splitlines()), 2)
+        self.assertTrue(body.startswith('7,load,10.0,2030-01-01T00:00:00+00:00,'))
+        statements = [sql for sql, _ in database.statements]
+        self.assertTrue(any('ON CONFLICT DO NOTHING RETURNING' in sql for sql in statements))
+        self.assertEqual(statements[-1], 'TRUNCATE incoming_assets_staging')
+
+    def test_payloads_are_copied_as_json(self):
+        database = FakePostgreSQL()
+        with mock.patch.object(storage, 'connection', database), mock.patch.object(storage, 'psycopg', None):
+            storage.PostgreSQLStorage().insert_payloads([({'name': 'crane'}, 1, 2)])
+        (copy_sql, body), = database.copies
+        self.assertIn(f'COPY {IncomingIoTData._meta.db_table} ', copy_sql)
+        self.assertTrue(body.startswith('"{""name"": ""crane""}",1,2,'))
+
+    def test_rollups_upsert_with_least_and_greatest(self):
+        database = FakePostgreSQL()
+        stamp = datetime(2030, 1, 1, 0, 0, 1, tzinfo=timezone.utc)
+        touched = update_rollups([('crane', 'load', 4.0, stamp), ('crane', 'load', 6.0, stamp)], {'crane': 7}, database)
+
+        self.assertEqual(set(touched.values()), {1})
+        sql, params = database.statements[1]  # the 1m table
+        self.assertEqual(sql, upsert_sql(AssetRollup1m, 'postgresql'))
+        self.assertIn('LEAST(asset_rollups_1m.min_value, excluded.min_value)', sql)
+        self.assertIn('GREATEST(asset_rollups_1m.last_timestamp, excluded.last_timestamp)', sql)
+        self.assertEqual(params, [(7, 'load', datetime(2030, 1, 1, tzinfo=timezone.utc), 2, 4.0, 6.0, 10.0, 6.0, stamp)])
+
+    def test_rollups_reject_unsupported_databases(self):
+        with self.assertRaises(NotImplementedError):
+            upsert_sql(AssetRollup1m, 'mysql')
@@ -0,0 +1,71 @@
+# test_streaming.py - Server-Sent Events catch-up and Last-Event-ID resume
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase
+
+from api.views import iot_data_store
+
+def services(value):
+    return [{'name': 'sse_test', 'assets': [{'id': 'load', 'value': value, 'timestamp': '2030-01-01T00:00:00Z'}]}]
+
+async def next_frame(stream):
+    """(id, data) of the next non-heartbeat frame"""
+    while True:
+        chunk = await asyncio.wait_for(anext(stream), timeout=5)
+        if chunk.startswith(b':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+        return int(fields['id']), json.loads(fields['data'])
+
+def load_value(data):
+    for service in data['services']:
+        if service['name'] == 'sse_test':
+            return service['assets'][0]['value']
+
+class StreamResumeTests(TestCase):
+    async def publish(self, value):
+        await sync_to_async(iot_data_store.atomic_update)(services(value))
+        return iot_data_store.history_entries(1)[0]
+
+    async def test_resume_sends_missed_updates(self):
+        version = await self.publish(1)
+        await self.publish(2)
+        response = await AsyncClient().get('/api/stream/iot-data', headers={'Last-Event-ID': str(version)})
+        stream = aiter(response.streaming_content)
+        try:
+            frame_version, data = await next_frame(stream)
+            self.assertEqual(frame_version, version + 1)
+            self.assertEqual(load_value(data), 2)
+        finally:
+            await stream.aclose()
+
+    async def test_last_event_id_ahead_of_current_version_gets_snapshot(self):
+        # An id handed out before a restart, far past the current version
+        current = await self.publish(10)
+        response = await AsyncClient().get('/api/stream/iot-data', headers={'Last-Event-ID': str(current + 1000)})
+        stream = aiter(response.streaming_content)
+        try:
+            frame_version, data = await next_frame(stream)
+            self.assertEqual(frame_version, current)
+            self.assertEqual(load_value(data), 10)
+
+            # Later updates are numbered below the stale id but still arrive
+            await self.publish(11)
+            frame_version, data = await next_frame(stream)
+            self.assertEqual(frame_version, current + 1)
+            self.assertEqual(load_value(data), 11)
+        finally:
+            await stream.aclose()
+
+    async def test_delta_stream_with_id_ahead_gets_snapshot(self):
+        current = await self.publish(20)
+        response = await AsyncClient().get('/api/stream/iot-data?delta=1', headers={'Last-Event-ID': str(current + 5)})
+        stream = aiter(response.streaming_content)
+        try:
+            frame_version, data = await next_frame(stream)
+            self.assertEqual(frame_version, current)
+            self.assertEqual(load_value(data), 20)
+        finally:
+            await stream.aclose()
@@ -0,0 +1,136 @@
+# test_upstream.py - Circuit breaker and the async upstream gateway
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import upstream
+from api.management.commands.bench_config_proxy import StandInUpstream
+from api.upstream import CircuitBreaker, UpstreamError, UpstreamGateway, UpstreamUnavailable
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(upstream.time, 'monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failures=3, reset_seconds=30)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.refusing())
+        self.assertEqual(self.breaker.retry_in(), 30)
+
+    def test_a_success_resets_the_count(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_one_trial_through_and_closes_on_success(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertFalse(self.breaker.refusing())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())  # the trial is still out
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_reopens_for_another_reset_period(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.opened, 2)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_abandoned_trial_frees_the_slot(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.cancel_trial()
+        self.assertTrue(self.breaker.allow())
+
+
+class UpstreamGatewayTests(SimpleTestCase):
+    def setUp(self):
+        self.upstream = StandInUpstream()
+        self.addCleanup(self.upstream.stop)
+        self.breaker = CircuitBreaker(failures=2, reset_seconds=60)
+        self.gateway = UpstreamGateway(base_url=self.upstream.base_url, timeout=0.5, breaker=self.breaker)
+        self.addCleanup(self.gateway.close)
+
+    async def test_returns_status_and_decoded_body(self):
+        status, data = await self.gateway.get('/api/crane-config')
+        self.assertEqual(status, 200)
+        self.assertEqual(data, {"data": {"crane_id": "stand-in", "revision": 0}})
+
+        status, _ = await self.gateway.post('/api/crane-config', json={"revision": 5})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.upstream.config, {"revision": 5})
+
+    async def test_identical_gets_in_flight_share_one_call(self):
+        self.upstream.delay = 0.2
+        results = await asyncio.gather(*(self.gateway.get('/api/crane-config') for _ in range(5)))
+        self.assertEqual({status for status, _ in results}, {200})
+        self.assertEqual(self.upstream.requests, 1)
+        self.assertEqual(self.gateway.shared, 4)
+
+    async def test_server_errors_open_the_circuit_and_later_calls_fail_fast(self):
+        self.upstream.failing = True
+        for _ in range(2):
+            status, _ = await self.gateway.get('/api/crane-config')
+            self.assertEqual(status, 500)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(UpstreamUnavailable):
+            await self.gateway.get('/api/crane-config')
+        with self.assertRaises(UpstreamUnavailable):
+            await self.gateway.post('/api/crane-config', json={})
+        self.assertEqual(self.upstream.requests, 2)
+        self.assertEqual(self.gateway.rejected, 2)
+
+    async def test_client_errors_do_not_count_against_the_circuit(self):
+        for _ in range(3):
+            status, _ = await self.gateway.get('/missing')
+            self.assertEqual(status, 404)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_slow_upstream_times_out_as_a_failure(self):
+        self.upstream.delay = 1.0
+        with self.assertRaises(UpstreamError) as raised:
+            await self.gateway.get('/api/crane-config')
+        self.assertIn('no response within 0.5s', str(raised.exception))
+        self.assertEqual(self.breaker.consecutive_failures, 1)
+
+    async def test_refused_connections_open_the_circuit(self):
+        self.upstream.stop()
+        for _ in range(2):
+            with self.assertRaises(UpstreamError):
+                await self.gateway.get('/api/crane-config')
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.gateway.get_metrics()['failures'], 2)
@@ -0,0 +1,248 @@
+# timeseries.py - Bucketed time-series queries over incoming_assets
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta, timezone as dt_timezone
+import json
+import math
+import re
+
+from .models import Service
+from .rollups import resolution_for_step
+
+# ==================== CONFIGURATION ====================
+# Hard cap on buckets returned per series - wider ranges get a coarser step
+TIMESERIES_MAX_POINTS = getattr(settings, 'IOT_TIMESERIES_MAX_POINTS', 5000)
+TIMESERIES_MAX_SERIES = getattr(settings, 'IOT_TIMESERIES_MAX_SERIES', 50)
+TIMESERIES_CHUNK_ROWS = 1000
+TIMESERIES_DEFAULT_RANGE = timedelta(hours=1)
+MIN_STEP_SECONDS = 0.01
+
+AGGREGATIONS = ('min', 'max', 'avg', 'last', 'count')
+
+_DURATION_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h|d|w)?\s*$')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, None: 1}
+
+
+class TimeseriesQueryError(ValueError):
+    """Invalid time-series request; carries the HTTP status to answer with"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# ==================== PARAMETER PARSING ====================
+
+def parse_duration(value):
+    """Parse '500ms', '10s', '5m', '1h', '1d', '1w' or plain seconds into seconds"""
+    match = _DURATION_RE.match(str(value))
+    if not match:
+        raise TimeseriesQueryError(f"Invalid duration: {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+def parse_time(value):
+    """Parse an ISO-8601 timestamp or epoch seconds into an aware datetime"""
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except ValueError:
+        pass
+    except (OverflowError, OSError):
+        raise TimeseriesQueryError(f"Timestamp out of range: {value!r}")
+    try:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise TimeseriesQueryError(f"Invalid timestamp: {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+# ==================== QUERY ====================
+
+class TimeseriesQuery:
+    """
+    One bucketed query: `agg` of `value` per `step` seconds for each asset of
+    a service between `start` (inclusive) and `end` (exclusive).
+
+    Bucketing runs in SQL, so only one row per bucket ever leaves the
+    database. Steps that are whole multiples of a rollup resolution read the
+    coarsest such rollup table instead of raw rows; rollup buckets are then
+    included when they start inside the range.
+    """
+    def __init__(self, service, service_id, asset_ids, start, end, step, agg):
+        self.service = service
+        self.service_id = service_id
+        self.asset_ids = asset_ids
+        self.start = start
+        self.end = end
+        self.requested_step = step
+        self.agg = agg
+        # Widen the step rather than exceed the per-series point cap; a widened
+        # step is rounded up to whole seconds so it can still use a rollup
+        span = (end - start).total_seconds()
+        step = max(step, MIN_STEP_SECONDS)
+        if span / TIMESERIES_MAX_POINTS > step:
+            step = span / TIMESERIES_MAX_POINTS
+            if step >= 1:
+                step = math.ceil(step)
+        # Buckets are computed on integer milliseconds
+        self.step_ms = math.ceil(round(step * 1000, 6))
+        self.step = self.step_ms / 1000
+        self.rollup = resolution_for_step(self.step)
+
+    @classmethod
+    def from_params(cls, params):
+        """Build a query from request GET parameters (touches the database)"""
+        service = params.get('service')
+        if not service:
+            raise TimeseriesQueryError("'service' is required")
+
+        asset_ids = [a for value in params.getlist('asset') for a in value.split(',') if a]
+        if len(asset_ids) > TIMESERIES_MAX_SERIES:
+            raise TimeseriesQueryError(f"At most {TIMESERIES_MAX_SERIES} assets per query")
+
+        agg = params.get('agg', 'avg')
+        if agg not in AGGREGATIONS:
+            raise TimeseriesQueryError(f"'agg' must be one of {', '.join(AGGREGATIONS)}")
+
+        end = parse_time(params['to']) if params.get('to') else timezone.now()
+        start = parse_time(params['from']) if params.get('from') else end - TIMESERIES_DEFAULT_RANGE
+        if start >= end:
+            raise TimeseriesQueryError("'from' must be before 'to'")
+
+        step = parse_duration(params.get('step', '60s'))
+        if step <= 0:
+            raise TimeseriesQueryError("'step' must be positive")
+
+        service_id = Service.objects.filter(name=service).values_list('id', flat=True).first()
+        if service_id is None:
+            raise TimeseriesQueryError(f"Unknown service: {service}", status=404)
+
+        return cls(service, service_id, asset_ids, start, end, step, agg)
+
+    @property
+    def resolution(self):
+        return f"{self.rollup.resolution_seconds}s" if self.rollup else 'raw'
+
+    def _bucket_sql(self, vendor, column):
+        if vendor == 'sqlite':
+            # julianday keeps sub-second precision, unlike strftime('%s');
+            # rounding to whole milliseconds absorbs its floating-point error
+            return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000.0) AS INTEGER) / %s"
+        if vendor == 'postgresql':
+            return f"FLOOR(EXTRACT(EPOCH FROM {column}) * 1000 / %s)::bigint"
+        raise TimeseriesQueryError(f"Time-series queries are not supported on {vendor}", status=501)
+
+    def _agg_sql(self, vendor):
+        if self.rollup is None:
+            value, timestamp = 'value', 'timestamp'
+            aggregates = {'min': 'MIN(value)', 'max': 'MAX(value)', 'avg': 'AVG(value)', 'count': 'COUNT(*)'}
+        else:
+            value, timestamp = 'last_value', 'last_timestamp'
+            aggregates = {
+                'min': 'MIN(min_value)',
+                'max': 'MAX(max_value)',
+                'avg': 'SUM(sum_value) / SUM(sample_count)',
+                'count': 'SUM(sample_count)',
+            }
+        if self.agg == 'last':
+            if vendor == 'sqlite':
+                # SQLite returns the bare value column from the MAX(timestamp) row
+                return f"{value}, MAX({timestamp})"
+            return f"(ARRAY_AGG({value} ORDER BY {timestamp} DESC))[1]"
+        return aggregates[self.agg]
+
+    def sql(self, db_connection=None):
+        """Return (sql, params) yielding (asset_id, bucket, value[, ...]) ordered by series then bucket"""
+        db_connection = db_connection or connection
+        vendor = db_connection.vendor
+        adapt = db_connection.ops.adapt_datetimefield_value
+        params = [self.step_ms, self.service_id, adapt(self.start), adapt(self.end)]
+        if self.rollup is None:
+            table, column = 'incoming_assets', 'timestamp'
+        else:
+            table, column = self.rollup._meta.db_table, 'bucket'
+        if self.asset_ids:
+            asset_filter = f"AND asset_id IN ({', '.join(['%s'] * len(self.asset_ids))})"
+            params.extend(self.asset_ids)
+        else:
+            # Without an asset filter, read the first TIMESERIES_MAX_SERIES assets
+            # (one more tells stream_json the result was truncated)
+            asset_filter = (
+                f"AND asset_id IN (SELECT DISTINCT asset_id FROM {table} "
+                f"WHERE service_id = %s AND {column} >= %s AND {column} < %s ORDER BY asset_id LIMIT %s)"
+            )
+            params.extend([self.service_id, adapt(self.start), adapt(self.end), TIMESERIES_MAX_SERIES + 1])
+        sql = (
+            f"SELECT asset_id, {self._bucket_sql(vendor, column)} AS bucket_index, {self._agg_sql(vendor)} "
+            f"FROM {table} "
+            f"WHERE service_id = %s AND {column} >= %s AND {column} < %s {asset_filter} "
+            f"GROUP BY asset_id, bucket_index ORDER BY asset_id, bucket_index"
+        )
+        return sql, params
+
+    def fetch_chunks(self, chunk_rows=TIMESERIES_CHUNK_ROWS):
+        """Yield lists of (asset_id, bucket, value) rows straight from the cursor"""
+        sql, params = self.sql()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    return
+                yield [row[:3] for row in rows]
+
+    async def stream_json(self):
+        """
+        Stream the response body in chunks. Rows arrive ordered by asset, so
+        each series is written out as soon as its buckets are read.
+        """
+        header = {
+            "success": True,
+            "service": self.service,
+            "from": self.start.isoformat(),
+            "to": self.end.isoformat(),
+            "step": self.step,
+            "requested_step": self.requested_step,
+            "resolution": self.resolution,
+            "agg": self.agg,
+            "max_points": TIMESERIES_MAX_POINTS,
+            "max_series": TIMESERIES_MAX_SERIES,
+        }
+        yield json.dumps(header)[:-1] + ', "series": ['
+
+        # The cursor lives in a sync generator; thread-sensitive sync_to_async
+        # keeps every fetch on the same thread and database connection
+        chunks = self.fetch_chunks()
+        next_chunk = sync_to_async(lambda: next(chunks, None))
+        current_asset = None
+        series_count = 0
+        truncated = False
+        try:
+            while not truncated:
+                rows = await next_chunk()
+                if rows is None:
+                    break
+                parts = []
+                for asset_id, bucket, value in rows:
+                    point = json.dumps([bucket * self.step_ms, value])
+                    if asset_id != current_asset:
+                        if series_count == TIMESERIES_MAX_SERIES:
+                            truncated = True
+                            break
+                        if current_asset is not None:
+                            parts.append(']}, ')
+                        parts.append(f'{{"asset": {json.dumps(asset_id)}, "points": [{point}')
+                        current_asset = asset_id
+                        series_count += 1
+                    else:
+                        parts.append(f', {point}')
+                yield ''.join(parts)
+        finally:
+            await sync_to_async(chunks.close)()
+
+        if current_asset is not None:
+            yield ']}'
+        yield f'], "total_series": {series_count}, "truncated": {json.dumps(truncated)}}}'
+
@@ -0,0 +1,263 @@
+# upstream.py - Non-blocking client for the upstream Flask server
+from django.conf import settings
+import asyncio
+import atexit
+import os
+import threading
+import time
+
+import aiohttp
+
+# ==================== CONFIGURATION ====================
+UPSTREAM_BASE_URL = getattr(settings, 'IOT_UPSTREAM_BASE_URL', 'http://172.28.176.174:5000')
+# Budget for one upstream call, including the wait for a concurrency slot
+UPSTREAM_TIMEOUT_SECONDS = getattr(settings, 'IOT_UPSTREAM_TIMEOUT_SECONDS', 3.0)
+# Keep-alive connections kept open to the upstream server
+UPSTREAM_POOL_SIZE = getattr(settings, 'IOT_UPSTREAM_POOL_SIZE', 10)
+# Upstream calls in flight at once per process
+UPSTREAM_MAX_CONCURRENCY = getattr(settings, 'IOT_UPSTREAM_MAX_CONCURRENCY', 10)
+# Consecutive failures that open the circuit, and how long it stays open
+UPSTREAM_BREAKER_FAILURES = getattr(settings, 'IOT_UPSTREAM_BREAKER_FAILURES', 5)
+UPSTREAM_BREAKER_RESET_SECONDS = getattr(settings, 'IOT_UPSTREAM_BREAKER_RESET_SECONDS', 30.0)
+
+# ==================== ERRORS ====================
+
+class UpstreamError(Exception):
+    """The upstream call did not produce a response (connection error, timeout)"""
+    status = 503
+
+class UpstreamUnavailable(UpstreamError):
+    """Refused without calling: the circuit is open"""
+
+# ==================== CIRCUIT BREAKER ====================
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After `failures` failed calls in a
+    row the circuit opens and calls are refused for `reset_seconds`; then
+    one trial call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=None, reset_seconds=None):
+        self.failure_threshold = failures or UPSTREAM_BREAKER_FAILURES
+        self.reset_seconds = UPSTREAM_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial = False
+        self.opened = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    return False
+                self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                    print(f"⚠️ Upstream circuit open after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def refusing(self):
+        """True while open and not yet due for a trial - checked without claiming one"""
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def cancel_trial(self):
+        """Let another half-open trial through after one was abandoned"""
+        with self._lock:
+            self._trial = False
+
+    def retry_in(self):
+        """Seconds until an open circuit lets a trial call through"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def get_metrics(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "retry_in_seconds": round(self.retry_in(), 3),
+            "opened": self.opened
+        }
+
+# ==================== GATEWAY ====================
+
+class UpstreamGateway:
+    """
+    aiohttp client for the upstream server running on its own event loop
+    thread, so no upstream call ever occupies a request thread or the
+    server's event loop - a slow or dead upstream costs the IoT endpoints
+    nothing. request() can be awaited from any event loop.
+
+    At most `max_concurrency` calls are in flight, each bounded by
+    `timeout` including the wait for a slot. Identical GETs in flight
+    share one upstream call. Connection errors, timeouts and 5xx answers
+    count against the circuit breaker; while it is open calls raise
+    UpstreamUnavailable without touching the network.
+
+    The loop thread starts on first use in each process (gunicorn forks
+    workers after importing the app).
+    """
+    def __init__(self, base_url=None, timeout=None, max_concurrency=None, pool_size=None, breaker=None):
+        self.base_url = (base_url or UPSTREAM_BASE_URL).rstrip('/')
+        self.timeout = timeout or UPSTREAM_TIMEOUT_SECONDS
+        self.max_concurrency = max_concurrency or UPSTREAM_MAX_CONCURRENCY
+        self.pool_size = pool_size or UPSTREAM_POOL_SIZE
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._session = None
+        self._semaphore = None
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+        self.rejected = 0
+        self.failures = 0
+
+    # event loop ----------------------------------------------------------
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                self._session = None
+                self._inflight = {}
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+                atexit.register(self.close)
+            return self._loop
+
+    def run(self, coroutine):
+        """Schedule `coroutine` on the gateway loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    # requests ------------------------------------------------------------
+
+    async def request(self, method, path, json=None, key=None):
+        """
+        Call the upstream; returns (status code, decoded JSON body or None).
+        GETs with the same `key` (default: the path) in flight at the same
+        time share one call. Raises UpstreamError / UpstreamUnavailable.
+        """
+        if self.breaker.refusing():
+            # Fail fast on the caller's side, without a hop to the gateway loop
+            self._reject()
+        return await asyncio.wrap_future(self.run(self._request(method, path, json, key)))
+
+    async def get(self, path, key=None):
+        return await self.request('GET', path, key=key)
+
+    async def post(self, path, json=None):
+        return await self.request('POST', path, json=json)
+
+    async def _request(self, method, path, json, key):
+        if method != 'GET':
+            return await self._call(method, path, json)
+        key = path if key is None else key
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(self._call(method, path, None))
+            task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        else:
+            self.shared += 1
+        # A cancelled caller must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    async def _call(self, method, path, json):
+        if not self.breaker.allow():
+            self._reject()
+        self.calls += 1
+        session = self._get_session()
+        try:
+            async with asyncio.timeout(self.timeout):
+                async with self._semaphore:
+                    async with session.request(method, self.base_url + path, json=json) as response:
+                        status = response.status
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            data = None
+        except (aiohttp.ClientError, TimeoutError, OSError) as e:
+            self.failures += 1
+            self.breaker.record_failure()
+            raise UpstreamError(f"Connection error: {str(e) or f'no response within {self.timeout:g}s'}") from e
+        except asyncio.CancelledError:
+            # Neither a success nor a failure
+            self.breaker.cancel_trial()
+            raise
+        if status >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return status, data
+
+    def _reject(self):
+        self.rejected += 1
+        raise UpstreamUnavailable(f"Upstream circuit open, retrying in {self.breaker.retry_in():.0f}s")
+
+    def close(self):
+        """Close the session and stop the gateway loop (a later call starts a new one)"""
+        with self._lock:
+            loop, session = self._loop, self._session
+            self._loop = self._session = None
+        if loop is None:
+            return
+        if session is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=self.timeout)
+            except Exception as e:
+                print(f"⚠️ Upstream session did not close cleanly: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+    def get_metrics(self):
+        return {
+            "base_url": self.base_url,
+            "calls": self.calls,
+            "shared": self.shared,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "in_flight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "breaker": self.breaker.get_metrics()
+        }
+
+
+# Process-wide gateway used by the proxy endpoints
+upstream_gateway = UpstreamGateway()
@@ -11,7 +11,13 @@ urlpatterns = [
     # IoT Data endpoints (local Django processing only)
     path('iot-data', views.get_iot_data, name='get-iot-data'),
     path('iot-data/receive', views.receive_iot_data, name='receive-iot-data'),
+    path('iot-data/receive/batch', views.receive_iot_data_batch, name='receive-iot-data-batch'),
     path('iot-data/history', views.get_iot_data_history, name='iot-data-history'),
+    path('timeseries', views.get_timeseries, name='timeseries'),
+    path('assets/<str:service_name>/<str:asset_id>/stats', views.get_asset_stats, name='asset-stats'),
+    path('alerts', views.get_alerts, name='alerts'),
+    path('dashboard', views.get_dashboard, name='dashboard'),
+    path('dashboard/<str:section>', views.get_dashboard, name='dashboard-section'),
     
     # ==================== REAL-TIME STREAMING ENDPOINTS ====================
     # Server-Sent Events (SSE) for real-time streaming
@@ -20,6 +26,7 @@ urlpatterns = [
     # ==================== UTILITY ENDPOINTS ====================
     path('health', views.health_check, name='health-check'),
     path('debug', views.debug_info, name='debug-info'),
+    path('debug/profile', views.profile_worker, name='debug-profile'),
     
     # ==================== WEB SOCKET ENDPOINT ====================
     path('ws/iot-data', views.websocket_iot, name='websocket-iot'),
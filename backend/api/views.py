@@ -1,12 +1,14 @@
 # views.py - High-performance version for 10ms+ IoT data
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
+from asgiref.sync import sync_to_async
+import hmac
 import json
-import requests
+import logging
+import os
 from datetime import datetime
-from collections import deque
 import threading
 import time
 import asyncio
@@ -14,136 +16,147 @@ from concurrent.futures import ThreadPoolExecutor
 import queue
 
 # Import models
-from .models import Service, Asset, IncomingIoTData
-
-# ==================== CONFIGURATION ====================
-EXTERNAL_SERVER_GET_BASE_URL = "http://172.28.176.174:5000"
+from .models import Service, Asset, IncomingIoTData, AlertEvent
+from . import ingest, coalesce, metrics, profiling
+from .service_cache import service_cache
+from .live_state import create_live_state
+from .streaming import sse_broadcaster, LiveUpdate, AlertUpdate, format_sse_event, SSE_HEARTBEAT, SSE_HEARTBEAT_SECONDS
+from .websocket import websocket_broadcaster
+from .snapshot_cache import snapshot_cache, etag_matches
+from .timeseries import TimeseriesQuery, TimeseriesQueryError
+from .retention import start_background_pruner
+from .db_writer import create_db_writer
+from .parallel_ingest import create_ingest_pipeline
+from .batch_ingest import BatchDecodeError, decode_batch, count_assets
+from .asset_stats import asset_stats
+from .aggregates import dashboard_aggregates, SECTIONS as DASHBOARD_SECTIONS
+from .rules import rule_engine, RULES_ENABLED
+from .config_proxy import crane_config
+from .upstream import upstream_gateway, UpstreamError
 
 # ==================== THREAD-SAFE DATA STORAGE ====================
 
-class ThreadSafeIoTData:
-    """Thread-safe container for IoT data with atomic updates"""
-    def __init__(self):
-        self._lock = threading.RLock()
-        self._data = {
-            'services': [],
-            'last_updated': None,
-            'history': deque(maxlen=100),
-            'latest': None,
-            'websocket_clients': set(),
-            'data_queue': queue.Queue(maxsize=1000)
-        }
-    
-    def atomic_update(self, services_data):
-        """Update all data fields atomically to prevent race conditions"""
-        with self._lock:
-            timestamp = datetime.now().isoformat() + 'Z'
-            
-            # Update history (thread-safe for deque)
-            self._data['history'].append(services_data)
-            
-            # Update all fields in single operation
-            self._data.update({
-                'services': services_data,
-                'last_updated': timestamp,
-                'latest': services_data
-            })
-            return timestamp
-    
-    def get_snapshot(self):
-        """Get consistent snapshot of all data - no partial states"""
-        with self._lock:
-            # Create a deep copy to avoid reference issues
-            return {
-                'services': self._data['services'].copy() if self._data['services'] else [],
-                'last_updated': self._data['last_updated'],
-                'latest': self._data['latest'].copy() if self._data['latest'] else None,
-                'history': list(self._data['history']),  # Convert deque to list for snapshot
-                'websocket_clients': self._data['websocket_clients'].copy(),
-                'queue_size': self._data['data_queue'].qsize()
-            }
-    
-    def add_websocket_client(self, client):
-        with self._lock:
-            self._data['websocket_clients'].add(client)
-    
-    def remove_websocket_client(self, client):
-        with self._lock:
-            self._data['websocket_clients'].discard(client)
-    
-    @property
-    def data_queue(self):
-        return self._data['data_queue']
-    
-    @property 
-    def websocket_clients(self):
-        with self._lock:
-            return len(self._data['websocket_clients'])
+# Initialize thread-safe store (backend chosen by IOT_LIVE_STATE_BACKEND)
+iot_data_store = create_live_state()
 
-# Initialize thread-safe store
-iot_data_store = ThreadSafeIoTData()
+# Database writes go through IOT_DB_WRITER (this process, or the writer process)
+db_writer = create_db_writer()
+
+# Payloads are normalized on IOT_INGEST_WORKERS processes when set (None = on
+# the processor thread)
+ingest_pipeline = create_ingest_pipeline(iot_data_store.data_queue, writer=db_writer)
 
 # ==================== HIGH-SPEED DATA PROCESSING ====================
 
 def background_data_processor():
-    """Background thread to process data without blocking the main request"""
-    print("🔄 Starting background data processor...")
+    """Background thread to process queued data in batches without blocking requests"""
+    workers = ingest_pipeline.pool.workers if ingest_pipeline else 0
+    print(f"🔄 Starting background data processor (mode: {coalesce.INGEST_MODE}, workers: {workers}, batch: {ingest.INGEST_BATCH_SIZE}, flush: {ingest.INGEST_FLUSH_INTERVAL_MS}ms)...")
+    try:
+        print(f"🗂️ Service cache warmed with {service_cache.warm()} services")
+    except Exception as e:
+        print(f"⚠️ Service cache warm-up failed (will fill on demand): {e}")
     while True:
         try:
-            # Get data from queue (non-blocking with timeout)
-            item = iot_data_store.data_queue.get(timeout=1.0)
-            external_data, request_time = item
+            # Drain up to N payloads or T milliseconds worth of queued data,
+            # persist it in one transaction and publish it (SSE and WebSocket
+            # subscribers are notified by the store) - one merged update per
+            # batch when IOT_INGEST_MODE=coalesce and the queue is backed up.
+            # With a worker pool this thread only commits, in drain order.
+            # Timings and counts go to /metrics; the log only gets a
+            # sampled summary line
+            if ingest_pipeline:
+                processed, published = ingest_pipeline.commit_next(iot_data_store)
+            else:
+                processed, published = coalesce.process_next_batch(iot_data_store.data_queue, iot_data_store, writer=db_writer)
             
-            # Process the data FIRST (outside lock for performance)
-            processed_services = process_service_based_data(external_data)
-            
-            # 🎯 ATOMIC UPDATE: Update all data fields together
-            iot_data_store.atomic_update(processed_services)
-                
-            # Broadcast to WebSocket clients with consistent data
-            broadcast_to_websockets(processed_services)
-                
-            print(f"✅ Background processed {len(processed_services)} services (queue: {iot_data_store.data_queue.qsize()})")
+            ingest.ingest_log.event(
+                'batch_processed', totals=('payloads', 'updates'),
+                payloads=processed, updates=published, queue=iot_data_store.data_queue.qsize()
+            )
                 
         except queue.Empty:
             # No data in queue, continue
             continue
         except Exception as e:
-            print(f"💥 Background processor error: {e}")
+            ingest.ingest_log.event('processor_error', logging.ERROR, error=str(e))
             continue
 
 # Start background processor thread
 processor_thread = threading.Thread(target=background_data_processor, daemon=True)
 processor_thread.start()
 
+# Live gauges for /metrics, and this worker's share of the aggregated metrics
+metrics.registry.gauge(
+    'iot_stream_subscribers', 'Connected live-data subscribers',
+    lambda: {('sse',): len(sse_broadcaster), ('websocket',): len(websocket_broadcaster)},
+    labelnames=('transport',)
+)
+metrics.registry.gauge(
+    'iot_ingest_queue_size', 'Payloads waiting in the ingest queue', lambda: iot_data_store.data_queue.qsize()
+)
+metrics.registry.start()
+
+# Start the retention pruner (IOT_RETENTION_POLICIES) - the writer process
+# runs it instead when it owns all writes
+pruner_thread = start_background_pruner() if db_writer.backend == 'local' else None
+
 @require_http_methods(["GET"])
-def get_iot_data(request):
-    """GET endpoint for IoT data - Thread-safe snapshot for no flickering"""
+async def get_iot_data(request):
+    """
+    GET endpoint for IoT data - Thread-safe snapshot for no flickering.
+    Full snapshots are served pre-encoded with an ETag (304 when unchanged).
+    With ?since=<version> only assets changed after that version are returned,
+    falling back to a full snapshot when the gap is too large.
+    """
     start_time = time.time()
     
-    # 🎯 Get atomic snapshot - guaranteed consistent state
-    data_snapshot = iot_data_store.get_snapshot()
-    services_data = data_snapshot['services']
-    timestamp = data_snapshot['last_updated']
-    
-    response_data = {
-        "success": True,
-        "data": {
-            "services": services_data,
-            "timestamp": timestamp,
-            "source": "django_server", 
-            "total_services": len(services_data),
-            "total_assets": sum(len(service.get('assets', [])) for service in services_data)
-        },
-        "message": "Data retrieved successfully",
-        "response_time_ms": round((time.time() - start_time) * 1000, 2),
-        "timestamp": datetime.now().isoformat() + 'Z'
-    }
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since_version = int(since)
+        except ValueError:
+            return JsonResponse({
+                "success": False,
+                "error": "'since' must be an integer version",
+                "timestamp": datetime.now().isoformat() + 'Z'
+            }, status=400)
+        
+        delta = iot_data_store.changes_since(since_version)
+        if delta is not None:
+            version, changes, removed = delta
+            return JsonResponse({
+                "success": True,
+                "data": {
+                    "delta": True,
+                    "since": since_version,
+                    "version": version,
+                    "changes": changes,
+                    "removed": removed,
+                    "source": "django_server",
+                    "total_changes": len(changes)
+                },
+                "message": "Changes retrieved successfully",
+                "response_time_ms": round((time.time() - start_time) * 1000, 2),
+                "timestamp": datetime.now().isoformat() + 'Z'
+            })
     
-    return JsonResponse(response_data)
+    # 🎯 Pre-serialized snapshot - built once per update, never per request
+    # (async view: no thread hand-off, just a pointer read)
+    cached = snapshot_cache.get()
+    if cached is None:
+        cached = await sync_to_async(snapshot_cache.get_or_build)(iot_data_store)
+    if etag_matches(request.headers.get('If-None-Match'), cached.etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(cached.body, content_type='application/json')
+    response['ETag'] = cached.etag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@metrics.REQUEST_SECONDS.labels('receive').timed()
 def receive_iot_data(request):
     """Receive IoT data - Ultra fast, just queues data for background processing"""
     start_time = time.time()
@@ -173,6 +186,7 @@ def receive_iot_data(request):
             
         except queue.Full:
             # Queue is full - handle backpressure
+            metrics.REJECTIONS.labels('receive').inc()
             return JsonResponse({
                 "success": False,
                 "error": "Server busy - queue full",
@@ -192,119 +206,75 @@ def receive_iot_data(request):
             "timestamp": datetime.now().isoformat() + 'Z'
         }, status=500)
 
-def process_service_based_data(external_data):
-    """Process IoT data - Optimized for speed"""
-    # Store raw payload in database (non-blocking if possible)
+@csrf_exempt
+@require_http_methods(["POST"])
+@metrics.REQUEST_SECONDS.labels('receive_batch').timed()
+def receive_iot_data_batch(request):
+    """
+    Receive many payloads in one request: NDJSON, a JSON array or MessagePack,
+    optionally gzip/zstd compressed (Content-Encoding). The whole batch is
+    queued with a single queue operation.
+    """
+    start_time = time.time()
+    
     try:
-        incoming_data = IncomingIoTData.objects.create(
-            raw_data=external_data,
-            total_services=0,
-            total_assets=0
+        payloads, errors, rejected = decode_batch(
+            request.body,
+            request.content_type,
+            request.headers.get('Content-Encoding')
         )
-    except Exception as e:
-        print(f"⚠️ Database write error (non-critical): {e}")
-        # Continue processing even if DB fails
-    
-    # Handle different data formats - optimized
-    services_data = []
-    
-    if isinstance(external_data, list):
-        services_data = external_data
-    elif isinstance(external_data, dict):
-        if 'services' in external_data and isinstance(external_data['services'], list):
-            services_data = external_data['services']
-        elif 'name' in external_data and 'assets' in external_data:
-            services_data = [external_data]
-        else:
-            services_data = [external_data]
-    else:
-        services_data = []
-    
-    processed_services = []
-    total_services = 0
-    total_assets = 0
-    
-    for service_data in services_data:
-        if isinstance(service_data, dict) and 'name' in service_data:
-            service_name = service_data['name']
-            
-            # Get or create service in database (non-blocking approach)
-            try:
-                service, created = Service.objects.get_or_create(name=service_name)
-            except Exception as e:
-                print(f"⚠️ Service creation error: {e}")
-                continue
-            
-            processed_assets = []
-            assets_data = service_data.get('assets', [])
-            
-            if not isinstance(assets_data, list):
-                assets_data = []
-            
-            for asset_data in assets_data:
-                if isinstance(asset_data, dict) and 'id' in asset_data and 'value' in asset_data:
-                    # Parse timestamp efficiently
-                    try:
-                        timestamp_str = asset_data.get('timestamp')
-                        if timestamp_str:
-                            if timestamp_str.endswith('Z'):
-                                timestamp_str = timestamp_str[:-1] + '+00:00'
-                            asset_timestamp = datetime.fromisoformat(timestamp_str)
-                        else:
-                            asset_timestamp = timezone.now()
-                    except Exception:
-                        asset_timestamp = timezone.now()
-                    
-                    # Create asset in database (non-blocking)
-                    try:
-                        Asset.objects.create(
-                            service=service,
-                            asset_id=asset_data['id'],
-                            value=str(asset_data['value']),
-                            timestamp=asset_timestamp
-                        )
-                    except Exception as e:
-                        print(f"⚠️ Asset creation error: {e}")
-                    
-                    # Add to processed assets
-                    processed_assets.append({
-                        'id': asset_data['id'],
-                        'value': asset_data['value'],
-                        'timestamp': asset_data.get('timestamp', datetime.now().isoformat() + 'Z')
-                    })
-            
-            total_assets += len(processed_assets)
-            total_services += 1
-            
-            # Create clean service object
-            processed_services.append({
-                'name': service_name,
-                'assets': processed_assets
-            })
+    except BatchDecodeError as e:
+        return JsonResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=e.status)
     
-    # Update database record if created
-    try:
-        if 'incoming_data' in locals():
-            incoming_data.total_services = total_services
-            incoming_data.total_assets = total_assets
-            incoming_data.processed = True
-            incoming_data.save()
-    except Exception as e:
-        print(f"⚠️ Database update error: {e}")
+    if payloads:
+        try:
+            iot_data_store.data_queue.put((ingest.PayloadBatch(payloads), datetime.now()), block=False)
+        except queue.Full:
+            metrics.REJECTIONS.labels('receive_batch').inc()
+            return JsonResponse({
+                "success": False,
+                "error": "Server busy - queue full",
+                "accepted": 0,
+                "rejected": len(payloads) + rejected,
+                "timestamp": datetime.now().isoformat() + 'Z'
+            }, status=503)
     
-    return processed_services
+    queue_size = iot_data_store.data_queue.qsize()
+    return JsonResponse({
+        "success": bool(payloads),
+        "message": f"{len(payloads)} payloads queued for processing (queue: {queue_size})",
+        "accepted": len(payloads),
+        "rejected": rejected,
+        "errors": errors,
+        "received_assets": count_assets(payloads),
+        "queue_position": queue_size,
+        "processing_time_ms": round((time.time() - start_time) * 1000, 2),
+        "timestamp": datetime.now().isoformat() + 'Z'
+    }, status=200 if payloads else 400)
+
+def process_service_based_data(external_data):
+    """Process a single IoT payload - thin wrapper over the batched ingest pipeline"""
+    return ingest.process_payloads([external_data], writer=db_writer)[0]
 
 # ==================== REAL WEB SOCKET IMPLEMENTATION ====================
 
 @csrf_exempt
 async def websocket_iot(request):
-    """Real WebSocket endpoint for live IoT data streaming"""
+    """Describe the WebSocket endpoint (the upgrade itself is handled in asgi.py)"""
     if request.method == 'GET':
         return JsonResponse({
             "success": True,
             "message": "WebSocket endpoint active",
             "supported_protocols": ["ws", "wss"],
             "endpoint": "/api/ws/iot-data",
+            "subscribe": {
+                "query": "?services=LoadCell,onboard_io&assets=LoadCell:load&delta=1",
+                "message": {"type": "subscribe", "services": ["LoadCell"], "assets": ["LoadCell:load"], "delta": True}
+            },
             "current_clients": iot_data_store.websocket_clients,
             "timestamp": datetime.now().isoformat() + 'Z'
         })
@@ -314,51 +284,113 @@ async def websocket_iot(request):
         "error": "Method not allowed"
     }, status=405)
 
-def broadcast_to_websockets(data):
-    """Broadcast data to all connected WebSocket clients"""
-    # Real implementation for WebSocket broadcasting
-    # This would use Django Channels in production
-    client_count = iot_data_store.websocket_clients
-    if client_count > 0:
-        # Get consistent snapshot for broadcasting
-        snapshot = iot_data_store.get_snapshot()
-        broadcast_data = {
-            "services": snapshot['services'],
-            "timestamp": snapshot['last_updated'],
-            "type": "iot_data_update",
-            "queue_size": snapshot['queue_size']
-        }
-        print(f"📢 Broadcasting consistent data to {client_count} WebSocket clients")
-        # Actual WebSocket broadcasting code would go here
+def broadcast_to_websockets(update):
+    """Push one update to all WebSocket clients - encoded once per subscription filter"""
+    websocket_broadcaster.publish(update)
+
+def publish_live_update(version, timestamp, services_data, changes, removed):
+    """Live-state listener: refresh the GET body and wake stream subscribers"""
+    snapshot_cache.update(version, timestamp, services_data)
+    if not (sse_broadcaster or websocket_broadcaster):
+        return
+    # One shared update object - SSE and WebSocket clients reuse its encodings
+    update = LiveUpdate(version, timestamp, services_data, changes, removed, iot_data_store.data_queue.qsize())
+    if sse_broadcaster:
+        sse_broadcaster.publish(update)
+    if websocket_broadcaster:
+        broadcast_to_websockets(update)
+
+iot_data_store.add_listener(publish_live_update)
+# Per-asset sample windows behind /api/assets/<service>/<id>/stats
+iot_data_store.add_listener(asset_stats.on_update)
+# Running dashboard summaries behind /api/dashboard/<section>, with energy and
+# load carried over from the day's rollups so a recycled worker keeps them
+iot_data_store.add_listener(dashboard_aggregates.on_update)
+dashboard_aggregates.seed_in_background()
+
+def publish_alerts(version, transitions):
+    """Rule-engine listener: push alert transitions to stream subscribers"""
+    update = AlertUpdate(version, transitions)
+    if sse_broadcaster:
+        sse_broadcaster.publish(update)
+    if websocket_broadcaster:
+        broadcast_to_websockets(update)
+
+# Alert rules run on every update that reaches this worker's live state
+if RULES_ENABLED:
+    rule_engine.add_listener(publish_alerts)
+    iot_data_store.add_listener(rule_engine.on_update)
+    # Alert events go through the same single writer as the ingest batches
+    rule_engine.start(writer=db_writer)
 
 @require_http_methods(["GET"])
-def stream_iot_data(request):
-    """Server-Sent Events endpoint for real-time data streaming"""
-    def event_stream():
-        last_sent = None
-        while True:
-            # Get consistent snapshot each time
-            snapshot = iot_data_store.get_snapshot()
-            current_data = snapshot['services']
-            current_timestamp = snapshot['last_updated']
-            
-            # Only send if data has changed (compare timestamps)
-            if current_timestamp != last_sent and current_data:
-                data = {
-                    "services": current_data,
-                    "timestamp": current_timestamp,
-                    "type": "iot_data_update",
-                    "queue_size": snapshot['queue_size']
-                }
-                yield f"data: {json.dumps(data)}\n\n"
-                last_sent = current_timestamp
-            
-            # Non-blocking sleep
-            time.sleep(0.01)  # 10ms check interval
-    
-    response = HttpResponse(event_stream(), content_type='text/event-stream')
+async def stream_iot_data(request):
+    """
+    Server-Sent Events endpoint - pushed on every update, resumable via Last-Event-ID.
+    With ?delta=1 only changed assets are sent after the initial snapshot.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_version = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_version = None
+    delta = request.GET.get('delta') in ('1', 'true')
+
+    async def initial_frames():
+        """
+        Catch a (re)connecting client up to the current version: (frames,
+        resumed). When Last-Event-ID cannot be resumed from - older than the
+        history, or ahead of the current version because it was handed out
+        before a restart - the client gets a full snapshot instead.
+        """
+        if last_version is not None:
+            if delta:
+                caught_up = await sync_to_async(iot_data_store.changes_since)(last_version)
+                if caught_up is not None:
+                    version, changes, removed = caught_up
+                    if version > last_version:
+                        return [LiveUpdate(version, None, None, changes, removed)], True
+                    return [], True
+            else:
+                backlog = await sync_to_async(iot_data_store.updates_since)(last_version)
+                if backlog is not None:
+                    return [LiveUpdate(*entry) for entry in backlog if entry[2]], True
+        current, entries = await sync_to_async(iot_data_store.history_entries)(1)
+        return [LiveUpdate(*entry) for entry in entries if entry[2]], False
+
+    async def event_stream():
+        # Subscribe before reading history so no update falls in between
+        subscription = sse_broadcaster.subscribe()
+        try:
+            frames, resumed = await initial_frames()
+            # A snapshot restarts the client's version, which may go backwards
+            sent_version = last_version if resumed else 0
+            for update in frames:
+                if update.version > sent_version:
+                    # Catch-up frames are full snapshots unless they carry a merged delta
+                    yield update.sse_frame(delta=update.services is None)
+                    sent_version = update.version
+
+            while True:
+                try:
+                    update = await subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield SSE_HEARTBEAT
+                    continue
+                if update is None:
+                    # Slow consumer - tell the client, which reconnects with Last-Event-ID
+                    yield format_sse_event(sent_version, {"type": "dropped", "reason": "slow_consumer"}, event="dropped")
+                    return
+                if update.durable:
+                    yield update.sse_frame()
+                elif update.version > sent_version:
+                    yield update.sse_frame(delta=delta)
+                    sent_version = update.version
+        finally:
+            sse_broadcaster.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
     response['Cache-Control'] = 'no-cache'
-    response['Connection'] = 'keep-alive'
     response['X-Accel-Buffering'] = 'no'  # Disable buffering for nginx
     return response
 
@@ -367,7 +399,7 @@ def stream_iot_data(request):
 @require_http_methods(["GET"]) 
 def health_check(request):
     """Health check with performance metrics"""
-    snapshot = iot_data_store.get_snapshot()
+    snapshot = iot_data_store.get_snapshot(include_history=False)
     services_data = snapshot['services']
     data_health = "healthy" if services_data else "no_data"
     queue_health = "normal" if snapshot['queue_size'] < 100 else "high_load"
@@ -380,10 +412,12 @@ def health_check(request):
             "queue_health": queue_health,
             "queue_size": snapshot['queue_size'],
             "queue_max_size": iot_data_store.data_queue.maxsize,
+            "ingest_mode": coalesce.INGEST_MODE,
+            "upstream_circuit": upstream_gateway.breaker.state,
             "processing_thread": processor_thread.is_alive(),
             "stored_services": len(services_data),
             "stored_assets": sum(len(service.get('assets', [])) for service in services_data),
-            "websocket_clients": snapshot['websocket_clients']
+            "websocket_clients": len(snapshot['websocket_clients'])
         },
         "capabilities": {
             "max_frequency": "10ms+",
@@ -397,7 +431,7 @@ def health_check(request):
 @require_http_methods(["GET"])
 def debug_info(request):
     """Debug endpoint with performance metrics"""
-    snapshot = iot_data_store.get_snapshot()
+    snapshot = iot_data_store.get_snapshot(include_history=False)
     current_services = snapshot['services']
     
     return JsonResponse({
@@ -407,9 +441,12 @@ def debug_info(request):
             "queue_max": iot_data_store.data_queue.maxsize,
             "processing_thread_alive": processor_thread.is_alive(),
             "last_updated": snapshot['last_updated'],
-            "history_count": len(snapshot['history']),
-            "websocket_clients": snapshot['websocket_clients']
+            "history_count": snapshot['history_count'],
+            "websocket_clients": len(snapshot['websocket_clients'])
         },
+        "ingest": coalesce.ingest_metrics(iot_data_store.data_queue),
+        "config_proxy": crane_config.get_metrics(),
+        "db_writer": db_writer.get_metrics(),
         "current_data": {
             "services_count": len(current_services),
             "total_assets": sum(len(service.get('assets', [])) for service in current_services),
@@ -425,12 +462,63 @@ def debug_info(request):
         "timestamp": datetime.now().isoformat() + 'Z'
     })
 
+@require_http_methods(["GET"])
+async def profile_worker(request):
+    """
+    Sample this worker's stacks for a bounded window and return them as a
+    collapsed-stack file (flamegraph.pl / speedscope). Staff session or
+    X-Profile-Token (IOT_PROFILE_TOKEN) only.
+
+    ?seconds=10 (up to IOT_PROFILE_MAX_SECONDS), ?target=processor|requests|all,
+    ?interval_ms=5, ?idle=1 to keep samples of threads waiting for work.
+    """
+    token = request.headers.get('X-Profile-Token', '')
+    if not (profiling.PROFILE_TOKEN and hmac.compare_digest(token, profiling.PROFILE_TOKEN)):
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return JsonResponse({
+                "success": False,
+                "error": "Staff login or X-Profile-Token required",
+                "timestamp": datetime.now().isoformat() + 'Z'
+            }, status=403)
+    
+    try:
+        seconds = float(request.GET.get('seconds', profiling.PROFILE_DEFAULT_SECONDS))
+        interval_ms = float(request.GET.get('interval_ms', profiling.PROFILE_DEFAULT_INTERVAL_MS))
+        if not (0 < seconds and 1 <= interval_ms <= 1000):
+            raise ValueError("seconds must be positive and interval_ms between 1 and 1000")
+        # Sampled on an executor thread, so the event loop keeps serving
+        profiler = await asyncio.to_thread(
+            profiling.profile, seconds, request.GET.get('target', 'all'),
+            interval_ms / 1000, request.GET.get('idle') in ('1', 'true')
+        )
+    except profiling.ProfilerBusy as e:
+        return JsonResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=409)
+    except ValueError as e:
+        return JsonResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=400)
+    
+    response = HttpResponse(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+    response['Content-Disposition'] = (
+        f'attachment; filename="profile-{profiler.target}-{os.getpid()}-{datetime.now():%Y%m%dT%H%M%S}.collapsed"'
+    )
+    response['X-Profile-Pid'] = str(os.getpid())
+    response['X-Profile-Samples'] = str(profiler.samples)
+    return response
+
 @require_http_methods(["GET"])
 def get_iot_data_history(request):
     """Get historical IoT data"""
     limit = min(int(request.GET.get('limit', 10)), 50)
-    snapshot = iot_data_store.get_snapshot()
-    history = snapshot['history'][-limit:]
+    _, entries = iot_data_store.history_entries(limit)
+    history = [services for _, _, services in entries]
     
     return JsonResponse({
         "success": True,
@@ -439,55 +527,150 @@ def get_iot_data_history(request):
         "timestamp": datetime.now().isoformat() + 'Z'
     })
 
-# ==================== CONFIGURATION ENDPOINTS ====================
+@require_http_methods(["GET"])
+def get_asset_stats(request, service_name, asset_id):
+    """
+    Rolling statistics over one asset's recent samples (IOT_ASSET_STATS_DEPTH /
+    IOT_ASSET_STATS_WINDOW_SECONDS): /api/assets/<service>/<id>/stats?samples=N
+    """
+    try:
+        samples = max(int(request.GET.get('samples', 0)), 0)
+    except ValueError:
+        return JsonResponse({
+            "success": False,
+            "error": "'samples' must be an integer",
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=400)
+    
+    stats = asset_stats.stats(service_name, asset_id, samples)
+    if stats is None:
+        return JsonResponse({
+            "success": False,
+            "error": f"No samples for asset '{asset_id}' of service '{service_name}'",
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=404)
+    
+    return JsonResponse({
+        "success": True,
+        "service": service_name,
+        "asset": asset_id,
+        "window": {
+            "depth": asset_stats.depth,
+            "seconds": asset_stats.window_seconds or None
+        },
+        "data": stats,
+        "timestamp": datetime.now().isoformat() + 'Z'
+    })
+
+@require_http_methods(["GET"])
+async def get_dashboard(request, section='summary'):
+    """
+    Incrementally maintained dashboard figures - summary, services, energy,
+    load or operations - as a small ETag-tagged body
+    """
+    if section not in DASHBOARD_SECTIONS:
+        return JsonResponse({
+            "success": False,
+            "error": f"Unknown section '{section}' (choose from {', '.join(DASHBOARD_SECTIONS)})",
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=404)
+    
+    cached = dashboard_aggregates.encoded(section)
+    if etag_matches(request.headers.get('If-None-Match'), cached.etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(cached.body, content_type='application/json')
+    response['ETag'] = cached.etag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 @require_http_methods(["GET"])
-def get_crane_config_proxy(request):
-    """GET config from Flask server"""
+def get_alerts(request):
+    """Rules currently firing in this worker, plus the most recent persisted transitions"""
     try:
-        response = requests.get(
-            f"{EXTERNAL_SERVER_GET_BASE_URL}/api/crane-config",
-            timeout=3,
-            headers={'Content-Type': 'application/json'}
-        )
-        
-        if response.status_code == 200:
-            external_data = response.json()
-            return JsonResponse({
-                "success": True,
-                "data": external_data.get('data', external_data),
-                "source": "flask_server",
-                "timestamp": datetime.now().isoformat() + 'Z'
-            })
-        else:
-            return JsonResponse({
-                "success": False,
-                "error": f"Flask server returned {response.status_code}",
-                "timestamp": datetime.now().isoformat() + 'Z'
-            }, status=response.status_code)
-            
-    except Exception as e:
+        limit = min(max(int(request.GET.get('limit', 50)), 0), 500)
+    except ValueError:
         return JsonResponse({
             "success": False,
-            "error": f"Connection error: {str(e)}",
+            "error": "'limit' must be an integer",
             "timestamp": datetime.now().isoformat() + 'Z'
-        }, status=503)
+        }, status=400)
+    
+    events = AlertEvent.objects.select_related('rule__service')[:limit]
+    return JsonResponse({
+        "success": True,
+        "active": rule_engine.active_alerts(),
+        "events": [
+            {
+                "rule_id": event.rule_id,
+                "rule": event.rule.name,
+                "severity": event.rule.severity,
+                "service": event.rule.service.name,
+                "id": event.rule.asset_id,
+                "state": event.state,
+                "value": event.value,
+                "message": event.message,
+                "triggered_at": event.triggered_at.isoformat().replace('+00:00', 'Z')
+            }
+            for event in events
+        ],
+        "timestamp": datetime.now().isoformat() + 'Z'
+    })
+
+@require_http_methods(["GET"])
+async def get_timeseries(request):
+    """
+    Bucketed history from the database:
+    /api/timeseries?service=&asset=&from=&to=&step=&agg=min|max|avg|last|count
+    """
+    try:
+        query = await sync_to_async(TimeseriesQuery.from_params)(request.GET)
+    except TimeseriesQueryError as e:
+        return JsonResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=e.status)
+    
+    # Streamed in chunks straight from the cursor - never materialized whole
+    return StreamingHttpResponse(query.stream_json(), content_type='application/json')
+
+# ==================== CONFIGURATION ENDPOINTS ====================
+
+@require_http_methods(["GET"])
+async def get_crane_config_proxy(request):
+    """
+    GET config from Flask server - served from the cached proxy (see
+    config_proxy): from memory while fresh, and while stale as the last
+    good copy during a background revalidation. Upstream calls run on the
+    gateway's own loop, so a slow or dead Flask server holds no worker.
+    """
+    entry, cache_state = await crane_config.get()
+    if entry.status == 503:
+        metrics.REJECTIONS.labels('proxy_config').inc()
+    if entry.status == 200 and etag_matches(request.headers.get('If-None-Match'), entry.etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(entry.body, status=entry.status, content_type='application/json')
+    if entry.status == 200:
+        response['ETag'] = entry.etag
+        response['Age'] = str(int(entry.age()))
+    response['Cache-Control'] = 'no-cache'
+    response['X-Cache'] = cache_state
+    return response
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def update_crane_config_proxy(request):
+async def update_crane_config_proxy(request):
     """POST config to Flask server"""
     try:
         data = json.loads(request.body)
         
-        response = requests.post(
-            f"{EXTERNAL_SERVER_GET_BASE_URL}/api/crane-config",
-            json=data,
-            headers={'Content-Type': 'application/json'},
-            timeout=3
-        )
+        # Sent through the upstream gateway; once accepted the cached
+        # config is dropped so the next read fetches the new one
+        status_code = await crane_config.update(data)
             
-        if response.status_code == 200:
+        if status_code == 200:
             return JsonResponse({
                 "success": True,
                 "message": "Data forwarded to Flask server",
@@ -496,13 +679,26 @@ def update_crane_config_proxy(request):
         else:
             return JsonResponse({
                 "success": False,
-                "error": f"Flask server returned {response.status_code}",
+                "error": f"Flask server returned {status_code}",
                 "timestamp": datetime.now().isoformat() + 'Z'
-            }, status=response.status_code)
+            }, status=status_code)
             
+    except UpstreamError as e:
+        # Includes an open circuit: answered at once, without calling upstream
+        metrics.REJECTIONS.labels('proxy_config_update').inc()
+        return JsonResponse({
+            "success": False,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat() + 'Z'
+        }, status=e.status)
     except Exception as e:
         return JsonResponse({
             "success": False,
             "error": f"Connection error: {str(e)}",
             "timestamp": datetime.now().isoformat() + 'Z'
-        }, status=503)
\ No newline at end of file
+        }, status=503)
+
+@require_http_methods(["GET"])
+def prometheus_metrics(request):
+    """Counters, histograms and gauges of all workers in Prometheus text format"""
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,125 @@
+# websocket.py - Raw ASGI WebSocket endpoint for live IoT data fan-out
+from urllib.parse import parse_qs
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+
+from .streaming import UpdateBroadcaster, LiveUpdate, parse_filter, SSE_CLIENT_QUEUE_SIZE
+
+WEBSOCKET_PATH = '/api/ws/iot-data'
+
+# ==================== CONNECTION HANDLING ====================
+
+class WebSocketConnection:
+    """One client: a bounded, conflating send queue drained by a sender task"""
+    def __init__(self, scope, receive, send, broadcaster, store):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.broadcaster = broadcaster
+        self.store = store
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.filter = parse_filter(
+            [s for value in query.get('services', []) for s in value.split(',')],
+            [a for value in query.get('assets', []) for a in value.split(',')]
+        )
+        self.delta = query.get('delta', [''])[0] in ('1', 'true')
+        self.sent_version = 0
+        # Deltas only chain while every update reaches the client; after the
+        # send queue conflates, the next message must be a full snapshot
+        self.needs_full = True
+        self.conflated_seen = 0
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        # Subscribe before reading the snapshot so no update falls in between
+        subscription = self.broadcaster.subscribe()
+        self.store.add_websocket_client(self)
+        sender = asyncio.create_task(self._send_updates(subscription))
+        try:
+            await self._send_snapshot()
+            await self._receive_messages()
+        finally:
+            sender.cancel()
+            self.broadcaster.unsubscribe(subscription)
+            self.store.remove_websocket_client(self)
+
+    async def _send_snapshot(self):
+        current, entries = await sync_to_async(self.store.history_entries)(1)
+        if entries:
+            version, timestamp, services_data = entries[-1]
+            await self._send_update(LiveUpdate(version, timestamp, services_data))
+
+    async def _send_update(self, update):
+        if update.durable:
+            text = update.encode(self.filter)
+            if text is not None:
+                await self.send({'type': 'websocket.send', 'text': text})
+            return
+        if update.version <= self.sent_version:
+            return
+        self.sent_version = update.version
+        text = update.encode(self.filter, delta=self.delta and not self.needs_full)
+        self.needs_full = False
+        if text is not None:
+            await self.send({'type': 'websocket.send', 'text': text})
+
+    async def _send_updates(self, subscription):
+        try:
+            while True:
+                update = await subscription.get()
+                if subscription.conflated != self.conflated_seen:
+                    self.conflated_seen = subscription.conflated
+                    self.needs_full = True
+                await self._send_update(update)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ WebSocket send error: {e}")
+
+    async def _receive_messages(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive' or not message.get('text'):
+                continue
+            try:
+                request = json.loads(message['text'])
+            except json.JSONDecodeError:
+                await self._send_error("Invalid JSON format")
+                continue
+            if request.get('type') == 'subscribe':
+                self.filter = parse_filter(request.get('services'), request.get('assets'))
+                self.delta = bool(request.get('delta', self.delta))
+                # Re-send the current state through the new filter
+                self.sent_version = 0
+                self.needs_full = True
+                await self._send_snapshot()
+            elif request.get('type') == 'ping':
+                await self.send({'type': 'websocket.send', 'text': json.dumps({"type": "pong"})})
+            else:
+                await self._send_error(f"Unknown message type: {request.get('type')}")
+
+    async def _send_error(self, error):
+        await self.send({'type': 'websocket.send', 'text': json.dumps({"type": "error", "error": error})})
+
+
+# Process-wide broadcaster feeding /api/ws/iot-data. Each update is a full
+# state, so a client that falls behind only needs the newest one.
+websocket_broadcaster = UpdateBroadcaster(queue_size=SSE_CLIENT_QUEUE_SIZE, conflate=True)
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for WebSocket connections"""
+    from .views import iot_data_store
+
+    if scope['path'].rstrip('/') != WEBSOCKET_PATH:
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await WebSocketConnection(scope, receive, send, websocket_broadcaster, iot_data_store).run()
@@ -80,6 +80,8 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
 # For better performance with Gunicorn
 WSGI_APPLICATION = 'backend_project.wsgi.application'
+# Served by Gunicorn with Uvicorn workers so streaming endpoints are async
+ASGI_APPLICATION = 'backend_project.asgi.application'
 
 
 # Database
@@ -89,17 +91,217 @@ import os
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db/db.sqlite3'),
+        # IOT_DB_PATH points a run elsewhere (e.g. the benchmarks' scratch database)
+        'NAME': os.environ.get('IOT_DB_PATH', os.path.join(BASE_DIR, 'db/db.sqlite3')),
         'OPTIONS': {
             'timeout': 20,
+            # Take the write lock when a transaction starts instead of failing
+            # to upgrade a read lock mid-transaction
+            'transaction_mode': 'IMMEDIATE',
+            # WAL lets readers (admin, history, timeseries) run alongside the
+            # writer; NORMAL sync is durable across app crashes in WAL mode.
+            # mmap_size is 256 MB, cache_size -65536 is 64 MB.
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
         }
     }
 }
 
+# IOT_DB_ENGINE=postgresql switches to PostgreSQL (needs psycopg or psycopg2);
+# incoming_assets is then partitioned by day and loaded with COPY
+IOT_DB_ENGINE = os.environ.get('IOT_DB_ENGINE', 'sqlite')
+if IOT_DB_ENGINE == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'iot'),
+        'USER': os.environ.get('POSTGRES_USER', 'iot'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
 # Reduce connection lifetime
 CONN_MAX_AGE = 60  # 1 minute instead of default
 
 
+# IoT ingest pipeline
+# Payloads are drained from the processing queue in batches of up to
+# IOT_INGEST_BATCH_SIZE, or whatever arrived within IOT_INGEST_FLUSH_INTERVAL_MS,
+# and written in a single transaction.
+IOT_INGEST_BATCH_SIZE = int(os.environ.get('IOT_INGEST_BATCH_SIZE', 200))
+IOT_INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('IOT_INGEST_FLUSH_INTERVAL_MS', 50))
+# Overload behaviour:
+#   'fifo'     - every payload reaches the live state in order; 503 once 1000 are queued
+#   'coalesce' - once more than IOT_COALESCE_THRESHOLD payloads wait, up to
+#                IOT_COALESCE_MAX_BATCH of them become one live update with the
+#                newest reading per asset (all are still persisted); beyond
+#                IOT_COALESCE_BACKLOG waiting payloads the oldest are dropped
+IOT_INGEST_MODE = os.environ.get('IOT_INGEST_MODE', 'fifo')
+IOT_COALESCE_THRESHOLD = int(os.environ.get('IOT_COALESCE_THRESHOLD', IOT_INGEST_BATCH_SIZE))
+IOT_COALESCE_MAX_BATCH = int(os.environ.get('IOT_COALESCE_MAX_BATCH', 2000))
+IOT_COALESCE_BACKLOG = int(os.environ.get('IOT_COALESCE_BACKLOG', 50000))
+# Worker processes that normalize payloads (parse timestamps, build rows),
+# sharded by service name; the processor thread then only commits, in order.
+# 0 normalizes on the processor thread.
+IOT_INGEST_WORKERS = int(os.environ.get('IOT_INGEST_WORKERS', 0))
+IOT_INGEST_MAX_IN_FLIGHT = int(os.environ.get('IOT_INGEST_MAX_IN_FLIGHT', 0))
+
+# Live state (latest payload + history) shared by the gunicorn workers:
+#   'local'         - per-process memory (single worker / development)
+#   'shared_memory' - mmap-backed segment at IOT_LIVE_STATE_PATH, one history
+#                     slot per version (IOT_LIVE_STATE_SLOT_BYTES to start with,
+#                     doubled whenever an update does not fit)
+#   'broker'        - `manage.py run_live_state_broker` on IOT_LIVE_STATE_SOCKET
+IOT_LIVE_STATE_BACKEND = os.environ.get('IOT_LIVE_STATE_BACKEND', 'local')
+IOT_LIVE_STATE_PATH = os.environ.get('IOT_LIVE_STATE_PATH', '/dev/shm/iot_live_state')
+IOT_LIVE_STATE_SLOT_BYTES = int(os.environ.get('IOT_LIVE_STATE_SLOT_BYTES', 128 * 1024))
+IOT_LIVE_STATE_SOCKET = os.environ.get('IOT_LIVE_STATE_SOCKET', '/tmp/iot_live_state.sock')
+# Versions the 'local' backend keeps as compact typed rows - this bounds
+# /api/iot-data/history, SSE Last-Event-ID resume and ?since= deltas
+IOT_LIVE_HISTORY_SIZE = int(os.environ.get('IOT_LIVE_HISTORY_SIZE', 1000))
+
+# Per-asset sample windows for /api/assets/<service>/<id>/stats: at most
+# IOT_ASSET_STATS_DEPTH samples per asset, further limited to the last
+# IOT_ASSET_STATS_WINDOW_SECONDS of sample time when non-zero
+IOT_ASSET_STATS_DEPTH = int(os.environ.get('IOT_ASSET_STATS_DEPTH', 600))
+IOT_ASSET_STATS_WINDOW_SECONDS = float(os.environ.get('IOT_ASSET_STATS_WINDOW_SECONDS', 0))
+
+# Alert rules (AlertRule in the admin) evaluated on every live update; rules
+# edited through another worker are picked up within IOT_RULES_RELOAD_SECONDS
+IOT_RULES_ENABLED = os.environ.get('IOT_RULES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+IOT_RULES_RELOAD_SECONDS = int(os.environ.get('IOT_RULES_RELOAD_SECONDS', 30))
+
+# Dashboard aggregates (/api/dashboard/<section>): power assets (kW) integrated
+# into kWh, the load-cell and onboard-io services, and the longest gap
+# between power readings that is still integrated across
+IOT_DASHBOARD_POWER_ASSETS = {
+    'modbus': ['Hoist_power', 'Ct_power', 'Lt_power'],
+}
+IOT_DASHBOARD_LOAD_SERVICE = os.environ.get('IOT_DASHBOARD_LOAD_SERVICE', 'LoadCell')
+IOT_DASHBOARD_OPERATION_SERVICE = os.environ.get('IOT_DASHBOARD_OPERATION_SERVICE', 'onboard_io')
+IOT_DASHBOARD_MAX_GAP_SECONDS = int(os.environ.get('IOT_DASHBOARD_MAX_GAP_SECONDS', 300))
+
+# Server-Sent Events: idle heartbeat interval and per-client buffered events
+# before a slow consumer is dropped (it then resumes via Last-Event-ID)
+IOT_SSE_HEARTBEAT_SECONDS = int(os.environ.get('IOT_SSE_HEARTBEAT_SECONDS', 15))
+IOT_SSE_CLIENT_QUEUE_SIZE = int(os.environ.get('IOT_SSE_CLIENT_QUEUE_SIZE', 64))
+
+# Upstream Flask server behind /api/proxy/config, called from an async client
+# on its own event loop over a pool of IOT_UPSTREAM_POOL_SIZE keep-alive
+# connections, at most IOT_UPSTREAM_MAX_CONCURRENCY calls at a time. After
+# IOT_UPSTREAM_BREAKER_FAILURES failures in a row the circuit opens and calls
+# fail fast for IOT_UPSTREAM_BREAKER_RESET_SECONDS. The crane config is served
+# from memory for IOT_CRANE_CONFIG_TTL_SECONDS, then for up to
+# IOT_CRANE_CONFIG_STALE_SECONDS more while it is revalidated in the background
+IOT_UPSTREAM_BASE_URL = os.environ.get('IOT_UPSTREAM_BASE_URL', 'http://172.28.176.174:5000')
+IOT_UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get('IOT_UPSTREAM_TIMEOUT_SECONDS', 3))
+IOT_UPSTREAM_POOL_SIZE = int(os.environ.get('IOT_UPSTREAM_POOL_SIZE', 10))
+IOT_UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('IOT_UPSTREAM_MAX_CONCURRENCY', 10))
+IOT_UPSTREAM_BREAKER_FAILURES = int(os.environ.get('IOT_UPSTREAM_BREAKER_FAILURES', 5))
+IOT_UPSTREAM_BREAKER_RESET_SECONDS = float(os.environ.get('IOT_UPSTREAM_BREAKER_RESET_SECONDS', 30))
+IOT_CRANE_CONFIG_TTL_SECONDS = float(os.environ.get('IOT_CRANE_CONFIG_TTL_SECONDS', 5))
+IOT_CRANE_CONFIG_STALE_SECONDS = float(os.environ.get('IOT_CRANE_CONFIG_STALE_SECONDS', 300))
+
+# /metrics: every process writes its counters and histograms to
+# IOT_METRICS_DIR/<pid>.json each IOT_METRICS_FLUSH_SECONDS and the endpoint
+# sums them (empty IOT_METRICS_DIR: this process only). The ingest loop logs
+# one JSON line per event and IOT_LOG_SAMPLE_SECONDS, with totals in between.
+IOT_METRICS_DIR = os.environ.get('IOT_METRICS_DIR', '/dev/shm/iot_metrics')
+IOT_METRICS_FLUSH_SECONDS = float(os.environ.get('IOT_METRICS_FLUSH_SECONDS', 1))
+IOT_LOG_SAMPLE_SECONDS = float(os.environ.get('IOT_LOG_SAMPLE_SECONDS', 10))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.environ.get('IOT_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# /api/debug/profile samples one worker's stacks for at most
+# IOT_PROFILE_MAX_SECONDS; staff sessions, or scripts sending IOT_PROFILE_TOKEN
+# in X-Profile-Token (empty: staff only)
+IOT_PROFILE_MAX_SECONDS = int(os.environ.get('IOT_PROFILE_MAX_SECONDS', 60))
+IOT_PROFILE_TOKEN = os.environ.get('IOT_PROFILE_TOKEN', '')
+
+# /api/timeseries limits: buckets per series (the step is widened to fit) and
+# series per request (more asset ids are refused; without an asset filter the
+# first ones by id are returned, with "truncated": true)
+IOT_TIMESERIES_MAX_POINTS = int(os.environ.get('IOT_TIMESERIES_MAX_POINTS', 5000))
+IOT_TIMESERIES_MAX_SERIES = int(os.environ.get('IOT_TIMESERIES_MAX_SERIES', 50))
+
+# Retention: max age in seconds per table (0/None keeps rows forever). Rows are
+# pruned every IOT_RETENTION_INTERVAL_SECONDS in chunks of IOT_RETENTION_CHUNK_ROWS
+# by one worker; rollups are kept forever by default. The background pruner is
+# off unless IOT_RETENTION_ENABLED is set - deleting history is a deploy-time
+# choice (`manage.py prune_data --dry-run` shows what it would remove).
+IOT_RETENTION_POLICIES = {
+    'incoming_iot_data': int(os.environ.get('IOT_RETAIN_RAW_PAYLOADS_SECONDS', 24 * 3600)),
+    'incoming_assets': int(os.environ.get('IOT_RETAIN_ASSETS_SECONDS', 30 * 86400)),
+    'asset_rollups_1s': int(os.environ.get('IOT_RETAIN_ROLLUPS_1S_SECONDS', 0)),
+    'asset_rollups_1m': int(os.environ.get('IOT_RETAIN_ROLLUPS_1M_SECONDS', 0)),
+    'asset_rollups_1h': int(os.environ.get('IOT_RETAIN_ROLLUPS_1H_SECONDS', 0)),
+}
+IOT_RETENTION_ENABLED = os.environ.get('IOT_RETENTION_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+IOT_RETENTION_INTERVAL_SECONDS = int(os.environ.get('IOT_RETENTION_INTERVAL_SECONDS', 300))
+IOT_RETENTION_CHUNK_ROWS = int(os.environ.get('IOT_RETENTION_CHUNK_ROWS', 2000))
+IOT_RETENTION_CHUNK_PAUSE_MS = int(os.environ.get('IOT_RETENTION_CHUNK_PAUSE_MS', 50))
+# Pages handed back to the filesystem per pass with PRAGMA incremental_vacuum
+# (needs `manage.py prune_data --enable-incremental-vacuum` once); 0 disables
+IOT_RETENTION_VACUUM_PAGES = int(os.environ.get('IOT_RETENTION_VACUUM_PAGES', 0))
+
+# Database writes:
+#   'local'   - each worker commits its own batches (single worker / development)
+#   'process' - `manage.py run_db_writer` on IOT_DB_WRITER_SOCKET owns all writes
+#               and merges concurrent batches, up to IOT_DB_WRITER_MAX_BATCH
+#               payloads, into one commit
+IOT_DB_WRITER = os.environ.get('IOT_DB_WRITER', 'local')
+IOT_DB_WRITER_SOCKET = os.environ.get('IOT_DB_WRITER_SOCKET', '/tmp/iot_db_writer.sock')
+IOT_DB_WRITER_MAX_BATCH = int(os.environ.get('IOT_DB_WRITER_MAX_BATCH', 1000))
+
+# Storage backend for ingest batches: 'auto' (by database vendor), 'sqlite'
+# (ORM bulk_create) or 'postgresql' (COPY into daily incoming_assets partitions,
+# created IOT_PARTITION_DAYS_AHEAD days in advance)
+IOT_STORAGE_BACKEND = os.environ.get('IOT_STORAGE_BACKEND', 'auto')
+IOT_PARTITION_DAYS_AHEAD = int(os.environ.get('IOT_PARTITION_DAYS_AHEAD', 7))
+
+# MQTT ingest bridge (`manage.py run_mqtt_bridge`). IOT_MQTT_TOPICS is a
+# comma-separated list of patterns; a {service} level, e.g. 'plant/{service}/data',
+# names the service for payloads without one. QoS 1/2 messages are acknowledged
+# only after their batch is committed.
+IOT_MQTT_HOST = os.environ.get('IOT_MQTT_HOST', 'localhost')
+IOT_MQTT_PORT = int(os.environ.get('IOT_MQTT_PORT', 1883))
+IOT_MQTT_USERNAME = os.environ.get('IOT_MQTT_USERNAME', '')
+IOT_MQTT_PASSWORD = os.environ.get('IOT_MQTT_PASSWORD', '')
+IOT_MQTT_CLIENT_ID = os.environ.get('IOT_MQTT_CLIENT_ID', 'iot-ingest-bridge')
+IOT_MQTT_TOPICS = [t for t in os.environ.get('IOT_MQTT_TOPICS', 'iot/#').split(',') if t]
+IOT_MQTT_QOS = int(os.environ.get('IOT_MQTT_QOS', 1))
+# Payloads whose own data cannot be written (a database that is down is retried
+# instead) are appended here as JSON lines and acknowledged
+IOT_MQTT_DEAD_LETTER_PATH = os.environ.get('IOT_MQTT_DEAD_LETTER_PATH', '')
+
+# /api/iot-data/receive/batch: payloads per request and the decompressed body
+# limit (the compressed body is still bounded by DATA_UPLOAD_MAX_MEMORY_SIZE).
+# MessagePack needs `msgpack`, zstd needs `zstandard`.
+IOT_BATCH_MAX_PAYLOADS = int(os.environ.get('IOT_BATCH_MAX_PAYLOADS', 5000))
+IOT_BATCH_MAX_DECODED_BYTES = int(os.environ.get('IOT_BATCH_MAX_DECODED_BYTES', 64 * 1024 * 1024))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
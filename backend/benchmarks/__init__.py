@@ -0,0 +1,12 @@
+"""
+End-to-end benchmark suite: simulated crane gateways posting payloads and
+live-data consumers (SSE, WebSocket, polling) against a local server.
+
+    python -m benchmarks --server uvicorn --gateways 20 --rate 10 --sse 50 --ws 50 --pollers 5
+    python -m benchmarks --url http://127.0.0.1:8000 --db-path db/db.sqlite3
+    python -m benchmarks --compare results/old.json results/new.json
+
+Run from the backend directory. Every run starts from an empty scratch
+database (unless --url is given) with a fixed, seeded workload, and the
+result JSON records the git commit so runs can be compared across commits.
+"""
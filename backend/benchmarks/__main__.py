@@ -0,0 +1,227 @@
+# __main__.py - python -m benchmarks: run the end-to-end benchmark, or compare two runs
+import argparse
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from . import report
+from .consumers import KINDS, PollingConsumer, SSEConsumer, WebSocketConsumer
+from .gateways import Gateway, SendLog
+from .server import SERVERS, LocalServer, database_bytes, process_tree, rss_bytes
+
+MB = 1024 * 1024
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='End-to-end gateway and live-consumer benchmark')
+    target = parser.add_argument_group('server')
+    target.add_argument('--server', choices=SERVERS, default='uvicorn', help='Local server to start (default: uvicorn)')
+    target.add_argument('--workers', type=int, default=2, help='Worker processes for --server gunicorn')
+    target.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the started server, e.g. IOT_INGEST_MODE=coalesce')
+    target.add_argument('--url', help='Benchmark an already running server instead of starting one')
+    target.add_argument('--db-path', help='Database file of the --url server, for the growth figures')
+    target.add_argument('--server-pid', type=int, help='Process of the --url server, for the memory figures')
+
+    workload = parser.add_argument_group('workload')
+    workload.add_argument('--gateways', type=int, default=10, help='Simulated gateways (default: 10)')
+    workload.add_argument('--rate', type=float, default=5.0, help='Payloads per second per gateway (default: 5)')
+    workload.add_argument('--services', type=int, default=2, help='Services per payload (default: 2)')
+    workload.add_argument('--assets', type=int, default=10, help='Assets per service (default: 10)')
+    workload.add_argument('--sse', type=int, default=10, help='SSE consumers (default: 10)')
+    workload.add_argument('--ws', type=int, default=10, help='WebSocket consumers (default: 10)')
+    workload.add_argument('--pollers', type=int, default=2, help='Polling consumers (default: 2)')
+    workload.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls (default: 1)')
+    workload.add_argument('--delta', action='store_true', help='Stream consumers subscribe with delta=1')
+    workload.add_argument('--duration', type=float, default=30.0, help='Measured seconds (default: 30)')
+    workload.add_argument('--warmup', type=float, default=5.0, help='Unmeasured seconds first (default: 5)')
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--output', '-o', help='Write the result JSON here')
+    output.add_argument('--keep', action='store_true', help="Keep the started server's scratch directory")
+    output.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files and exit')
+    args = parser.parse_args(argv)
+    if args.gateways < 1 or args.rate <= 0 or args.services < 1 or args.assets < 1 or args.duration <= 0:
+        parser.error('--gateways, --rate, --services, --assets and --duration must be positive')
+    try:
+        args.env = dict(item.split('=', 1) for item in args.env)
+    except ValueError:
+        parser.error('--env takes KEY=VALUE')
+    return args
+
+def workload_config(args, server_kind):
+    """Everything that shapes the load; runs are comparable when these match"""
+    return {
+        'server': server_kind,
+        'workers': args.workers if server_kind == 'gunicorn' else 1,
+        'env': args.env,
+        'gateways': args.gateways,
+        'rate': args.rate,
+        'services': args.services,
+        'assets': args.assets,
+        'sse': args.sse,
+        'ws': args.ws,
+        'pollers': args.pollers,
+        'poll_interval': args.poll_interval,
+        'delta': args.delta,
+        'duration': args.duration,
+        'warmup': args.warmup,
+    }
+
+async def scrape(session, url):
+    try:
+        async with session.get(url + '/metrics') as response:
+            if response.status == 200:
+                return report.parse_metrics(await response.text())
+    except aiohttp.ClientError:
+        pass
+    return None
+
+async def sample_resources(pids, db_path, stop, samples):
+    """RSS and database size once a second until `stop`"""
+    while not stop.is_set():
+        samples.append((time.perf_counter(), rss_bytes(pids()), database_bytes(db_path)))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_benchmark(args, url, pids, db_path, streaming=True):
+    send_log = SendLog()
+    gateways = [
+        Gateway(number, url, args.rate, args.services, args.assets, send_log)
+        for number in range(args.gateways)
+    ]
+    consumers = (
+        [SSEConsumer(url, send_log, args.delta) for _ in range(args.sse if streaming else 0)]
+        + [WebSocketConsumer(url, send_log, args.delta) for _ in range(args.ws if streaming else 0)]
+        + [PollingConsumer(url, send_log, interval=args.poll_interval) for _ in range(args.pollers)]
+    )
+    if (args.sse or args.ws) and not streaming:
+        print('⚠️ This server cannot stream - SSE and WebSocket consumers skipped', file=sys.stderr)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        stop = asyncio.Event()
+        consuming = [asyncio.create_task(consumer.run(session, stop)) for consumer in consumers]
+        # Let the streams connect before the first payload
+        await asyncio.sleep(1.0)
+
+        start = time.perf_counter()
+        sending = [asyncio.create_task(gateway.run(session, start, args.warmup, args.duration)) for gateway in gateways]
+        await asyncio.sleep(max(0.0, start + args.warmup - time.perf_counter()))
+
+        for consumer in consumers:
+            consumer.recording = True
+        before = await scrape(session, url)
+        sampling_stop, samples = asyncio.Event(), []
+        sampling = asyncio.create_task(sample_resources(pids, db_path, sampling_stop, samples))
+        measured_from = time.perf_counter()
+
+        await asyncio.gather(*sending)
+        # Deliveries of the last payloads may still be on their way
+        await asyncio.sleep(1.0)
+        for consumer in consumers:
+            consumer.recording = False
+        measured = time.perf_counter() - measured_from
+        after = await scrape(session, url)
+        sampling_stop.set()
+        await sampling
+        stop.set()
+        await asyncio.gather(*consuming)
+
+    return summarize(args, gateways, consumers, samples, measured, before, after)
+
+def summarize(args, gateways, consumers, samples, measured, before, after):
+    sent = sum(g.accepted + g.busy + g.errors for g in gateways)
+    offered = sent + sum(g.skipped for g in gateways)
+    post_latencies = [latency for g in gateways for latency in g.post_latencies]
+    ingest = {
+        'offered_per_second': round(offered / args.duration, 1),
+        'accepted': sum(g.accepted for g in gateways),
+        'accepted_per_second': round(sum(g.accepted for g in gateways) / args.duration, 1),
+        'assets_per_second': round(sum(g.accepted_assets for g in gateways) / args.duration, 1),
+        'busy': sum(g.busy for g in gateways),
+        'busy_rate': round(sum(g.busy for g in gateways) / sent, 4) if sent else 0.0,
+        'errors': sum(g.errors for g in gateways),
+        'error_rate': round(sum(g.errors for g in gateways) / sent, 4) if sent else 0.0,
+        'skipped': sum(g.skipped for g in gateways),
+        'post_p50_ms': report.milliseconds(report.percentile(post_latencies, 50)),
+        'post_p99_ms': report.milliseconds(report.percentile(post_latencies, 99)),
+    }
+
+    delivery = {}
+    for kind in KINDS:
+        group = [c for c in consumers if c.kind == kind]
+        if not group:
+            continue
+        delivery[kind] = {
+            'clients': len(group),
+            **report.latency_summary([latency for c in group for latency in c.latencies]),
+            'superseded': sum(c.superseded for c in group),
+            'messages': sum(c.messages for c in group),
+            'mb_per_second': round(sum(c.bytes for c in group) / MB / measured, 2),
+            'reconnects': sum(c.reconnects for c in group),
+            'dropped': sum(getattr(c, 'dropped', 0) for c in group),
+            'errors': sum(c.errors for c in group),
+        }
+
+    rss = [sample[1] for sample in samples if sample[1] is not None]
+    sizes = [sample[2] for sample in samples if sample[2] is not None]
+    growth = (sizes[-1] - sizes[0]) / MB if len(sizes) > 1 else None
+    elapsed = samples[-1][0] - samples[0][0] if len(samples) > 1 else 0
+    resources = {
+        'rss_start_mb': round(rss[0] / MB, 1) if rss else None,
+        'rss_peak_mb': round(max(rss) / MB, 1) if rss else None,
+        'rss_end_mb': round(rss[-1] / MB, 1) if rss else None,
+        'db_start_mb': round(sizes[0] / MB, 2) if sizes else None,
+        'db_end_mb': round(sizes[-1] / MB, 2) if sizes else None,
+        'db_growth_mb': round(growth, 2) if growth is not None else None,
+        'db_growth_mb_per_minute': round(growth / elapsed * 60, 2) if growth is not None and elapsed else None,
+    }
+    server = report.server_summary(before, after, measured) if before and after else None
+    return {'ingest': ingest, 'delivery': delivery, 'resources': resources, 'server': server}
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        print(report.format_comparison(*(report.load(path) for path in args.compare)))
+        return 0
+
+    server = None
+    if args.url:
+        url, db_path, kind, streaming = args.url.rstrip('/'), args.db_path, 'external', True
+        pids = (lambda: process_tree(args.server_pid)) if args.server_pid else (lambda: [])
+    else:
+        server = LocalServer(args.server, args.workers, args.env)
+        print(f"Starting {args.server} on a scratch database in {server.directory}", file=sys.stderr)
+        server.start()
+        url, db_path, kind, streaming, pids = server.url, server.db_path, args.server, server.streaming, server.pids
+
+    total = 1.0 + args.warmup + args.duration + 1.0
+    print(f"Running {args.gateways} gateways x {args.rate}/s for {total:.0f}s against {url}", file=sys.stderr)
+    try:
+        results = asyncio.run(run_benchmark(args, url, pids, db_path, streaming))
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if server is not None:
+            server.stop(keep=args.keep)
+
+    result = {
+        'revision': report.git_revision(),
+        'config': workload_config(args, kind),
+        'host': report.host_info(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        **results,
+    }
+    print(report.format_report(result))
+    if args.output:
+        report.save(result, args.output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
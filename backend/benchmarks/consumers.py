@@ -0,0 +1,173 @@
+# consumers.py - Live-data consumers timing gateway payloads end to end
+import asyncio
+import json
+import re
+import time
+
+import aiohttp
+
+from .gateways import SEQUENCE_ASSET
+
+GATEWAY_SERVICE = re.compile(r'^bench_gw(\d+)$')
+KINDS = ('sse', 'ws', 'poll')
+# Pause before reconnecting after an error (a clean end reconnects at once)
+RETRY_SECONDS = 0.5
+
+class Consumer:
+    """
+    Base consumer: finds each gateway's 'seq' asset in what it receives
+    and, the first time a sequence number shows up, records the delay
+    since the gateway sent it. Sequence numbers that never show up
+    because a later one replaced them first (conflation, or several
+    payloads between two polls) are counted as superseded.
+    """
+    kind = None
+
+    def __init__(self, url, send_log, delta=False):
+        self.url = url
+        self.send_log = send_log
+        self.delta = delta
+        self.recording = False
+        self.latencies = []
+        self.messages = 0
+        self.bytes = 0
+        self.superseded = 0
+        self.reconnects = 0
+        self.errors = 0
+        self._seen = {}
+
+    def _observe(self, gateway, sequence, received_at):
+        last = self._seen.get(gateway, 0)
+        if sequence <= last:
+            return
+        self._seen[gateway] = sequence
+        sent_at = self.send_log.sent_at(gateway, sequence)
+        if not self.recording or sent_at is None:
+            return
+        self.latencies.append(received_at - sent_at)
+        if last:
+            self.superseded += sequence - last - 1
+
+    def _sequences(self, services=None, changes=None):
+        if services is not None:
+            for service in services:
+                match = GATEWAY_SERVICE.match(service.get('name', ''))
+                if match:
+                    for asset in service.get('assets', []):
+                        if asset.get('id') == SEQUENCE_ASSET:
+                            yield int(match.group(1)), int(asset['value'])
+                            break
+        for change in changes or ():
+            if change.get('id') == SEQUENCE_ASSET:
+                match = GATEWAY_SERVICE.match(change.get('service', ''))
+                if match:
+                    yield int(match.group(1)), int(change['value'])
+
+    def on_message(self, text, received_at):
+        if self.recording:
+            self.messages += 1
+            self.bytes += len(text)
+        message = json.loads(text)
+        if message.get('type') not in ('iot_data_update', 'iot_data_delta'):
+            # Alerts, pongs and drop notices carry no data
+            return
+        for gateway, sequence in self._sequences(message.get('services'), message.get('changes')):
+            self._observe(gateway, sequence, received_at)
+
+    async def consume(self, session):
+        raise NotImplementedError
+
+    async def run(self, session, stop):
+        """Consume until `stop` is set, reconnecting after errors"""
+        while not stop.is_set():
+            try:
+                consuming = asyncio.create_task(self.consume(session))
+                stopping = asyncio.create_task(stop.wait())
+                await asyncio.wait((consuming, stopping), return_when=asyncio.FIRST_COMPLETED)
+                if not consuming.done():
+                    consuming.cancel()
+                    await asyncio.gather(consuming, return_exceptions=True)
+                    return
+                stopping.cancel()
+                consuming.result()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                self.errors += self.recording
+                await asyncio.sleep(RETRY_SECONDS)
+            self.reconnects += self.recording
+
+class SSEConsumer(Consumer):
+    """
+    EventSource client on /api/stream/iot-data. Like a browser it resumes
+    with Last-Event-ID when the server drops it as a slow consumer.
+    """
+    kind = 'sse'
+
+    def __init__(self, url, send_log, delta=False):
+        super().__init__(url, send_log, delta)
+        self.last_event_id = None
+        self.dropped = 0
+
+    async def consume(self, session):
+        url = self.url + '/api/stream/iot-data' + ('?delta=1' if self.delta else '')
+        headers = {'Last-Event-ID': self.last_event_id} if self.last_event_id else {}
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            data, event = [], None
+            async for line in response.content:
+                line = line.rstrip(b'\r\n')
+                if not line:
+                    if event == b'dropped':
+                        self.dropped += self.recording
+                    elif data and event is None:
+                        self.on_message(b'\n'.join(data).decode('utf-8'), time.perf_counter())
+                    data, event = [], None
+                elif line.startswith(b'data:'):
+                    data.append(line[5:].lstrip())
+                elif line.startswith(b'event:'):
+                    event = line[6:].strip()
+                elif line.startswith(b'id:'):
+                    self.last_event_id = line[3:].strip().decode('ascii')
+
+class WebSocketConsumer(Consumer):
+    """WebSocket client on /api/ws/iot-data"""
+    kind = 'ws'
+
+    async def consume(self, session):
+        url = self.url.replace('http', 'ws', 1) + '/api/ws/iot-data' + ('?delta=1' if self.delta else '')
+        async with session.ws_connect(url, heartbeat=30) as ws:
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    self.on_message(message.data, time.perf_counter())
+                elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+
+class PollingConsumer(Consumer):
+    """Dashboard polling GET /api/iot-data every `interval` seconds, with If-None-Match"""
+    kind = 'poll'
+
+    def __init__(self, url, send_log, delta=False, interval=1.0):
+        super().__init__(url, send_log, delta)
+        self.interval = interval
+        self.not_modified = 0
+
+    async def consume(self, session):
+        etag = None
+        while True:
+            started = time.perf_counter()
+            headers = {'If-None-Match': etag} if etag else {}
+            async with session.get(self.url + '/api/iot-data', headers=headers) as response:
+                body = await response.read()
+                if response.status == 304:
+                    self.not_modified += self.recording
+                else:
+                    response.raise_for_status()
+                    etag = response.headers.get('ETag')
+                    received_at = time.perf_counter()
+                    if self.recording:
+                        self.messages += 1
+                        self.bytes += len(body)
+                    data = json.loads(body).get('data') or {}
+                    for gateway, sequence in self._sequences(data.get('services', [])):
+                        self._observe(gateway, sequence, received_at)
+            await asyncio.sleep(max(0.0, self.interval - (time.perf_counter() - started)))
@@ -0,0 +1,120 @@
+# gateways.py - Simulated crane gateways posting service/asset payloads
+from datetime import datetime, timedelta, timezone
+import asyncio
+import random
+import time
+
+import aiohttp
+
+# Payload shapes accepted by process_service_based_data, used in turn
+FORMATS = ('services', 'list', 'single')
+
+SEQUENCE_ASSET = 'seq'
+
+def gateway_service(gateway):
+    """Name of the service carrying a gateway's sequence numbers"""
+    return f'bench_gw{gateway}'
+
+class SendLog:
+    """Send time of every (gateway, sequence number), shared with the consumers"""
+    def __init__(self):
+        self.sent = {}
+
+    def record(self, gateway, sequence, sent_at):
+        self.sent[gateway, sequence] = sent_at
+
+    def sent_at(self, gateway, sequence):
+        return self.sent.get((gateway, sequence))
+
+class Gateway:
+    """
+    One gateway: `rate` payloads per second, open loop (sends are
+    scheduled on the clock, not after the previous response), each with
+    `services` services of `assets` assets. The first service carries the
+    payload's sequence number as asset 'seq', which the consumers use to
+    time delivery. Payload formats rotate through FORMATS ('single' only
+    with one service). Values come from a generator seeded with the
+    gateway number, so every run sends the same workload.
+    """
+    def __init__(self, number, url, rate, services, assets, send_log, max_in_flight=8):
+        self.number = number
+        self.url = url + '/api/iot-data/receive'
+        self.interval = 1.0 / rate
+        self.services = services
+        self.assets = assets
+        self.send_log = send_log
+        self.random = random.Random(number)
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.formats = [f for f in FORMATS if f != 'single' or services == 1]
+        self.sequence = 0
+        self.accepted = 0
+        self.accepted_assets = 0
+        self.busy = 0
+        self.errors = 0
+        self.skipped = 0
+        self.post_latencies = []
+        self._tasks = set()
+
+    def payload(self, sequence, now):
+        stamp = (datetime(2030, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=now * 1000)).isoformat()
+        stamp = stamp.replace('+00:00', 'Z')
+        services = []
+        for s in range(self.services):
+            name = gateway_service(self.number) if s == 0 else f'{gateway_service(self.number)}_s{s}'
+            assets = [
+                {'id': f'asset_{a}', 'value': round(self.random.uniform(0, 100), 2), 'timestamp': stamp}
+                for a in range(self.assets - (1 if s == 0 else 0))
+            ]
+            if s == 0:
+                assets.insert(0, {'id': SEQUENCE_ASSET, 'value': sequence, 'timestamp': stamp})
+            services.append({'name': name, 'assets': assets})
+        shape = self.formats[sequence % len(self.formats)]
+        if shape == 'services':
+            return {'services': services}
+        if shape == 'list':
+            return services
+        return services[0]
+
+    async def _post(self, session, sequence, body, record):
+        try:
+            sent_at = time.perf_counter()
+            self.send_log.record(self.number, sequence, sent_at)
+            async with session.post(self.url, json=body) as response:
+                await response.read()
+                if record:
+                    self.post_latencies.append(time.perf_counter() - sent_at)
+                    if response.status == 200:
+                        self.accepted += 1
+                        self.accepted_assets += self.services * self.assets
+                    elif response.status == 503:
+                        self.busy += 1
+                    else:
+                        self.errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if record:
+                self.errors += 1
+        finally:
+            self.slots.release()
+
+    async def run(self, session, start, warmup, duration):
+        """Send from `start` for warmup + duration seconds; only the measured part is counted"""
+        # Spread the gateways over one interval so they do not send in lockstep
+        next_send = start + self.random.random() * self.interval
+        end = start + warmup + duration
+        while next_send < end:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            record = next_send >= start + warmup
+            if self.slots.locked():
+                # Every connection is waiting on the server
+                self.skipped += record
+            else:
+                await self.slots.acquire()
+                self.sequence += 1
+                task = asyncio.create_task(self._post(session, self.sequence, self.payload(self.sequence, next_send), record))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            next_send += self.interval
+        if self._tasks:
+            await asyncio.wait(self._tasks)
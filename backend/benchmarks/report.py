@@ -0,0 +1,181 @@
+# report.py - Benchmark results: summary statistics, text report and run comparison
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+
+from .server import BACKEND_DIR
+
+# Metrics printed by --compare, with the direction that counts as better
+COMPARED = (
+    ('ingest.accepted_per_second', 'higher'),
+    ('ingest.assets_per_second', 'higher'),
+    ('ingest.busy_rate', 'lower'),
+    ('ingest.error_rate', 'lower'),
+    ('ingest.post_p99_ms', 'lower'),
+    ('delivery.sse.p50_ms', 'lower'),
+    ('delivery.sse.p99_ms', 'lower'),
+    ('delivery.ws.p50_ms', 'lower'),
+    ('delivery.ws.p99_ms', 'lower'),
+    ('delivery.poll.p50_ms', 'lower'),
+    ('delivery.poll.p99_ms', 'lower'),
+    ('resources.rss_peak_mb', 'lower'),
+    ('resources.db_growth_mb_per_minute', 'lower'),
+)
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values` (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+def latency_summary(latencies):
+    return {
+        'samples': len(latencies),
+        'p50_ms': milliseconds(percentile(latencies, 50)),
+        'p99_ms': milliseconds(percentile(latencies, 99)),
+        'max_ms': milliseconds(max(latencies) if latencies else None),
+    }
+
+# ==================== RUN METADATA ====================
+
+def git_revision():
+    """HEAD commit and whether the tree has uncommitted changes"""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--', '.'))}
+    except OSError:
+        return {'commit': None, 'dirty': None}
+
+def host_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'argv': sys.argv[1:],
+    }
+
+# ==================== SERVER METRICS ====================
+
+def parse_metrics(text):
+    """Prometheus text from /metrics as {'name{labels}': value}"""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            try:
+                samples[match.group(1) + (match.group(2) or '')] = float(match.group(3))
+            except ValueError:
+                continue
+    return samples
+
+def server_summary(before, after, duration):
+    """Ingest counters over the measured window, from two /metrics scrapes"""
+    def delta(name):
+        return sum(value - before.get(key, 0.0) for key, value in after.items()
+                   if key == name or key.startswith(name + '{'))
+
+    def mean_ms(name):
+        count = delta(name + '_count')
+        return milliseconds(delta(name + '_sum') / count) if count else None
+
+    payloads = delta('iot_ingest_payloads_total')
+    return {
+        'payloads_published': int(payloads),
+        'payloads_per_second': round(payloads / duration, 1),
+        'live_updates': int(delta('iot_live_updates_total')),
+        'batches': int(delta('iot_ingest_batches_total')),
+        'rejections': int(delta('iot_http_rejections_total')),
+        'db_write_errors': int(delta('iot_ingest_db_write_errors_total')),
+        'queue_wait_mean_ms': mean_ms('iot_ingest_queue_wait_seconds'),
+        'db_write_mean_ms': mean_ms('iot_ingest_db_write_seconds'),
+        'publish_latency_mean_ms': mean_ms('iot_ingest_publish_latency_seconds'),
+    }
+
+# ==================== OUTPUT ====================
+
+def lookup(result, path):
+    value = result
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def format_report(result):
+    ingest = result['ingest']
+    resources = result['resources']
+    revision = result['revision']
+    lines = [
+        f"Commit {revision['commit'] or 'unknown'}{' (dirty)' if revision['dirty'] else ''} "
+        f"on {result['config']['server']}, {result['config']['duration']}s measured",
+        '',
+        f"Ingest    {ingest['accepted_per_second']} payloads/s accepted ({ingest['assets_per_second']} assets/s) "
+        f"of {ingest['offered_per_second']} offered",
+        f"          503 rate {ingest['busy_rate']:.2%}, errors {ingest['error_rate']:.2%}, "
+        f"skipped {ingest['skipped']}, POST p50/p99 {ingest['post_p50_ms']}/{ingest['post_p99_ms']} ms",
+        '',
+        f"{'Delivery':<10}{'clients':>8}{'samples':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'superseded':>12}{'reconnects':>12}{'MB/s':>8}",
+    ]
+    for kind, delivery in result['delivery'].items():
+        lines.append(
+            f"{kind:<10}{delivery['clients']:>8}{delivery['samples']:>10}{str(delivery['p50_ms']):>10}"
+            f"{str(delivery['p99_ms']):>10}{str(delivery['max_ms']):>10}{delivery['superseded']:>12}"
+            f"{delivery['reconnects']:>12}{delivery['mb_per_second']:>8}"
+        )
+    lines += [
+        '',
+        f"Resources RSS start/peak/end {resources['rss_start_mb']}/{resources['rss_peak_mb']}/{resources['rss_end_mb']} MB, "
+        f"database +{resources['db_growth_mb']} MB ({resources['db_growth_mb_per_minute']} MB/min)",
+    ]
+    server = result.get('server')
+    if server:
+        lines.append(
+            f"Server    {server['payloads_per_second']} payloads/s published in {server['live_updates']} live updates, "
+            f"queue wait {server['queue_wait_mean_ms']} ms, DB write {server['db_write_mean_ms']} ms, "
+            f"publish {server['publish_latency_mean_ms']} ms (means)"
+        )
+    return '\n'.join(lines)
+
+def format_comparison(old, new):
+    """Side-by-side of two result files on the COMPARED metrics"""
+    def label(result):
+        revision = result.get('revision') or {}
+        return (revision.get('commit') or 'unknown')[:10] + ('+' if revision.get('dirty') else '')
+
+    lines = []
+    if old.get('config') != new.get('config'):
+        lines += ['⚠️ The runs used different workloads - the numbers are not directly comparable', '']
+    lines.append(f"{'metric':<38}{label(old):>14}{label(new):>14}{'change':>10}")
+    for path, better in COMPARED:
+        before, after = lookup(old, path), lookup(new, path)
+        if before is None and after is None:
+            continue
+        change = ''
+        if before and after is not None:
+            ratio = (after - before) / before
+            improved = ratio > 0 if better == 'higher' else ratio < 0
+            change = f"{ratio:+.1%}{' ✓' if improved and abs(ratio) >= 0.05 else ''}"
+        lines.append(f"{path:<38}{str(before):>14}{str(after):>14}{change:>10}")
+    return '\n'.join(lines)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save(result, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
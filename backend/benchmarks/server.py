@@ -0,0 +1,166 @@
+# server.py - Start the Django server on a scratch database, and watch its processes
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = ('runserver', 'uvicorn', 'gunicorn')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class LocalServer:
+    """
+    The backend in a child process group, on a migrated scratch database
+    and metrics directory in a temporary directory:
+
+    'runserver' - Django's development server (WSGI, no SSE or WebSockets)
+    'uvicorn'   - one ASGI process, as in development
+    'gunicorn'  - gunicorn.conf.py with uvicorn workers, as in production
+
+    Extra environment (IOT_* settings) is passed through `env`.
+    """
+    def __init__(self, kind='uvicorn', workers=2, env=None):
+        if kind not in SERVERS:
+            raise ValueError(f"Unknown server {kind!r} (expected one of {', '.join(SERVERS)})")
+        self.kind = kind
+        self.workers = workers
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.directory = tempfile.mkdtemp(prefix='iot-bench-')
+        self.db_path = os.path.join(self.directory, 'db.sqlite3')
+        self.log_path = os.path.join(self.directory, 'server.log')
+        self.env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'backend_project.settings',
+            'IOT_DB_PATH': self.db_path,
+            'IOT_METRICS_DIR': os.path.join(self.directory, 'metrics'),
+            'IOT_LIVE_STATE_PATH': os.path.join(self.directory, 'live_state'),
+            'IOT_LIVE_STATE_SOCKET': os.path.join(self.directory, 'live_state.sock'),
+            'IOT_DB_WRITER_SOCKET': os.path.join(self.directory, 'db_writer.sock'),
+        }
+        if kind == 'gunicorn':
+            # As entrypoint.sh: workers share one live state, so every
+            # consumer sees every gateway whichever worker serves it, and
+            # hand their database writes to one writer process
+            self.env['IOT_LIVE_STATE_BACKEND'] = 'shared_memory'
+            self.env['IOT_DB_WRITER'] = 'process'
+        self.env.update(env or {})
+        self.process = None
+        self.writer = None
+
+    @property
+    def streaming(self):
+        # The WSGI development server buffers SSE responses and has no WebSockets
+        return self.kind != 'runserver'
+
+    def _command(self):
+        if self.kind == 'runserver':
+            return [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{self.port}', '--noreload']
+        if self.kind == 'uvicorn':
+            return [sys.executable, '-m', 'uvicorn', 'backend_project.asgi:application',
+                    '--port', str(self.port), '--log-level', 'warning']
+        return [sys.executable, '-m', 'gunicorn', 'backend_project.asgi:application', '-c', 'gunicorn.conf.py',
+                '--bind', f'127.0.0.1:{self.port}', '--workers', str(self.workers)]
+
+    def start(self, timeout=60):
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+            cwd=BACKEND_DIR, env=self.env, check=True
+        )
+        deadline = time.monotonic() + timeout
+        with open(self.log_path, 'w') as log:
+            if self.env.get('IOT_DB_WRITER') == 'process':
+                self.writer = subprocess.Popen(
+                    [sys.executable, 'manage.py', 'run_db_writer'], cwd=BACKEND_DIR, env=self.env,
+                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+                )
+                while not os.path.exists(self.env['IOT_DB_WRITER_SOCKET']):
+                    if self.writer.poll() is not None or time.monotonic() > deadline:
+                        self.stop(keep=True)
+                        raise RuntimeError(f"The database writer did not start, see {self.log_path}")
+                    time.sleep(0.1)
+            self.process = subprocess.Popen(
+                self._command(), cwd=BACKEND_DIR, env=self.env,
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+            )
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.stop(keep=True)
+                raise RuntimeError(f"{self.kind} exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if requests.get(f'{self.url}/api/health', timeout=2).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop(keep=True)
+        raise RuntimeError(f"{self.kind} did not answer /api/health within {timeout}s, see {self.log_path}")
+
+    def stop(self, keep=False):
+        # The server first, so its last batches reach the writer
+        for process in (self.process, self.writer):
+            if process is not None and process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+        if not keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def pids(self):
+        return [pid for process in (self.process, self.writer) if process is not None
+                for pid in process_tree(process.pid)]
+
+# ==================== MEASUREMENTS ====================
+
+def process_tree(root):
+    """`root` and all its descendants, from /proc (Linux)"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name may hold spaces; fields resume after its ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+def rss_bytes(pids):
+    """Summed resident set size of `pids` (None where /proc is unavailable)"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total or None
+
+def database_bytes(db_path):
+    """Size of an SQLite database including its WAL file"""
+    if not db_path:
+        return None
+    return sum(os.path.getsize(path) for path in (db_path, f'{db_path}-wal') if os.path.exists(path))
@@ -20,18 +20,33 @@ if not User.objects.filter(username='inno').exists():
     print('Superuser created')
 "
 
+# Share live IoT state across all Gunicorn workers
+export IOT_LIVE_STATE_BACKEND=${IOT_LIVE_STATE_BACKEND:-shared_memory}
+if [ "$IOT_LIVE_STATE_BACKEND" = "broker" ]; then
+    echo "📡 Starting live state broker..."
+    python manage.py run_live_state_broker &
+fi
+
+# One process owns all database writes; workers hand it their batches
+export IOT_DB_WRITER=${IOT_DB_WRITER:-process}
+if [ "$IOT_DB_WRITER" = "process" ]; then
+    echo "💾 Starting database writer..."
+    rm -f ${IOT_DB_WRITER_SOCKET:-/tmp/iot_db_writer.sock}
+    python manage.py run_db_writer &
+    while [ ! -S ${IOT_DB_WRITER_SOCKET:-/tmp/iot_db_writer.sock} ]; do sleep 0.1; done
+fi
+
 # Find project name
 PROJECT_NAME=$(find . -name wsgi.py -exec dirname {} \; | xargs -I {} basename {})
 
 echo "📁 Detected project name: $PROJECT_NAME"
 
-# Start Gunicorn server (this blocks and keeps container running)
+# Start Gunicorn server with async Uvicorn workers (this blocks and keeps container running)
 echo "🌐 Starting Gunicorn server..."
-exec gunicorn ${PROJECT_NAME}.wsgi:application \
+exec gunicorn ${PROJECT_NAME}.asgi:application \
     --bind 0.0.0.0:8000 \
     --workers 2 \
-    --threads 2 \
-    --worker-connections 100 \
+    --worker-class uvicorn_worker.UvicornWorker \
     --max-requests 1000 \
     --timeout 30 \
     --preload \
@@ -1,10 +1,19 @@
 # gunicorn.conf.py
+import os
+import shutil
+
 bind = "0.0.0.0:8000"
 workers = 2
-worker_class = "sync"
+worker_class = "uvicorn_worker.UvicornWorker"
 worker_connections = 1000
 timeout = 60
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 100
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+
+def on_starting(server):
+    # Per-worker metric files from a previous run would be summed into
+    # /metrics (see api.metrics) - counters start from zero on every start
+    shutil.rmtree(os.environ.get('IOT_METRICS_DIR', '/dev/shm/iot_metrics'), ignore_errors=True)